@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import stat
+import errno
+import ctypes
+import shutil
+import hashlib
+from datetime import datetime
+from raws import lock
+
+
+
+class backupstore(object):
+    '''Keeps snapshots of a directory, such as the raws input directory, within a
+    backup directory. The contents of each file are stored once as a blob named by
+    their hash, so a file which is the same in many snapshots only takes up space
+    once. Each snapshot is a directory tree of hard links to those blobs, so that it
+    can be browsed like an ordinary copy, along with an index recording the hash,
+    size, and modification time of every file in it.
+
+    Files whose size and modification time are the same as in the latest snapshot
+    aren't read again, and when nothing at all has changed no new snapshot is made.
+    Making a backup when nothing has changed therefore takes hardly any time or
+    space. Blobs are made read-only so that editing a file within a snapshot can't
+    change what other snapshots contain. Restored files are always copies, since
+    they're bound to be changed. The store is locked while it's used, so that
+    processes backing up to the same directory wait for each other rather than
+    removing each other's blobs or temporary files.
+
+    Example usage:
+        >>> store = backupstore('rawbak')
+        >>> name = store.snapshot('raw/objects', keep=10)
+        >>> store.restore('raw/objects', name)
+    '''
+
+    # Snapshots written with a different format are ignored
+    format = 1
+
+    # Format used for naming snapshots by when they were made, such that sorting their
+    # names also sorts them by time
+    nameformat = '%Y.%m.%d.%H.%M.%S'
+
+    def __init__(self, path):
+        '''Constructs a backupstore object for the backup directory at path. The
+        directory is created if it doesn't exist already.'''
+        self.path = path
+        self.blobspath = os.path.join(path, 'blobs')
+        self.snapshotspath = os.path.join(path, 'snapshots')
+        self.temppath = os.path.join(path, 'tmp')
+        for dirpath in (self.blobspath, self.snapshotspath, self.temppath):
+            if not os.path.isdir(dirpath): os.makedirs(dirpath)
+        self.lock = lock(os.path.join(path, 'lock'))
+
+    def locked(method):
+        # Utility function for wrapping methods which use the store, so that they hold its
+        # lock while they do
+        def lockedmethod(self, *args, **kwargs):
+            with self.lock: return method(self, *args, **kwargs)
+        lockedmethod.__name__ = method.__name__
+        lockedmethod.__doc__ = method.__doc__
+        return lockedmethod
+
+    def blobpath(self, digest):
+        # Utility method for getting the path of the blob with some hash
+        return os.path.join(self.blobspath, digest[:2], digest[2:])
+    def indexpath(self, name):
+        # Utility method for getting the path of the index of a snapshot
+        return os.path.join(self.snapshotspath, '%s.json' % name)
+
+    def snapshots(self):
+        '''Gets the names of all complete snapshots, oldest first.'''
+        return sorted(
+            filename[:-5] for filename in os.listdir(self.snapshotspath)
+            if filename.endswith('.json') and os.path.isfile(os.path.join(self.snapshotspath, filename))
+        )
+    def latest(self):
+        '''Gets the name of the most recent snapshot, or None if there aren't any.'''
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+    def index(self, name):
+        '''Gets the index of a snapshot as a tuple containing a dict mapping paths
+        of files relative to the directory, using / as a separator, to (hash, size,
+        modification time) tuples and a list of the relative paths of directories.
+        Returns None if the snapshot doesn't exist or its index can't be read.'''
+        try:
+            with open(self.indexpath(name), 'rb') as indexfile:
+                data = json.load(indexfile)
+            if data.get('format') != backupstore.format: return None
+            files = {str(path): (str(entry[0]), entry[1], entry[2]) for path, entry in data['files'].iteritems()}
+            return files, [str(path) for path in data['dirs']]
+        except (OSError, IOError, ValueError, TypeError, KeyError, AttributeError, IndexError):
+            return None
+
+    @locked
+    def snapshot(self, source, keep=None, log=None):
+        '''Makes a snapshot of the directory at source and returns its name. If
+        nothing has changed since the latest snapshot then none is made, and the
+        name of the latest snapshot is returned instead.
+
+        keep: If given, only this many of the most recent snapshots are kept, and
+            older ones are removed along with blobs no other snapshot refers to.
+        '''
+        latest = self.latest()
+        previous = self.index(latest) if latest is not None else None
+        previousfiles = previous[0] if previous is not None else {}
+        files, dirs = {}, []
+        stored = 0
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            reldir = os.path.relpath(dirpath, source)
+            if reldir != os.curdir: dirs.append(reldir.replace(os.sep, '/'))
+            for filename in sorted(filenames):
+                filepath = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(filepath, source).replace(os.sep, '/')
+                filestat = os.stat(filepath)
+                entry = previousfiles.get(relpath)
+                # Files which look the same as last time are trusted to have the same contents.
+                # Restored files have their modification times set only to the microsecond, so
+                # those may differ from what was recorded by a little less than that.
+                if entry is not None and entry[1] == filestat.st_size and abs(entry[2] - filestat.st_mtime) < 0.001 and os.path.isfile(self.blobpath(entry[0])):
+                    files[relpath] = entry
+                else:
+                    files[relpath] = (self.store(filepath), filestat.st_size, filestat.st_mtime)
+                    stored += 1
+        if previous is not None and (files, dirs) == previous:
+            if log: log.debug('Nothing changed since snapshot %s.' % latest)
+            name = latest
+        else:
+            name = self.newname()
+            if log: log.debug('Making snapshot %s of %d files, %d of which were stored anew.' % (name, len(files), stored))
+            self.maketree(name, files, dirs)
+            self.writeindex(name, files, dirs)
+        if keep is not None: self.prune(keep, log)
+        return name
+
+    @locked
+    def restore(self, target, name=None, log=None):
+        '''Restores a snapshot, by default the latest one, to the directory at target,
+        replacing whatever is there. The snapshot is first put together in a staging
+        directory next to the target, which then takes the target's place, so that
+        the target is never left partly restored. Where the system can swap two
+        paths in one step, as Linux can, the target is replaced atomically.
+        Elsewhere the target is first renamed aside and the staging directory then
+        renamed in its place, so that for a moment between the two renames there's
+        nothing at all at target.
+
+        Restored files are copies of the stored blobs, never links to them, since
+        writing to a link would change the blob and with it every snapshot.
+        '''
+        if name is None: name = self.latest()
+        index = self.index(name) if name is not None else None
+        if index is None: raise ValueError('No snapshot named %s.' % name)
+        files, dirs = index
+        target = os.path.abspath(target)
+        staging = '%s.%d.restoring' % (target, os.getpid())
+        replaced = '%s.%d.replaced' % (target, os.getpid())
+        if log: log.debug('Restoring snapshot %s of %d files to %s.' % (name, len(files), target))
+        if os.path.exists(staging): removetree(staging)
+        os.makedirs(staging)
+        try:
+            for reldir in dirs: os.makedirs(os.path.join(staging, *reldir.split('/')))
+            for relpath, (digest, size, mtime) in files.iteritems():
+                filepath = os.path.join(staging, *relpath.split('/'))
+                self.linkblob(digest, mtime, filepath, link=False)
+        except:
+            removetree(staging)
+            raise
+        try:
+            exchanged = os.path.exists(target) and exchangepaths(staging, target)
+        except:
+            removetree(staging)
+            raise
+        if exchanged:
+            # The staging directory now holds what used to be at target
+            removetree(staging)
+        elif os.path.exists(target):
+            os.rename(target, replaced)
+            try:
+                os.rename(staging, target)
+            except:
+                os.rename(replaced, target)
+                raise
+            removetree(replaced)
+        else:
+            os.rename(staging, target)
+
+    @locked
+    def prune(self, keep, log=None):
+        '''Removes all but the given number of most recent snapshots, and then the
+        blobs which none of the remaining snapshots refer to.'''
+        snapshots = self.snapshots()
+        # The most recent snapshot is always kept
+        for name in snapshots[:max(0, len(snapshots) - max(1, keep))]:
+            if log: log.debug('Removing old snapshot %s.' % name)
+            # The index goes first, so that a snapshot is never complete without its tree
+            os.remove(self.indexpath(name))
+            treepath = os.path.join(self.snapshotspath, name)
+            if os.path.exists(treepath): removetree(treepath)
+        self.collect(log)
+    @locked
+    def collect(self, log=None):
+        '''Removes blobs which no snapshot refers to, along with anything left over
+        from snapshots which were never finished. If the index of any snapshot
+        can't be read then there's no telling which blobs it refers to, and so no
+        blobs are removed at all.'''
+        snapshots = self.snapshots()
+        referenced = set()
+        unreadable = []
+        for name in snapshots:
+            index = self.index(name)
+            if index is not None:
+                referenced.update(entry[0] for entry in index[0].itervalues())
+            else:
+                unreadable.append(name)
+        if unreadable:
+            if log: log.debug('Keeping all blobs, since the index of snapshot %s can\'t be read.' % unreadable[0])
+        else:
+            for prefix in os.listdir(self.blobspath):
+                prefixpath = os.path.join(self.blobspath, prefix)
+                if not os.path.isdir(prefixpath): continue
+                for filename in os.listdir(prefixpath):
+                    if prefix + filename not in referenced:
+                        if log: log.debug('Removing unused blob %s.' % (prefix + filename))
+                        removefile(os.path.join(prefixpath, filename))
+        for filename in os.listdir(self.snapshotspath):
+            treepath = os.path.join(self.snapshotspath, filename)
+            if os.path.isdir(treepath) and filename not in snapshots: removetree(treepath)
+        # Temporary files are only made while the store is locked and are removed as soon as
+        # they're done with, so any found now were left by a process which was interrupted
+        for filename in os.listdir(self.temppath):
+            removefile(os.path.join(self.temppath, filename))
+
+    def store(self, filepath):
+        # Utility method for storing the contents of a file as a blob, if there isn't one
+        # with the same contents already, and getting its hash. The file is hashed while
+        # it's copied, so that the blob is sure to match its name.
+        digest = hashlib.sha1()
+        temppath = os.path.join(self.temppath, '%d.tmp' % os.getpid())
+        with open(filepath, 'rb') as source:
+            with open(temppath, 'wb') as blob:
+                while True:
+                    chunk = source.read(65536)
+                    if not chunk: break
+                    digest.update(chunk)
+                    blob.write(chunk)
+        digest = digest.hexdigest()
+        blobpath = self.blobpath(digest)
+        if os.path.exists(blobpath):
+            os.remove(temppath)
+        else:
+            if not os.path.isdir(os.path.dirname(blobpath)): os.makedirs(os.path.dirname(blobpath))
+            os.rename(temppath, blobpath)
+            os.chmod(blobpath, stat.S_IREAD)
+        return digest
+
+    def maketree(self, name, files, dirs):
+        # Utility method for making the directory tree of a snapshot out of links to blobs,
+        # or copies of them where links aren't supported
+        treepath = os.path.join(self.snapshotspath, name)
+        for reldir in dirs: os.makedirs(os.path.join(treepath, *reldir.split('/')))
+        if not os.path.isdir(treepath): os.makedirs(treepath)
+        for relpath, (digest, size, mtime) in files.iteritems():
+            self.linkblob(digest, mtime, os.path.join(treepath, *relpath.split('/')))
+    def linkblob(self, digest, mtime, filepath, link=True):
+        # Utility method for putting a blob at some path as a link to it, or as a copy with
+        # the original modification time if link is False or links aren't supported
+        if link:
+            try:
+                os.link(self.blobpath(digest), filepath)
+                return
+            except (AttributeError, OSError):
+                pass
+        shutil.copyfile(self.blobpath(digest), filepath)
+        os.utime(filepath, (mtime, mtime))
+    def writeindex(self, name, files, dirs):
+        # Utility method for writing the index of a snapshot, which is written last so that
+        # snapshots are only listed once they're complete
+        indexpath = self.indexpath(name)
+        temppath = '%s.%d.tmp' % (indexpath, os.getpid())
+        with open(temppath, 'wb') as indexfile:
+            json.dump({'format': backupstore.format, 'files': files, 'dirs': dirs}, indexfile, indent=4, sort_keys=True)
+        os.rename(temppath, indexpath)
+    def newname(self):
+        # Utility method for naming a new snapshot by the current time
+        name = datetime.now().strftime(backupstore.nameformat)
+        snapshots = set(self.snapshots())
+        uniquename, count = name, 1
+        while uniquename in snapshots or os.path.exists(os.path.join(self.snapshotspath, uniquename)):
+            count += 1
+            uniquename = '%s.%d' % (name, count)
+        return uniquename
+
+    del locked
+
+
+
+def removefile(path):
+    # Remove a file, even if it's read-only
+    os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+    os.remove(path)
+
+# Flags for swapping two paths with renameat2, where it's available
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+def exchangepaths(source, target):
+    # Swap what's at two paths in one step, so that neither is missing at any moment.
+    # Returns False without changing anything where the system or file system can't.
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError, TypeError):
+        return False
+    # Unicode paths would be passed as wide strings, which renameat2 doesn't take
+    encoding = sys.getfilesystemencoding() or 'utf-8'
+    if isinstance(source, unicode): source = source.encode(encoding)
+    if isinstance(target, unicode): target = target.encode(encoding)
+    if renameat2(AT_FDCWD, source, AT_FDCWD, target, RENAME_EXCHANGE) == 0: return True
+    error = ctypes.get_errno()
+    if error in (errno.ENOSYS, errno.EINVAL, errno.EPERM, errno.ENOTSUP): return False
+    raise OSError(error, os.strerror(error), target)
+
+def removetree(path):
+    # Remove a directory tree, even if it contains read-only files
+    def onerror(function, path, excinfo):
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        function(path)
+    shutil.rmtree(path, onerror=onerror)
@@ -0,0 +1,497 @@
+import os
+import sys
+import gc
+import time
+import shutil
+import itertools
+import argparse
+import tempfile
+import multiprocessing
+import raws
+
+
+
+__version__ = '1.0.0'
+
+
+
+# Raws bundled with the scripts in this repository, used when no input directory is given
+bundledroot = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+
+
+def rawspaths(root):
+    # Get paths to every raws file in a directory or, recursively, in its subdirectories
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.txt'): paths.append(os.path.join(dirpath, filename))
+    return paths
+
+def readdata(paths):
+    # Read the contents of raws files in the same way rawsfile does, skipping files without tokens
+    data = []
+    for path in paths:
+        with open(path, 'rb') as rfile:
+            rfile.readline()
+            content = rfile.read()
+        if '[' in content: data.append(content)
+    return data
+
+def timed(function, repeat):
+    # Run some function repeatedly and return the best time along with its last result
+    best, result = None, None
+    for i in xrange(0, repeat):
+        start = time.time()
+        result = function()
+        duration = time.time() - start
+        if best is None or duration < best: best = duration
+    return best, result
+
+def report(name, before, after):
+    print '%s: %.3fs before, %.3fs after, %.2fx speedup.' % (name, before, after, before / after if after else float('inf'))
+
+
+
+def legacyparse(data):
+    # The find-and-slice parser which rawstoken.parse used before adopting a compiled pattern
+    tokens = raws.tokenlist()
+    pos = 0
+    while pos < len(data):
+        token = None
+        open = data.find('[', pos)
+        if open >= 0 and open < len(data):
+            close = data.find(']', open)
+            if close >= 0 and close < len(data):
+                prefix = data[pos:open]
+                tokentext = data[open+1:close]
+                tokenparts = tokentext.split(':')
+                token = raws.token(
+                    value=tokenparts[0],
+                    args=tokenparts[1:],
+                    prefix=prefix,
+                    prev=tokens[-1] if len(tokens) else None
+                )
+                pos = close+1
+        if token:
+            if len(tokens): tokens[-1].next = token
+            tokens.append(token)
+        else:
+            break
+    if len(tokens) and pos<len(data):
+        tokens[-1].suffix = data[pos:]
+    return tokens
+
+def samestream(atokens, btokens):
+    # Check that two parsed token lists are identical, formatting included
+    if len(atokens) != len(btokens): return False
+    for a, b in zip(atokens, btokens):
+        if (a.value, list(a.args), a.prefix, a.suffix) != (b.value, list(b.args), b.prefix, b.suffix): return False
+    return True
+
+def benchparse(paths, args):
+    '''Compares the legacy parser against rawstoken.parse.'''
+    data = readdata(paths)
+    legacytime, legacyresult = timed(lambda: [legacyparse(content) for content in data], args.repeat)
+    parsetime, parseresult = timed(lambda: [raws.token.parse(content, implicit_braces=False) for content in data], args.repeat)
+    if not all(samestream(a, b) for a, b in zip(legacyresult, parseresult)): raise ValueError('Token streams differ.')
+    print 'Parsed %d tokens in %d files.' % (sum(len(tokens) for tokens in parseresult), len(data))
+    report('parse', legacytime, parsetime)
+
+
+
+class dicttoken(object):
+    # Stand-in with the layout rawstoken had before it used slots, attributes in an instance dict
+    def __init__(self, token):
+        self.prev = token.prev
+        self.next = token.next
+        self.value = token.value
+        self.args = token.args
+        self.prefix = token.prefix
+        self.suffix = token.suffix
+        self.removed = token.removed
+        self.file = token.file
+
+def tokenbytes(token):
+    # Bytes belonging to one token object, not counting strings which may be shared
+    if isinstance(token, raws.token):
+        # Arguments which haven't been split yet are held as a single string instead of a list
+        args = token.argstext if token.argslist is None else token.argslist
+        size = sys.getsizeof(token)
+        if args is not None: size += sys.getsizeof(args)
+        if token.offset is not None: size += sys.getsizeof(token.offset)
+        return size
+    else:
+        return sys.getsizeof(token) + sys.getsizeof(token.args) + sys.getsizeof(vars(token))
+
+def benchmemory(paths, args):
+    '''Reports the number of bytes used per token for the dict and slots layouts, the
+    latter with arguments left unsplit as they are until first accessed.'''
+    data = readdata(paths)
+    parsed = [raws.token.parse(content, implicit_braces=False) for content in data]
+    tokens = [token for tokens in parsed for token in tokens]
+    after = sum(tokenbytes(token) for token in tokens)
+    before = sum(tokenbytes(dicttoken(token)) for token in tokens)
+    print 'Measured %d tokens in %d files.' % (len(tokens), len(data))
+    print 'memory: %.1f bytes per token before, %.1f bytes per token after, %.1f%% saved.' % (
+        float(before) / len(tokens), float(after) / len(tokens), 100.0 * (before - after) / before
+    )
+    references, unique, saved = raws.strings.stats(tokens)
+    print 'strings: %d references to %d distinct strings, %.1f bytes per token saved by interning.' % (
+        references, unique, float(saved) / len(tokens)
+    )
+
+
+
+def rawsdirs(paths):
+    # Get the directories containing some raws files which can be loaded as a rawsdir
+    dirs = []
+    for dirpath in sorted(set(os.path.dirname(path) for path in paths)):
+        try:
+            raws.dir(path=dirpath)
+            dirs.append(dirpath)
+        except ValueError:
+            pass
+    return dirs
+
+def benchload(paths, args):
+    '''Compares reading directories in one process against reading them with a pool.'''
+    dirs = rawsdirs(paths)
+    processes = args.processes
+    serialtime, serialresult = timed(lambda: [raws.dir(path=dirpath) for dirpath in dirs], args.repeat)
+    pooltime, poolresult = timed(lambda: [raws.dir(path=dirpath, processes=processes) for dirpath in dirs], args.repeat)
+    for a, b in zip(serialresult, poolresult):
+        if a.files.keys() != b.files.keys() or any(repr(a.files[name]) != repr(b.files[name]) for name in a.files):
+            raise ValueError('Loaded raws differ.')
+    print 'Loaded %d directories using %d processes.' % (len(dirs), processes)
+    report('load', serialtime, pooltime)
+
+
+
+def benchcache(paths, args):
+    '''Compares reading directories without a cache against reading them with a warm cache.'''
+    dirs = rawsdirs(paths)
+    cachepath = tempfile.mkdtemp()
+    try:
+        cache = raws.cache(cachepath)
+        for dirpath in dirs: raws.dir(path=dirpath, cache=cache)
+        uncachedtime, uncachedresult = timed(lambda: [raws.dir(path=dirpath) for dirpath in dirs], args.repeat)
+        cachedtime, cachedresult = timed(lambda: [raws.dir(path=dirpath, cache=cache) for dirpath in dirs], args.repeat)
+    finally:
+        shutil.rmtree(cachepath)
+    for a, b in zip(uncachedresult, cachedresult):
+        if any(repr(a.files[name]) != repr(b.files[name]) for name in a.files): raise ValueError('Loaded raws differ.')
+    print 'Loaded %d directories, cache had %d hits and %d misses.' % (len(dirs), cache.hits, cache.misses)
+    report('cache', uncachedtime, cachedtime)
+
+
+
+def benchindex(paths, args):
+    '''Compares looking up tokens by value by checking every token against looking them
+    up using the value index, not counting the one time cost of building the index.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    values = ('TILE', 'NAME', 'REACTION', 'CREATURE', 'INORGANIC', 'COLOR', 'BODY', 'PRODUCT')
+    def scan(): return [[dir.all(exact_value=value, tokeniter=dir.tokens()) for value in values] for dir in loaded]
+    def lookup(): return [[dir.all(exact_value=value) for value in values] for dir in loaded]
+    start = time.time()
+    for dir in loaded:
+        for rfile in dir.files.itervalues(): rfile.getindex()
+    buildtime = time.time() - start
+    scantime, scanresult = timed(scan, args.repeat)
+    lookuptime, lookupresult = timed(lookup, args.repeat)
+    if scanresult != lookupresult: raise ValueError('Query results differ.')
+    print 'Queried %d directories for %d values, building indexes took %.3fs.' % (len(loaded), len(values), buildtime)
+    report('index', scantime, lookuptime)
+
+
+
+def legacygetobj(dir, type, id):
+    # The way getobj used to find objects, by checking every token following each file's OBJECT token
+    for objecttoken in dir.getobjheaders(type):
+        obj = objecttoken.get(exact_value=type, exact_args=(id,), tokeniter=objecttoken.tokens())
+        if obj: return obj
+    return None
+
+def benchobj(paths, args):
+    '''Compares finding every object by checking tokens one by one against finding them
+    using the object index.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    types = ('CREATURE', 'INORGANIC', 'REACTION', 'ENTITY', 'BUILDING_WORKSHOP', 'ITEM_WEAPON')
+    lookups = [(dir, type, obj.args[0]) for dir in loaded for type in types for obj in dir.allobj(type)]
+    scantime, scanresult = timed(lambda: [legacygetobj(dir, type, id) for dir, type, id in lookups], args.repeat)
+    lookuptime, lookupresult = timed(lambda: [dir.getobj(type=type, exact_id=id) for dir, type, id in lookups], args.repeat)
+    if any(a is not b for a, b in zip(scanresult, lookupresult)): raise ValueError('Objects differ.')
+    print 'Looked up %d objects.' % len(lookups)
+    report('obj', scantime, lookuptime)
+
+
+
+def benchprop(paths, args):
+    '''Compares property queries which check every token up to the next object against
+    those which look only at the object's own tokens using the index.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    types = ('CREATURE', 'INORGANIC', 'REACTION', 'ENTITY', 'BUILDING_WORKSHOP', 'ITEM_WEAPON')
+    objs = [obj for dir in loaded for type in types for obj in dir.allobj(type)]
+    # Passing an argument meant for the tokens method makes the queries go the old way
+    scantime, scanresult = timed(lambda: [(obj.getprop('NAME', include_self=False), obj.getlastprop('TILE', include_self=False), obj.allprop(include_self=False)) for obj in objs], args.repeat)
+    proptime, propresult = timed(lambda: [(obj.getprop('NAME'), obj.getlastprop('TILE'), obj.allprop()) for obj in objs], args.repeat)
+    if scanresult != propresult: raise ValueError('Properties differ.')
+    print 'Queried properties of %d objects.' % len(objs)
+    report('prop', scantime, proptime)
+
+
+
+def benchplan(paths, args):
+    '''Compares queries which check every token in their scope against those planned
+    to look tokens up by value or object id where that's expected to be cheaper.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    types = ('CREATURE', 'INORGANIC', 'REACTION', 'ENTITY', 'BUILDING_WORKSHOP', 'ITEM_WEAPON')
+    objs = [(dir, obj) for dir in loaded for type in types for obj in dir.allobj(type)]
+    # Giving a tokeniter makes the queries check every token the way they used to
+    scantime, scanresult = timed(lambda: [(
+        obj.getuntil('TILE', obj.value, tokeniter=obj.tokens()),
+        obj.alluntil(value_in=('NAME', 'STATE_NAME_ADJ'), until_exact_value=obj.value, tokeniter=obj.tokens()),
+        dir.get(exact_value=obj.value, exact_args=obj.args, tokeniter=dir.tokens()),
+        obj.get('TILE', tokeniter=obj.tokens())
+    ) for dir, obj in objs], args.repeat)
+    plantime, planresult = timed(lambda: [(
+        obj.getuntil('TILE', obj.value),
+        obj.alluntil(value_in=('NAME', 'STATE_NAME_ADJ'), until_exact_value=obj.value),
+        dir.get(exact_value=obj.value, exact_args=obj.args),
+        obj.get('TILE')
+    ) for dir, obj in objs], args.repeat)
+    if scanresult != planresult: raise ValueError('Query results differ.')
+    print 'Ran 4 queries for each of %d objects.' % len(objs)
+    report('plan', scantime, plantime)
+
+
+
+def benchhas(paths, args):
+    '''Compares checking whether objects have properties, which they mostly don't, by
+    checking every token up to the next object against using summaries of the values
+    of each object's properties.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    types = ('CREATURE', 'INORGANIC', 'REACTION', 'ENTITY', 'BUILDING_WORKSHOP', 'ITEM_WEAPON')
+    objs = [obj for dir in loaded for type in types for obj in dir.allobj(type)]
+    props = ('IS_GEM', 'IS_STONE', 'REACTION_CLASS:FLUX', 'PERMITTED_JOB:MINER', 'SKILL_RUST_RATES', 'FLIER', 'CREATURE_TILE')
+    # Passing an argument meant for the tokens method makes the queries go the old way
+    scantime, scanresult = timed(lambda: [[obj.getprop(prop, include_self=False) for prop in props] for obj in objs], args.repeat)
+    hastime, hasresult = timed(lambda: [[obj.getprop(prop) for prop in props] for obj in objs], args.repeat)
+    if scanresult != hasresult: raise ValueError('Properties differ.')
+    if [obj for obj in objs if obj.getprop('IS_STONE')] != [obj for dir in loaded for type in types for obj in dir.allobj(type, has='IS_STONE')]:
+        raise ValueError('Objects differ.')
+    print 'Checked %d properties of %d objects.' % (len(props), len(objs))
+    report('has', scantime, hastime)
+
+
+
+def benchargs(paths, args):
+    '''Compares queries for tokens with some argument which check every token against
+    those which look them up in an index of arguments.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    ids = sorted(set(obj.args[0] for dir in loaded for type in ('INORGANIC', 'CREATURE', 'REACTION') for obj in dir.allobj(type)))[::20]
+    def query():
+        return [(dir.all(args_contains=id), dir.all(exact_arg=((0, id),)), dir.get(exact_args=('NONE', id))) for dir in loaded for id in ids]
+    scantime, scanresult = timed(query, args.repeat)
+    start = time.time()
+    for dir in loaded:
+        dir.indexargs()
+        for rfile in dir.files.itervalues(): rfile.getargsindex()
+    indextime = time.time() - start
+    argstime, argsresult = timed(query, args.repeat)
+    if scanresult != argsresult: raise ValueError('Query results differ.')
+    print 'Queried %d directories for %d ids, building indexes took %.3fs.' % (len(loaded), len(ids), indextime)
+    report('args', scantime, argstime)
+
+
+
+def benchquery(paths, args):
+    '''Compares calling quick query methods for every object, which sets up the query
+    anew each time, against preparing the queries once and running them for every object.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    types = ('CREATURE', 'INORGANIC', 'REACTION', 'ENTITY', 'BUILDING_WORKSHOP', 'ITEM_WEAPON')
+    objs = [obj for dir in loaded for type in types for obj in dir.allobj(type)]
+    skills = ('SKILL_RATE', 'SKILL_RUST_RATE', 'SKILL_RATES', 'SKILL_RUST_RATES')
+    calltime, callresult = timed(lambda: [(
+        obj.allprop(value_in=skills), obj.getprop('NAME'), obj.getprop(re_value='.*TILE', args_count=1)
+    ) for obj in objs], args.repeat)
+    queries = (
+        raws.query('allprop', value_in=skills), raws.query('getprop', 'NAME'), raws.query('getprop', re_value='.*TILE', args_count=1)
+    )
+    preparedtime, preparedresult = timed(lambda: [tuple(query(obj) for query in queries) for obj in objs], args.repeat)
+    if callresult != preparedresult: raise ValueError('Query results differ.')
+    print 'Ran %d queries for each of %d objects.' % (len(queries), len(objs))
+    report('query', calltime, preparedtime)
+
+
+
+def benchlazy(paths, args):
+    '''Compares getting the first few matches and counting matches using lists of all
+    matching tokens against iterating through them only as far as needed.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    values = ('BODY', 'TILE', 'NAME', 'REACTION_CLASS', 'ENVIRONMENT', 'PERMITTED_JOB')
+    eagertime, eagerresult = timed(lambda: [
+        (dir.all(value)[:3], len(dir.all(value)), dir.allobj('CREATURE')[:3]) for dir in loaded for value in values
+    ], args.repeat)
+    lazytime, lazyresult = timed(lambda: [
+        (list(itertools.islice(dir.iterall(value), 3)), dir.count(value), list(itertools.islice(dir.iterallobj('CREATURE'), 3)))
+        for dir in loaded for value in values
+    ], args.repeat)
+    if eagerresult != lazyresult: raise ValueError('Query results differ.')
+    print 'Ran 3 queries for each of %d values in %d directories.' % (len(values), len(loaded))
+    report('lazy', eagertime, lazytime)
+
+
+
+def benchmemo(paths, args):
+    '''Compares repeating the same queries, the way several scripts run in one session
+    do, against remembering their results in a rawsquerycache until tokens change.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    types = ('CREATURE', 'INORGANIC', 'REACTION', 'ENTITY', 'BUILDING_WORKSHOP', 'ITEM_WEAPON')
+    def query():
+        return [(
+            [dir.allobj(type) for type in types], dir.all(exact_value='REACTION'), dir.all(re_value='ITEM_.+'),
+            [obj.getprop('NAME') for obj in dir.allobj('INORGANIC', has='IS_STONE')]
+        ) for dir in loaded]
+    uncachedtime, uncachedresult = timed(query, args.repeat)
+    for dir in loaded: dir.cachequeries()
+    cachedtime, cachedresult = timed(query, args.repeat)
+    if uncachedresult != cachedresult: raise ValueError('Query results differ.')
+    hits = sum(dir.querycache.hits for dir in loaded)
+    misses = sum(dir.querycache.misses for dir in loaded)
+    print 'Repeated queries on %d directories, the cache had %d hits and %d misses.' % (len(loaded), hits, misses)
+    report('memo', uncachedtime, cachedtime)
+
+
+
+def legacyquery(filters, tokeniter):
+    # The way rawsqueryable.query used to check every token against every filter
+    for filter in filters: filter.result = raws.tokenlist()
+    limit = False
+    for token in tokeniter:
+        for filter in filters:
+            if (not filter.limit) or len(filter.result) < filter.limit:
+                if filter.match(token): filter.result.append(token)
+                if filter.limit_terminates and len(filter.result) == filter.limit: limit = True; break
+        if limit: break
+    return [filter.result for filter in filters]
+
+def benchmulti(paths, args):
+    '''Compares queries with many filters which check every token against every filter
+    against those which check tokens only against filters which could match their values.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    objs = [obj for dir in loaded for type in ('INORGANIC', 'CREATURE') for obj in dir.allobj(type)]
+    values = ('IS_STONE', 'IS_GEM', 'METAL_ORE', 'SOIL', 'SOIL_SAND', 'SOIL_OCEAN', 'METAMORPHIC', 'SEDIMENTARY', 'IGNEOUS_ALL',
+        'IGNEOUS_EXTRUSIVE', 'IGNEOUS_INTRUSIVE', 'AQUIFER', 'TILE', 'ITEM_SYMBOL', 'DISPLAY_COLOR', 'BASIC_COLOR', 'TILE_COLOR', 'CREATURE_TILE')
+    filters = [raws.tokenfilter(exact_value=value, limit=1, limit_terminates=False) for value in values]
+    filters += [raws.tokenfilter(pretty='REACTION_CLASS:FLUX', limit=1, limit_terminates=False), raws.tokenfilter(exact_value='ENVIRONMENT'), raws.tokenfilter(exact_value='STATE_COLOR')]
+    def query(obj):
+        end = raws.tokenfilter(exact_value=obj.value, limit=1)
+        return [filter.result for filter in obj.query(filters + [end])]
+    legacytime, legacyresult = timed(lambda: [legacyquery(filters + [raws.tokenfilter(exact_value=obj.value, limit=1)], obj.tokens()) for obj in objs], args.repeat)
+    querytime, queryresult = timed(lambda: [query(obj) for obj in objs], args.repeat)
+    if legacyresult != queryresult: raise ValueError('Query results differ.')
+    print 'Queried %d filters for each of %d objects.' % (len(filters) + 1, len(objs))
+    report('multi', legacytime, querytime)
+
+
+
+def legacywrite(rfile, stream):
+    # The way rawsfile.write used to render every token regardless of whether it changed
+    stream.write(rfile.headertext())
+    stream.write(''.join([repr(token) for token in rfile.tokens()]))
+
+def benchwrite(paths, args):
+    '''Compares rendering every token when writing files against copying the text of
+    unchanged tokens from the original data, with one token in each file modified.'''
+    files = [rfile for dirpath in rawsdirs(paths) for rfile in raws.dir(path=dirpath).files.itervalues()]
+    for rfile in files:
+        root = rfile.root()
+        if root is not None and root.next is not None: root.next.prefix = '\n\t'
+    with open(os.devnull, 'wb') as stream:
+        legacytime, legacyresult = timed(lambda: [legacywrite(rfile, stream) for rfile in files], args.repeat)
+        writetime, writeresult = timed(lambda: [rfile.write(stream) for rfile in files], args.repeat)
+    if any(rfile.body() != ''.join([repr(token) for token in rfile.tokens()]) for rfile in files): raise ValueError('Written raws differ.')
+    print 'Wrote %d files.' % len(files)
+    report('write', legacytime, writetime)
+
+
+
+def benchflush(paths, args):
+    '''Compares writing directories to disk one file after another against writing
+    their files using a pool of threads.'''
+    loaded = [raws.dir(path=dirpath) for dirpath in rawsdirs(paths)]
+    for dir in loaded:
+        for rfile in dir.files.itervalues():
+            root = rfile.root()
+            if root is not None and root.next is not None: root.next.prefix = '\n\t'
+    threads = args.processes
+    outputpath = tempfile.mkdtemp()
+    try:
+        outputs = [os.path.join(outputpath, str(index)) for index in xrange(len(loaded))]
+        for output in outputs: os.makedirs(output)
+        serialtime, serialresult = timed(lambda: [dir.write(output) for dir, output in zip(loaded, outputs)], args.repeat)
+        serialdata = [readdata(rawspaths(output)) for output in outputs]
+        pooltime, poolresult = timed(lambda: [dir.write(output, threads=threads) for dir, output in zip(loaded, outputs)], args.repeat)
+        pooldata = [readdata(rawspaths(output)) for output in outputs]
+    finally:
+        shutil.rmtree(outputpath)
+    if serialdata != pooldata: raise ValueError('Written raws differ.')
+    print 'Wrote %d directories using %d threads.' % (len(loaded), threads)
+    report('flush', serialtime, pooltime)
+
+
+
+def benchgc(paths, args):
+    '''Reports whether discarded raws were freed without help from the cyclic garbage
+    collector, and how long it took to clean up after them.'''
+    dirs = rawsdirs(paths)
+    gc.collect()
+    loaded = [raws.dir(path=dirpath) for dirpath in dirs]
+    start = time.time()
+    del loaded
+    freetime = time.time() - start
+    start = time.time()
+    collected = gc.collect()
+    collecttime = time.time() - start
+    print 'Discarded %d directories in %.3fs, then the collector found %d unreachable objects in %.3fs.' % (
+        len(dirs), freetime, collected, collecttime
+    )
+
+
+
+benchmarks = {
+    'parse': benchparse,
+    'memory': benchmemory,
+    'load': benchload,
+    'cache': benchcache,
+    'gc': benchgc,
+    'index': benchindex,
+    'obj': benchobj,
+    'prop': benchprop,
+    'plan': benchplan,
+    'args': benchargs,
+    'has': benchhas,
+    'multi': benchmulti,
+    'query': benchquery,
+    'lazy': benchlazy,
+    'memo': benchmemo,
+    'write': benchwrite,
+    'flush': benchflush
+}
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', help='run only these benchmarks', nargs='*', type=str)
+    parser.add_argument('-i', '--input', help='raws input directory, defaults to the raws bundled with scripts', type=str, default=bundledroot)
+    parser.add_argument('-r', '--repeat', help='run each benchmark this many times and report the best', type=int, default=3)
+    parser.add_argument('-p', '--processes', help='number of processes for benchmarks using a pool', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    paths = rawspaths(args.input)
+    for name in (args.benchmarks if args.benchmarks else sorted(benchmarks)):
+        benchmarks[name](paths, args)
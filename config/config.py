@@ -18,15 +18,23 @@ timestamp = datetime.now().strftime(datetimeformat)
 
 
 class config:
-    def __init__(self, version=None, input=None, output=None, backup=None, scripts=[], packages=[], verbose=False, log='logs/%s.txt' % timestamp):
+    def __init__(self, version=None, input=None, output=None, backup=None, scripts=[], packages=[], verbose=False, log='logs/%s.txt' % timestamp, jobs=None, threads=None, cache=None, querycache=None, incremental=False, manifest=False, backupkeep=None, atomic=False):
         self.version = version      # Dwarf Fortress version, for handling script compatibility metadata
         self.input = input          # Raws are loaded from this input directory
         self.output = output        # Raws are written to this output directory
         self.backup = backup        # Raws are backed up to this directory before any changes are made
+        self.backupkeep = backupkeep # Only this many of the most recent backups are kept, or all of them if None
         self.scripts = scripts      # These scripts are run in the order that they appear
         self.packages = packages    # These packages are imported (probably because they contain PyDwarf scripts)
         self.verbose = verbose      # Log DEBUG messages to stdout if True, otherwise only INFO and above
         self.log = log              # Log file goes here
+        self.jobs = jobs            # Parse raws up front using this many processes rather than lazily
+        self.threads = threads      # Write raws files using this many threads at once
+        self.cache = cache          # Results of parsing raws files are cached in this directory
+        self.querycache = querycache # Remember the results of up to this many queries made by scripts
+        self.incremental = incremental # Write only changed raws files rather than rewriting all of them
+        self.manifest = manifest    # Keep hashes of output files next to them and skip writing unchanged ones
+        self.atomic = atomic        # Write output files to a staging directory, then move them all into place
         
     def json(self, path, *args, **kwargs):
         with open(path, 'rb') as jsonfile: return self.apply(json.load(jsonfile), *args, **kwargs)
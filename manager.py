@@ -5,7 +5,7 @@ import importlib
 import pydwarf
 import raws
 from config import config
-from utils import copytree
+from backup import backupstore
 
 
 
@@ -62,6 +62,47 @@ def getconf(args=None):
 
 
 
+# Check an output directory against the manifest written along with it
+def verify(outputdir):
+    manifest = raws.manifest(outputdir)
+    if not manifest.files:
+        pydwarf.log.error('Found no manifest in output directory %s.' % outputdir)
+        return False
+    pydwarf.log.info('Verifying %d files in %s against their manifest.' % (len(manifest.files), outputdir))
+    missing, changed, unexpected = manifest.verify()
+    for filename in missing: pydwarf.log.error('File %s is missing.' % filename)
+    for filename in changed: pydwarf.log.error('File %s was changed since it was written.' % filename)
+    for filename in unexpected: pydwarf.log.error('File %s is not in the manifest.' % filename)
+    if missing or changed or unexpected:
+        pydwarf.log.error('Verification failed.')
+        return False
+    else:
+        pydwarf.log.info('All files match the manifest.')
+        return True
+
+
+
+# Restore the input directory from a backup
+def restore(conf, name=None):
+    if conf.backup is None:
+        pydwarf.log.error('No backup directory was specified.')
+        return False
+    store = backupstore(conf.backup)
+    if name is None: name = store.latest()
+    if name not in store.snapshots():
+        pydwarf.log.error('Found no backup %s in %s.' % (name, conf.backup) if name else 'Found no backups in %s.' % conf.backup)
+        return False
+    pydwarf.log.info('Restoring raws in %s from backup %s.' % (conf.input, name))
+    try:
+        store.restore(conf.input, name, log=pydwarf.log)
+    except Exception, e:
+        pydwarf.log.error('Failed to restore backup.\n%s' % e)
+        return False
+    pydwarf.log.info('All done!')
+    return True
+
+
+
 # Actually run the program
 def __main__(args=None):
     conf = getconf(args)
@@ -79,6 +120,10 @@ def __main__(args=None):
     elif args.meta is not None:
         pydwarf.urist.doclist(args.meta)
         exit(0)
+    elif args.verify:
+        exit(0 if verify(conf.output if conf.output else conf.input) else 1)
+    elif args.restore is not None:
+        exit(0 if restore(conf, args.restore if args.restore else None) else 1)
     
     # Verify that input directory exists
     if not os.path.exists(conf.input):
@@ -89,24 +134,33 @@ def __main__(args=None):
     if conf.backup is not None:
         pydwarf.log.info('Backing up raws to %s.' % conf.backup)
         try:
-            copytree(conf.input, conf.backup)
-        except:
-            pydwarf.log.error('Failed to create backup.')
+            name = backupstore(conf.backup).snapshot(conf.input, keep=conf.backupkeep, log=pydwarf.log)
+            pydwarf.log.debug('Raws are backed up as snapshot %s.' % name)
+        except Exception, e:
+            pydwarf.log.error('Failed to create backup.\n%s' % e)
             exit(1)
     else:
         pydwarf.log.warning('Proceeding without backing up raws.')
     
     # Read input raws
     pydwarf.log.info('Reading raws from input directory %s.' % conf.input)
-    pydwarf.urist.session.dfraws = raws.dir(path=conf.input, log=pydwarf.log)
+    cache = raws.cache(conf.cache) if conf.cache else None
+    pydwarf.urist.session.dfraws = raws.dir(path=conf.input, log=pydwarf.log, lazy=not conf.jobs, processes=conf.jobs, cache=cache)
+    if conf.querycache: pydwarf.urist.session.dfraws.cachequeries(maxsize=conf.querycache)
     
     # Run each script
     pydwarf.log.info('Running scripts.')
     pydwarf.urist.session.handleall(conf.scripts)
+    if cache: pydwarf.log.debug('Parse cache had %d hits and %d misses.' % (cache.hits, cache.misses))
+    querycache = pydwarf.urist.session.dfraws.querycache
+    if querycache is not None: pydwarf.log.debug('Query cache had %d hits and %d misses.' % (querycache.hits, querycache.misses))
     
     # Get the output directory, remove old raws if present
+    # When writing atomically, obsolete raws are instead removed once the new ones are in place
     outputdir = conf.output if conf.output else conf.input
-    if os.path.exists(outputdir):
+    if os.path.exists(outputdir) and (conf.incremental or conf.manifest or conf.atomic):
+        pydwarf.log.info('Replacing raws in %s once they are written.' % outputdir if conf.atomic else 'Keeping unchanged raws in %s.' % outputdir)
+    elif os.path.exists(outputdir):
         pydwarf.log.info('Removing obsolete raws from %s.' % outputdir)
         for removefile in [os.path.join(outputdir, f) for f in os.listdir(outputdir)]:
             pydwarf.log.debug('Removing file %s.' % removefile)
@@ -117,7 +171,9 @@ def __main__(args=None):
     
     # Write the output
     pydwarf.log.info('Writing changes to raws to %s.' % outputdir)
-    pydwarf.urist.session.dfraws.write(outputdir, pydwarf.log)
+    pydwarf.urist.session.dfraws.write(
+        outputdir, pydwarf.log, incremental=conf.incremental, threads=conf.threads, manifest=conf.manifest, atomic=conf.atomic
+    )
     
     # All done!
     pydwarf.log.info('All done!')
@@ -131,13 +187,23 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--input', help='raws input directory', type=str)
     parser.add_argument('-o', '--output', help='raws output directory', type=str)
     parser.add_argument('-b', '--backup', help='raws backup directory', type=str)
+    parser.add_argument('--backupkeep', help='keep only this many of the most recent backups', type=int)
     parser.add_argument('-s', '--scripts', help='run scripts by name or namespace', nargs='+', type=str)
     parser.add_argument('-p', '--packages', help='import packages containing PyDwarf scripts', nargs='+', type=str)
     parser.add_argument('-c', '--config', help='run with json config file if the extension is json, otherwise treat as a Python package, import, and override settings using export dict', type=str)
     parser.add_argument('-v', '--verbose', help='set stdout logging level to DEBUG', action='store_true')
     parser.add_argument('--log', help='output log file to path', type=str)
+    parser.add_argument('--cache', help='cache parsed raws in this directory to speed up later runs', type=str)
+    parser.add_argument('--querycache', help='remember the results of up to this many queries made by scripts until the raws they cover are changed', type=int)
+    parser.add_argument('--incremental', help='write only raws files which were changed or added and remove only those which were removed, leaving the rest of the output directory untouched', action='store_const', const=True)
+    parser.add_argument('--manifest', help='keep a manifest of hashes in the output directory and skip writing raws files whose contents are unchanged', action='store_const', const=True)
+    parser.add_argument('--atomic', help='write raws files to a staging directory first and then move them all into place, so that the output directory is left untouched if writing fails', action='store_const', const=True)
+    parser.add_argument('-j', '--jobs', help='parse all raws up front using this many processes instead of parsing files as they are needed', type=int)
+    parser.add_argument('-t', '--threads', help='write raws files using this many threads at once rather than one after another', type=int)
     parser.add_argument('--list', help='list available scripts', action='store_true')
     parser.add_argument('--meta', help='show metadata for scripts', nargs='*', type=str)
+    parser.add_argument('--restore', help='restore the raws input directory from the backup with this name, or the latest one if no name is given, instead of running scripts', nargs='?', const='', type=str)
+    parser.add_argument('--verify', help='check the output directory against its manifest instead of running scripts', action='store_true')
     args = parser.parse_args()
     
     __main__(args)
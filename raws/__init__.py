@@ -2,9 +2,16 @@ from filters import rawstokenfilter as tokenfilter
 from filters import rawsboolfilter as boolfilter
 from queryable import rawsqueryable as queryable
 from queryable import rawstokenlist as tokenlist
+from queryable import rawsquery as query
 from token import rawstoken as token
 from file import rawsfile as file
 from dir import rawsdir as dir
+from cache import rawscache as cache
+from querycache import rawsquerycache as querycache
+from manifest import rawsmanifest as manifest
+from index import rawsindex as index
+from lock import rawslock as lock
+import strings
 import color
 
 __version__ = '1.0.0'
@@ -0,0 +1,118 @@
+import os
+import errno
+import marshal
+import hashlib
+from token import rawstoken
+
+class rawscache(object):
+    '''Keeps parsed raws files in a directory on disk, in the compact form given by
+    rawstoken.pack, so that later runs can build their tokens without splitting the
+    text of files which haven't changed. An entry is only used when the hash of the
+    file's contents is the same as what was recorded, since a file can be changed
+    without its size or modification time changing, and tokens built from an old
+    entry would refer to the wrong text when written. Hashing is cheap next to
+    splitting, and files which were touched but not changed are still hits.
+
+    Entries aren't evicted as they're stored, which would mean checking every
+    entry for every file; rawsdir.read trims the cache once after reading.'''
+
+    # Entries written with a different format are ignored
+    format = 3
+
+    def __init__(self, path, maxsize=64*1024*1024):
+        '''Constructs a rawscache object.
+
+        path: Directory in which cache entries are stored. It's created if it doesn't
+            exist already.
+        maxsize: When entries in total take up more than this many bytes, the least
+            recently used ones are deleted.
+        '''
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path): os.makedirs(path)
+
+    def entrypath(self, path):
+        # Utility method for getting the path of the cache entry for a raws file
+        return os.path.join(self.path, '%s.cache' % hashlib.sha1(os.path.abspath(path)).hexdigest())
+    def entries(self):
+        # Utility method for getting the paths of all cache entries
+        return [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.cache')]
+
+    def get(self, path, data, digest=None):
+        '''Gets the packed tokens for the file at path, or None if there's no valid
+        entry for it. data must be the file's contents following the header line.
+        digest may be given as the SHA-1 hex digest of data, if it's known already.'''
+        entrypath = self.entrypath(path)
+        try:
+            with open(entrypath, 'rb') as entry:
+                format, entrydigest, packed = marshal.load(entry)
+        except (OSError, IOError, EOFError, ValueError, TypeError):
+            format = None
+        if format == rawscache.format:
+            if digest is None: digest = hashlib.sha1(data).hexdigest()
+            if entrydigest == digest:
+                os.utime(entrypath, None) # Entries are evicted in order of when they were last used
+                self.hits += 1
+                return packed
+        self.misses += 1
+        return None
+
+    def put(self, path, data, packed, digest=None):
+        '''Stores the packed tokens for the file at path.'''
+        entrypath = self.entrypath(path)
+        temppath = '%s.%d.tmp' % (entrypath, os.getpid())
+        if digest is None: digest = hashlib.sha1(data).hexdigest()
+        with open(temppath, 'wb') as entry:
+            marshal.dump((rawscache.format, digest, packed), entry)
+        if os.path.exists(entrypath): os.remove(entrypath)
+        os.rename(temppath, entrypath)
+
+    def packed(self, path, data):
+        '''Gets the packed tokens for the file at path from the cache if possible,
+        otherwise splits and packs data and stores the result.'''
+        digest = hashlib.sha1(data).hexdigest()
+        packed = self.get(path, data, digest)
+        if packed is None:
+            packed = rawstoken.pack(rawstoken.split(data))
+            self.put(path, data, packed, digest)
+        return packed
+    def tokens(self, path, data):
+        '''Gets a list of linked tokens for the file at path, using the cache to skip
+        splitting data when possible.'''
+        return rawstoken.unpack(self.packed(path, data))
+
+    def invalidate(self, path):
+        '''Removes the entry for the file at path, if there is one.'''
+        entrypath = self.entrypath(path)
+        if os.path.exists(entrypath): os.remove(entrypath)
+    def clear(self):
+        '''Removes all entries.'''
+        for entrypath in self.entries(): os.remove(entrypath)
+
+    def size(self):
+        '''Gets the number of bytes taken up by all entries.'''
+        return sum(os.path.getsize(entrypath) for entrypath in self.entries())
+    def trim(self, maxsize=None):
+        '''Removes least recently used entries until the entries in total take up no
+        more than maxsize bytes, which defaults to the cache's own maximum size.
+        Entries removed in the meantime by another process are ignored.'''
+        if maxsize is None: maxsize = self.maxsize
+        entries = []
+        for entrypath in self.entries():
+            try:
+                stat = os.stat(entrypath)
+            except OSError as error:
+                if error.errno != errno.ENOENT: raise
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entrypath))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, entrypath in entries:
+            if total <= maxsize: break
+            try:
+                os.remove(entrypath)
+            except OSError as error:
+                if error.errno != errno.ENOENT: raise
+            total -= size
@@ -1,15 +1,79 @@
 import os
+import re
+import shutil
+import marshal
+import hashlib
+import sys
+import Queue
+import weakref
+import threading
+import multiprocessing
+from collections import OrderedDict
 from queryable import rawsqueryable_obj
 from file import rawsfile
+from token import rawstoken
+from querycache import rawsquerycache
+from manifest import rawsmanifest
+from lock import rawslock
+
+class rawsfiles(OrderedDict):
+    '''Ordered dict of a directory's files by name which lets the directory know when
+    files are added, replaced, or removed, including when scripts assign to it
+    directly. Files put in it belong to the directory from then on.'''
+    
+    def __init__(self, dir, *args, **kwargs):
+        self.dirref = weakref.ref(dir)
+        OrderedDict.__init__(self, *args, **kwargs)
+        
+    def __reduce__(self):
+        # Copies and pickles are plain ordered dicts
+        return (OrderedDict, (self.items(),))
+        
+    def __setitem__(self, name, rfile, dict_setitem=dict.__setitem__):
+        OrderedDict.__setitem__(self, name, rfile, dict_setitem)
+        dir = self.dirref()
+        if dir is not None:
+            rfile.dir = dir
+            dir.fileschanged()
+    def __delitem__(self, name, dict_delitem=dict.__delitem__):
+        rfile = self[name]
+        OrderedDict.__delitem__(self, name, dict_delitem)
+        dir = self.dirref()
+        if dir is not None:
+            if rfile.dir is dir: rfile.dir = None
+            dir.fileschanged()
+    def clear(self):
+        rfiles = self.values()
+        OrderedDict.clear(self)
+        dir = self.dirref()
+        if dir is not None:
+            for rfile in rfiles:
+                if rfile.dir is dir: rfile.dir = None
+            dir.fileschanged()
+
+
 
 class rawsdir(rawsqueryable_obj):
     '''Represents as a whole all the raws contained within a directory.'''
     
     def __init__(self, *args, **kwargs):
         '''Constructor for rawsdir object.'''
-        self.files = {}
+        self.objectfiles = None
+        self.argsindexed = False
+        self.querycache = None
+        self.version = 0
+        self.files = OrderedDict()
         if len(args) or len(kwargs): self.read(*args, **kwargs)
         
+    # Files are kept in a rawsfiles dict, so that changes to it are noticed even when it's
+    # replaced as a whole
+    def getfiles(self):
+        return self.filesdict
+    def setfiles(self, files):
+        self.filesdict = rawsfiles(self, files)
+        self.fileschanged()
+    files = property(getfiles, setfiles)
+        
     def getfile(self, filename, create=False):
         rfile = self.files.get(filename)
         if create and rfile is None:
@@ -24,21 +88,18 @@ class rawsdir(rawsqueryable_obj):
             if filename in self.files: raise KeyError
             if not rfile: rfile = rawsfile(header=filename)
             self.files[filename] = rfile
-            rfile.dir = self
             return rfile
     def setfile(self, filename=None, rfile=None):
         if rfile and not filename: filename = rfile.header
-        rfile.dir = self
         self.files[filename] = rfile
     def removefile(self, filename=None, rfile=None):
         if not rfile.dir == self: raise ValueError
         if rfile and not filename: filename = rfile.header
-        rfile.dir = None
         del self.files[filename]
         
-    def addpath(self, path):
+    def addpath(self, path, lazy=False, cache=None):
         with open(path, 'rb') as rfilestream:
-            rfile = rawsfile(path=path, rfile=rfilestream, dir=self)
+            rfile = rawsfile(path=path, rfile=rfilestream, dir=self, lazy=lazy, cache=cache)
             if rfile.header in self.files: raise ValueError
             self.files[rfile.header] = rfile
             return rfile
@@ -46,30 +107,360 @@ class rawsdir(rawsqueryable_obj):
     def __getitem__(self, name): return self.getfile(name)
     def __setitem__(self, name, value): return self.setfile(name, value)
     
-    def read(self, path, log=None):
-        '''Reads raws from all text files in the specified directory.'''
-        for filename in os.listdir(path):
-            filepath = os.path.join(path, filename)
-            if filename.endswith('.txt') and os.path.isfile(filepath
-                ):
+    def read(self, path, log=None, lazy=False, processes=None, cache=None):
+        '''Reads raws from all text files in the specified directory. Files are read
+        in order of their names.
+        
+        lazy: If True, each file is only parsed once its tokens are first accessed.
+        processes: If greater than one and lazy is False, files are read and split
+            up by this many worker processes. The tokens themselves are still
+            built and linked in this process, so the result is the same as
+            reading them one after another.
+        cache: A rawscache object used to skip splitting files which were parsed
+            before and haven't changed since. It's trimmed once the files are read.'''
+        filenames = sorted(
+            filename for filename in os.listdir(path)
+            if filename.endswith('.txt') and os.path.isfile(os.path.join(path, filename))
+        )
+        if processes and processes > 1 and not lazy and len(filenames) > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(readpacked, [(os.path.join(path, filename), cache) for filename in filenames])
+            finally:
+                pool.close()
+                pool.join()
+            for filename, result in zip(filenames, results):
+                filepath = os.path.join(path, filename)
+                if log: log.debug('Building tokens for file %s...' % filepath)
+                headerline, data, packed, hits, misses = marshal.loads(result)
+                if cache is not None:
+                    # Workers only have copies of the cache, so their counts are added up here
+                    cache.hits += hits
+                    cache.misses += misses
+                rfile = rawsfile(header=headerline.strip(), data=data, path=filepath, dir=self, lazy=True, cache=cache)
+                rfile.headerline = headerline
+                rfile.parse(packed=packed)
+                self.files[os.path.splitext(filename)[0]] = rfile
+        else:
+            for filename in filenames:
+                filepath = os.path.join(path, filename)
                 if log: log.debug('Reading file %s...' % filepath)
                 with open(filepath, 'rb') as rfile:
                     filenamekey = os.path.splitext(os.path.basename(filename))[0]
-                    self.files[filenamekey] = rawsfile(path=filepath, rfile=rfile, dir=self)
+                    self.files[filenamekey] = rawsfile(path=filepath, rfile=rfile, dir=self, lazy=lazy, cache=cache)
+        if cache is not None: cache.trim()
         return self
         
-    def write(self, path, log=None):
-        '''Writes raws to the specified directory.'''
+    def write(self, path, log=None, incremental=False, threads=None, manifest=False, atomic=False):
+        '''Writes raws to the specified directory.
+        
+        incremental: If True, files which weren't changed since they were read
+            aren't written again when the directory already has an up-to-date copy
+            of them, and are copied rather than written when it doesn't. Text files
+            in the directory which don't belong to any of these raws are removed.
+            Other files are left untouched.
+        threads: If greater than one, files are written by this many threads at
+            once. Each file is still written by a single thread, in pieces, so this
+            mostly helps when writing to slow or networked drives.
+        manifest: If True, a rawsmanifest recording the hashes of the files in the
+            directory is kept alongside them. Files whose contents hash the same as
+            what was last written, and which haven't been touched since, aren't
+            written again, so their modification times are left as they were.
+            Text files which don't belong to any of these raws are removed, as for
+            incremental writes.
+        atomic: If True, files are first written to a staging directory next to
+            the one at path, and only once every one of them was written are they
+            moved into place by renaming them over the old files. An exception
+            while writing leaves the directory untouched, and on POSIX systems
+            processes reading the raws see each file either as it was or as it
+            is now, never half written. Old files are kept aside while the new ones
+            are moved into place, and if moving any of them fails they're all put
+            back. Text files which don't belong to any of these raws are removed
+            afterwards, as for incremental writes. Staging directories left next
+            to path by earlier writes which were interrupted are removed first,
+            while those of other processes still writing are left alone.'''
+        filepaths = []
         for filename in self.files:
             filepath = os.path.join(path, filename)
             if not filepath.endswith('.txt'): filepath += '.txt'
-            with open(filepath, 'wb') as rfile:
-                if log: log.debug('Writing file %s...' % filepath)
-                self.files[filename].write(rfile)
+            filepaths.append(filepath)
+        manifest = rawsmanifest(path) if manifest else None
+        if atomic:
+            # Staged files need to be on the same drive for renaming them to be atomic
+            target = os.path.normpath(os.path.abspath(path))
+            staging, staginglock = makestaging(target, log)
+            outpaths = [os.path.join(staging, os.path.basename(filepath)) for filepath in filepaths]
+        else:
+            outpaths = filepaths
+        tasks = [
+            (rfile, filepath, outpath, incremental, manifest, log)
+            for rfile, filepath, outpath in zip(self.files.itervalues(), filepaths, outpaths)
+        ]
+        try:
+            if threads and threads > 1 and len(tasks) > 1:
+                records = threadmap(writefile, tasks, threads)
+            else:
+                records = [writefile(task) for task in tasks]
+            if atomic: publishfiles(filepaths, outpaths, '%s.%d.replaced' % (target, os.getpid()), log)
+        finally:
+            if atomic:
+                try:
+                    shutil.rmtree(staging)
+                finally:
+                    staginglock.release(remove=True)
+        if manifest is not None:
+            for record in records:
+                if record is not None: manifest.record(*record)
+        if incremental or manifest is not None or atomic:
+            keep = set(os.path.normcase(os.path.abspath(filepath)) for filepath in filepaths)
+            for filename in os.listdir(path):
+                filepath = os.path.join(path, filename)
+                if filename.endswith('.txt') and os.path.isfile(filepath) and os.path.normcase(os.path.abspath(filepath)) not in keep:
+                    if log: log.debug('Removing file %s.' % filepath)
+                    os.remove(filepath)
+        if manifest is not None:
+            for filename in manifest.files.keys():
+                if not os.path.isfile(os.path.join(path, filename)): manifest.forget(filename)
+            manifest.write()
         return self
     
+    def indexargs(self, enabled=True):
+        '''Enables or disables indexing tokens by their arguments. When enabled,
+        queries using the args_contains, exact_arg, or exact_args arguments can look
+        up the tokens having those arguments rather than checking every token, which
+        makes finding everything that refers to some id much faster. The index for
+        each file is built the first time it's needed and takes up some additional
+        memory for as long as indexing stays enabled.
+        
+        Example usage:
+            >>> df.indexargs()
+            >>> print df.get(args_contains='BEAR_GRIZZLY')
+            [CREATURE:BEAR_GRIZZLY]
+        '''
+        self.argsindexed = enabled
+        if not enabled:
+            for rfile in self.files.itervalues():
+                if rfile.index is not None: rfile.index.indexargs(False)
+        
+    def cachequeries(self, enabled=True, maxsize=1024):
+        '''Enables or disables remembering the results of quick queries, such as
+        all and getprop, and of allobj. When enabled, running the same query on the
+        same object again gives the remembered result as long as no tokens in the
+        files it covers were added, removed, or changed in the meantime. Results
+        which are lists are copied each time, so changing them doesn't change
+        what's remembered. The rawsquerycache holding the results is kept in the
+        querycache attribute, and counts its hits and misses.
+        
+        maxsize: At most this many results are remembered at once.
+        
+        Example usage:
+            >>> df.cachequeries()
+            >>> print len(df.allobj('INORGANIC')) == len(df.allobj('INORGANIC'))
+            True
+            >>> print df.querycache.hits, df.querycache.misses
+            1 1
+            >>> df.cachequeries(False)
+        '''
+        self.querycache = rawsquerycache(maxsize) if enabled else None
+        
+    def fileschanged(self):
+        # Utility method called by rawsfiles when files are added to or removed from the
+        # directory
+        self.objectfiles = None
+        self.version += 1
+    def cachestamp(self):
+        return (self.querycache, self.version) if self.querycache is not None else None
+        
+    def getobjfiles(self, type):
+        # Files are grouped by the type given by their OBJECT token, which is remembered
+        # until a file is added or removed or the first token of some file is changed
+        if self.objectfiles is None:
+            self.objectfiles = {}
+            for order, rfile in enumerate(self.files.itervalues()):
+                self.objectfiles.setdefault(rfile.objecttype(), []).append((order, rfile))
+        match_types = self.getobjheadername(type)
+        matches = [
+            objecttype for objecttype in self.objectfiles
+            if objecttype is not None and objecttype in match_types
+        ]
+        if len(matches) == 1:
+            return [rfile for order, rfile in self.objectfiles[matches[0]]]
+        else:
+            return [rfile for order, rfile in sorted(
+                item for objecttype in matches for item in self.objectfiles[objecttype]
+            )]
+        
+    def scope(self):
+        return tuple((rfile, None, None, False) for rfile in self.files.itervalues())
+        
     def tokens(self):
         '''Iterate through all tokens.'''
         for filename in self.files:
             for token in self.files[filename].tokens():
                 yield token
+
+
+
+def threadmap(function, items, threads):
+    # Calls a function for each item using some number of threads and returns a list of
+    # the results in the same order, or once they're all done raises the first exception
+    # that any of them raised. Unlike ThreadPool, this doesn't wait on a polling loop when
+    # the threads are finished.
+    queue = Queue.Queue()
+    for index, item in enumerate(items): queue.put((index, item))
+    results = [None] * len(items)
+    errors = []
+    def work():
+        while not errors:
+            try:
+                index, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            except:
+                errors.append(sys.exc_info())
+    workers = [threading.Thread(target=work) for index in xrange(min(threads, len(items)))]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    if errors: raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+def writefile(args):
+    # Run for each file by rawsdir.write, possibly by a thread in a pool: Writes a file to
+    # outpath, which is either where it belongs or a staging path from which it's moved
+    # there later. Returns a tuple containing the file's name and the hash of its contents
+    # when they should be recorded in the manifest once the file is in place.
+    rfile, filepath, outpath, incremental, manifest, log = args
+    filename = os.path.basename(filepath)
+    if incremental and not rfile.isdirty() and rfile.path is not None and os.path.isfile(rfile.path):
+        if uptodate(rfile.path, filepath):
+            if log: log.debug('Skipping unchanged file %s.' % filepath)
+        else:
+            if log: log.debug('Copying unchanged file %s...' % filepath)
+            shutil.copy2(rfile.path, outpath)
+        if manifest is not None and not manifest.current(filename): return filename, rfile.digest()
+    elif manifest is None:
+        with open(outpath, 'wb') as outfile:
+            if log: log.debug('Writing file %s...' % filepath)
+            rfile.write(outfile)
+    else:
+        # The file is hashed as it's written to a temporary file, which takes its place
+        # only when the hash shows that its contents have changed
+        temppath = '%s.%d.tmp' % (outpath, os.getpid())
+        digest = hashlib.sha1()
+        try:
+            with open(temppath, 'wb') as outfile:
+                if log: log.debug('Writing file %s...' % filepath)
+                rfile.write(outfile, digest=digest)
+            digest = digest.hexdigest()
+            if manifest.current(filename, digest):
+                if log: log.debug('Skipping file %s with unchanged contents.' % filepath)
+                os.remove(temppath)
+            else:
+                replacefile(temppath, outpath)
+                return filename, digest
+        except:
+            if os.path.exists(temppath): os.remove(temppath)
+            raise
+    return None
+    
+def replacefile(source, target):
+    # Moves a file to where another file is, replacing it. The rename is atomic on POSIX
+    # systems, where readers see either the old file or the new one. Windows refuses to
+    # rename over an existing file, so there the old one has to be removed first.
+    try:
+        os.rename(source, target)
+    except OSError:
+        if not os.path.exists(target): raise
+        os.remove(target)
+        os.rename(source, target)
+
+def makestaging(target, log=None):
+    # Used by atomic writes: Makes a staging directory next to target for this process,
+    # first removing those left there by processes which were interrupted. Each process
+    # holds a lock on a file next to its staging directory for as long as it's there, so
+    # that those still in use are left alone. Returns the path of the staging directory
+    # along with the lock, which should be released once the directory is removed.
+    parent, basename = os.path.split(target)
+    lock = rawslock('%s.%d.lock' % (target, os.getpid()))
+    lock.acquire()
+    try:
+        stagingpattern = re.compile(r'%s\.(\d+)\.staging$' % re.escape(basename))
+        for filename in os.listdir(parent):
+            match = stagingpattern.match(filename)
+            if not match or int(match.group(1)) == os.getpid(): continue
+            leftover = rawslock('%s.%s.lock' % (target, match.group(1)))
+            if not leftover.acquire(blocking=False): continue
+            try:
+                if log: log.debug('Removing leftover staging directory %s.' % os.path.join(parent, filename))
+                shutil.rmtree(os.path.join(parent, filename))
+            finally:
+                leftover.release(remove=True)
+        staging = os.path.join(parent, '%s.%d.staging' % (basename, os.getpid()))
+        if os.path.exists(staging): shutil.rmtree(staging)
+        os.makedirs(staging)
+    except:
+        lock.release(remove=True)
+        raise
+    return staging, lock
+
+def publishfiles(filepaths, outpaths, replaced, log=None):
+    # Used by atomic writes: Moves each staged file at outpath, where there is one, to its
+    # filepath. Old files are first linked, or where that isn't supported moved, into the
+    # replaced directory, so that if anything fails they can all be put back. If putting
+    # them back fails too, the replaced directory is left as it is so they aren't lost.
+    os.makedirs(replaced)
+    moved = []
+    try:
+        for filepath, outpath in zip(filepaths, outpaths):
+            if not os.path.exists(outpath): continue
+            oldpath = None
+            if os.path.exists(filepath):
+                oldpath = os.path.join(replaced, os.path.basename(filepath))
+                try:
+                    os.link(filepath, oldpath)
+                except (AttributeError, OSError):
+                    os.rename(filepath, oldpath)
+            moved.append((filepath, oldpath))
+            replacefile(outpath, filepath)
+    except:
+        exception = sys.exc_info()
+        if log: log.debug('Putting back %d replaced files.' % len(moved))
+        for filepath, oldpath in reversed(moved):
+            if oldpath is not None:
+                replacefile(oldpath, filepath)
+            elif os.path.exists(filepath):
+                os.remove(filepath)
+        shutil.rmtree(replaced)
+        raise exception[0], exception[1], exception[2]
+    shutil.rmtree(replaced)
+
+def uptodate(source, target):
+    # Used by incremental writes: Tells whether the file at target is the one at source, or
+    # a copy of it made by shutil.copy2 which kept its size and modification time
+    if not os.path.isfile(target): return False
+    if os.path.normcase(os.path.abspath(source)) == os.path.normcase(os.path.abspath(target)): return True
+    # copy2 sets modification times only to the microsecond, so a copy's may differ from a
+    # more precise one of the original by a little less than that
+    sourcestat, targetstat = os.stat(source), os.stat(target)
+    return sourcestat.st_size == targetstat.st_size and abs(sourcestat.st_mtime - targetstat.st_mtime) < 0.001
+
+def readpacked(args):
+    # Run by worker processes for rawsdir.read: Reads a file, then splits and packs its data
+    # for rawstoken.unpack, or gets it already packed from the cache. Files without any
+    # braces are left for the parent to parse so that it raises the same exception as it
+    # would have otherwise. Along with the packed tokens it returns how many times the cache
+    # was hit and missed, since the parent's copy of the cache doesn't see those counts.
+    path, cache = args
+    with open(path, 'rb') as rfile:
+        headerline, data = rfile.readline(), rfile.read()
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    if data.find('[') == -1 and data.find(']') == -1:
+        packed = None
+    elif cache is not None:
+        packed = cache.packed(path, data)
+    else:
+        packed = rawstoken.pack(rawstoken.split(data))
+    if cache is not None: hits, misses = cache.hits - hits, cache.misses - misses
+    return marshal.dumps((headerline, data, packed, hits, misses))
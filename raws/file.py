@@ -1,30 +1,97 @@
+import weakref
+import hashlib
 from queryable import rawsqueryable
 from token import rawstoken
+from index import rawsindex
 
 class rawsfile(rawsqueryable):
     '''Represents a single file within a raws directory.'''
     
-    def __init__(self, header=None, data=None, path=None, tokens=None, rfile=None, dir=None):
+    def __init__(self, header=None, data=None, path=None, tokens=None, rfile=None, dir=None, lazy=False, cache=None, stream=False):
+        '''Constructs a rawsfile object.
+        
+        lazy: If True, data isn't parsed into tokens until tokens are first
+            accessed. Files whose tokens are never accessed are written back
+            exactly as they were read.
+        cache: A rawscache object which is used when parsing the file's data.
+            Requires path to be given.
+        stream: If True, tokens are parsed from rfile in chunks as it's read,
+            and the file's text as a whole is never kept in memory.'''
+        self.headerline = None
+        self.cache = cache
+        self.roottoken = None
+        self.tailtoken = None
+        self.index = None
+        self.dirref = None
+        self.version = 0
         if rfile:
-            self.read(rfile)
+            self.read(rfile, stream)
             if header is not None: self.header = header
             if data is not None: self.data = data
         else:
             self.header = header
             self.data = data
         self.path = path
-        self.roottoken = None
-        self.tailtoken = None
         self.dir = dir
-        if self.data:
-            tokens = rawstoken.parse(self.data, implicit_braces=False)
-        if tokens:
-            self.settokens(tokens)
+        self.parsed = not self.data
+        if self.parsed:
+            if tokens: self.settokens(tokens)
+        elif not lazy:
+            self.parse()
+        # Files are clean only when their tokens are the ones read from their path
+        self.dirty = path is None or bool(tokens)
             
-    def settokens(self, tokens):
+    def parse(self, parts=None, packed=None):
+        '''Parses the file's data into tokens, if that hasn't happened yet. If parts
+        is given, it should be the result of rawstoken.split for the file's data, and
+        if packed is given, the result of rawstoken.pack for those parts.'''
+        if not self.parsed:
+            self.parsed = True
+            if packed is not None:
+                self.settokens(rawstoken.unpack(packed), parsed=True)
+            elif parts is not None:
+                self.settokens(rawstoken.fromparts(parts), parsed=True)
+            elif self.cache is not None and (self.data.find('[') != -1 or self.data.find(']') != -1):
+                self.settokens(self.cache.tokens(self.path, self.data), parsed=True)
+            else:
+                self.settokens(rawstoken.parse(self.data, implicit_braces=False), parsed=True)
+            
+    def settokens(self, tokens, parsed=False):
+        # When parsed is True the tokens must have come from parsing the file's data, and
+        # they keep track of where their text is found within it.
         self.roottoken, self.tailtoken = rawstoken.firstandlast(tokens)
+        self.index = None
+        self.rootchanged()
+        if not parsed: self.changed()
+        fileref = weakref.ref(self)
+        token = self.roottoken
+        while token is not None:
+            token.fileref = fileref
+            if not parsed: token.offset = None
+            token = token.next
+        
+    def __del__(self):
+        # Tokens link strongly to the ones on both sides of them, so a file's tokens form
+        # reference cycles. The file owns its tokens, so when it's freed it unlinks them,
+        # and then they're freed by reference counting rather than by the cyclic garbage
+        # collector. Tokens which were since given to another file are left alone. Weak
+        # references to the file are already dead by the time this is called.
+        token = self.roottoken
+        if token is None or token.file is not None: return
+        while token.prev is not None: token = token.prev
+        while token is not None:
+            token.prev = None
+            token = token.next
+        
+    # The directory keeps its files alive, so files only keep a weak reference to it
+    def getdir(self):
+        return self.dirref() if self.dirref is not None else None
+    def setdir(self, dir):
+        self.dirref = weakref.ref(dir) if dir is not None else None
+    dir = property(getdir, setdir)
         
     def copy(self):
+        if not self.parsed: return rawsfile(header=self.header, data=self.data, path=self.path, dir=self.dir, lazy=True)
         rfile = rawsfile(header=self.header, path=self.path, dir=self.dir)
         rfile.settokens(rawstoken.copy(self.tokens()))
         return rfile
@@ -32,17 +99,115 @@ class rawsfile(rawsqueryable):
     def __str__(self):
         return '%s\n%s' %(self.header, ''.join([str(o) for o in self.tokens()]))
     def __repr__(self):
-        return '%s\n%s' %(self.header, ''.join([repr(o) for o in self.tokens()]))
+        return '%s\n%s' %(self.header, self.body())
+        
+    def body(self):
+        '''Gets the text of the file following the header.'''
+        if self.parsed:
+            return ''.join([str(chunk) for chunk in self.chunks()])
+        else:
+            return self.data
+    def chunks(self):
+        '''Iterates through pieces of the text of the file following the header,
+        which put together are the same as what body returns. Tokens which haven't
+        been changed since the file was parsed aren't written out again; instead,
+        each run of them is given as a buffer referring to the original data.'''
+        if not self.parsed:
+            if self.data: yield self.data
+            return
+        data = self.data
+        start, end = None, None
+        for token in self.tokens():
+            if data and token.offset is not None:
+                if token.offset != end:
+                    if start is not None: yield buffer(data, start, end - start)
+                    start = token.offset
+                end = token.offset + token.length()
+            else:
+                if start is not None:
+                    yield buffer(data, start, end - start)
+                    start, end = None, None
+                yield repr(token)
+        if start is not None: yield buffer(data, start, end - start)
+    def digest(self):
+        '''Gets the SHA-1 hash, as a hex string, of what the write method would
+        write. The text is hashed piece by piece as given by the chunks method
+        rather than being put together in memory first.'''
+        digest = hashlib.sha1(self.headertext())
+        for chunk in self.chunks(): digest.update(chunk)
+        return digest.hexdigest()
+    def isdirty(self):
+        '''Gets whether the file may differ from the one at its path, because it
+        wasn't read from there or because its header or any of its tokens were
+        changed since it was.'''
+        return self.dirty or self.headertext() != self.headerline
+    def headertext(self):
+        '''Gets the header line of the file as it should be written, which is the
+        line as it was read if the header hasn't been changed since.'''
+        if self.headerline is not None and self.headerline.strip() == self.header:
+            return self.headerline
+        else:
+            return '%s\n' % self.header
+        
+    def objecttype(self):
+        '''Gets X when the file starts with an OBJECT:X token, otherwise None. When
+        the file hasn't been parsed yet this only reads as far as the first token.'''
+        if self.parsed:
+            root = self.root()
+            if root and root.value == 'OBJECT' and root.nargs() == 1: return root.args[0]
+        else:
+            match = rawstoken.token_pattern.search(self.data)
+            if match:
+                tokenparts = match.group(1).split(':')
+                if tokenparts[0] == 'OBJECT' and len(tokenparts) == 2: return tokenparts[1]
+        return None
         
     def root(self):
         '''Gets the first token in the file.'''
+        self.parse()
         while self.roottoken and self.roottoken.prev: self.roottoken = self.roottoken.prev
         return self.roottoken
     def tail(self):
         '''Gets the last token in the file.'''
+        self.parse()
         while self.tailtoken and self.tailtoken.next: self.tailtoken = self.tailtoken.next
         return self.tailtoken
         
+    def rootchanged(self):
+        # Utility method called when the first token in the file, which tells the type of
+        # objects the file contains, is changed or replaced
+        dir = self.dir
+        if dir is not None: dir.objectfiles = None
+    def changed(self):
+        # Utility method called whenever tokens in the file are added, removed, or changed,
+        # which makes any results of queries remembered by a rawsquerycache out of date
+        self.version += 1
+        self.dirty = True
+        dir = self.dir
+        if dir is not None: dir.version += 1
+        
+    def getindex(self):
+        '''Gets the rawsindex for this file's tokens, building it if it doesn't
+        exist yet.'''
+        if self.index is None: self.index = rawsindex(self.root())
+        return self.index
+    def getargsindex(self):
+        '''Gets the rawsindex for this file's tokens if they're also indexed by their
+        arguments, which is the case when the file belongs to a rawsdir with argument
+        indexing enabled. Returns None otherwise.'''
+        dir = self.dir
+        if dir is None or not dir.argsindexed: return None
+        index = self.getindex()
+        if index.args is None: index.indexargs()
+        return index
+    def cachestamp(self):
+        dir = self.dir
+        if dir is None or dir.querycache is None: return None
+        return dir.querycache, self.version
+    def scope(self, range=None, include_self=False, reverse=False):
+        if range is not None or include_self: return None
+        return ((self, None, None, reverse),)
+        
     def tokens(self, range=None, include_self=False, reverse=False):
         '''Iterate through all tokens.'''
         if include_self: raise ValueError
@@ -53,10 +218,43 @@ class rawsfile(rawsqueryable):
             itrtoken = itrtoken.prev if reverse else itrtoken.next
             count += 1
             
-    def read(self, rfile):
-        self.header, self.data = rfile.readline().strip(), rfile.read()
-    def write(self, rfile):
-        rfile.write(self.__repr__())
+    def read(self, rfile, stream=False):
+        self.headerline = rfile.readline()
+        self.header = self.headerline.strip()
+        if stream:
+            self.data = None
+            self.settokens(rawstoken.iterparse(rfile))
+        else:
+            self.data = rfile.read()
+    def write(self, rfile, buffersize=65536, digest=None):
+        '''Writes the file's header and text to a stream, piece by piece as given
+        by the chunks method, so that the text as a whole is never put together in
+        memory. Small pieces, such as the text of changed tokens, are gathered up
+        and written together once there are buffersize bytes of them.
+        
+        digest: If given, a hashlib object which is updated with everything that's
+            written, so that the file's hash is gotten in the same pass as writing
+            it rather than by calling the digest method beforehand.'''
+        write = rfile.write
+        if digest is not None:
+            def write(text):
+                digest.update(text)
+                rfile.write(text)
+        pending = [self.headertext()]
+        size = len(pending[0])
+        for chunk in self.chunks():
+            if len(chunk) >= buffersize:
+                # Big runs of unchanged text are written as they are rather than copied
+                write(''.join(pending))
+                write(chunk)
+                pending, size = [], 0
+            else:
+                pending.append(str(chunk))
+                size += len(chunk)
+                if size >= buffersize:
+                    write(''.join(pending))
+                    pending, size = [], 0
+        if pending: write(''.join(pending))
     
     def add(self, auto=None, pretty=None, token=None, tokens=None, **kwargs):
         tail = self.tail()
@@ -68,8 +266,7 @@ class rawsfile(rawsqueryable):
                 tokens = rawstoken.parse(pretty)
                 if len(tokens) == 1: token = tokens[0]
             if token:
-                self.roottoken = token
-                self.tailtoken = token
+                self.settokens((token,))
                 return token
             elif tokens:
                 self.settokens(tokens)
@@ -1,4 +1,5 @@
 import re
+from strings import intern
 
 
 
@@ -19,6 +20,10 @@ class rawsbasefilter:
         return not result if self.invert else result
     def basematch(self, token):
         return False
+    def indexvalues(self):
+        return None
+    def indexargs(self):
+        return None
 
 
 
@@ -115,73 +120,190 @@ class rawstokenfilter(rawsbasefilter):
         self.limit = limit
         self.limit_terminates = limit_terminates
         
+        # Tokens' values and arguments are interned strings, so interning these too lets
+        # comparisons which succeed do so by identity rather than by comparing characters
+        if self.exact_value is not None: self.exact_value = intern(self.exact_value)
+        if self.except_value is not None: self.except_value = intern(self.except_value)
+        if self.exact_args is not None: self.exact_args = [None if a is None else intern(str(a)) for a in self.exact_args]
+        if self.exact_arg is not None: self.exact_arg = [(a[0], intern(str(a[1]))) for a in self.exact_arg]
+        if self.args_contains is not None: self.args_contains = intern(str(self.args_contains))
+        
         # Anchor regular expressions
         if self.re_value: self.re_value += '$'
         if self.re_prefix: self.re_prefix += '$'
         if self.re_suffix: self.re_suffix += '$'
-        if self.re_args: self.re_args = [a + '$' for a in self.re_args]
+        if self.re_args: self.re_args = [None if a is None else a + '$' for a in self.re_args]
         if self.re_arg: self.re_arg = [(a[0], a[1]+'$') for a in self.re_arg]
         
-    def basematch(self, token):
-        if (
-            (self.exact_token is not None and self.exact_token is not token) or
-            (self.except_value is not None and self.except_value == token.value) or
-            (self.exact_value is not None and self.exact_value != token.value) or
-            (self.args_count is not None and self.args_count != token.nargs()) or
-            (self.value_in is not None and token.value not in self.value_in) or
-            (self.value_not_in is not None and token.value in self.value_not_in) or
-            (self.re_value is not None and re.match(self.re_value, token.value) == None) or
-            (self.args_contains is not None and str(self.args_contains) not in [str(a) for a in token.args])
-        ):
-            return False
-        if self.exact_args is not None:
-            if not (len(self.exact_args) == token.nargs() and all([self.exact_args[i] == None or str(self.exact_args[i]) == token.args[i] for i in xrange(0, token.nargs())])):
-                return False
-        if self.exact_arg is not None:
-            if not all([a[0]>=0 and a[0]<token.nargs() and token.args[a[0]] == str(a[1]) for a in self.exact_arg]):
-                return False
+        self.compile()
+        
+    def compile(self):
+        '''Prepares the filter for matching tokens by compiling its regular expressions
+        and building a list of the checks which a token must pass, leaving out those
+        for arguments which weren't given. This is done when the filter is constructed,
+        so it only needs to be called again if the filter's attributes are changed
+        afterwards.'''
+        checks = []
+        
+        exact_token = self.exact_token
+        if exact_token is not None: checks.append(lambda token: token is exact_token)
+        
+        # Checks on the token's value
+        exact_value = self.exact_value
+        if exact_value is not None: checks.append(lambda token: token.valuestr == exact_value)
+        except_value = self.except_value
+        if except_value is not None: checks.append(lambda token: token.valuestr != except_value)
+        value_in = self.value_in
+        if value_in is not None: checks.append(lambda token: token.valuestr in value_in)
+        value_not_in = self.value_not_in
+        if value_not_in is not None: checks.append(lambda token: token.valuestr not in value_not_in)
+        if self.re_value is not None:
+            re_value = re.compile(self.re_value).match
+            checks.append(lambda token: re_value(token.valuestr) is not None)
+            
+        # Checks on the token's arguments
+        args_count = self.args_count
+        if args_count is not None: checks.append(lambda token: token.nargs() == args_count)
+        args_contains = self.args_contains
+        if args_contains is not None:
+            checks.append(lambda token: args_contains in token.args or args_contains in map(str, token.args))
+        exact_args = self.exact_args
+        if exact_args is not None:
+            count = len(exact_args)
+            checks.append(lambda token: token.nargs() == count and all([a is None or a == b for a, b in zip(exact_args, token.args)]))
+        exact_arg = self.exact_arg
+        if exact_arg is not None:
+            checks.append(lambda token: all([a[0] >= 0 and a[0] < token.nargs() and token.args[a[0]] == a[1] for a in exact_arg]))
         if self.re_args is not None:
-            if not (len(self.re_args) == token.nargs() and all([self.re_args[i] == None or re.match(self.re_args[i], token.args[i]) for i in xrange(0, token.nargs())])):
-                return False
+            re_args = [None if a is None else re.compile(a).match for a in self.re_args]
+            count = len(re_args)
+            checks.append(lambda token: token.nargs() == count and all([a is None or a(b) is not None for a, b in zip(re_args, token.args)]))
         if self.re_arg is not None:
-            if not all([a[0]>=0 and a[0]<token.nargs() and re.match(a[1], token.args[a[0]]) for a in self.re_arg]):
-                return False
-        if self.exact_prefix is not None or self.re_prefix is not None:
-            match_prefix = (self.prev.suffix + self.prefix) if self.prev else self.prefix
-            if (self.exact_prefix is not None and match_prefix != self.exact_prefix) or (self.re_prefix is not None and re.match(self.re_prefix, match_prefix)):
-                return False
-        if self.exact_suffix is not None or self.re_suffix is not None:
-            match_suffix = (self.suffix + self.next.prefix) if self.next else self.suffix
-            if (self.exact_suffix is not None and match_suffix != self.exact_suffix) or (self.re_suffix is not None and re.match(self.re_suffix, match_suffix)):
-                return False
+            re_arg = [(a[0], re.compile(a[1]).match) for a in self.re_arg]
+            checks.append(lambda token: all([a[0] >= 0 and a[0] < token.nargs() and a[1](token.args[a[0]]) is not None for a in re_arg]))
+            
+        # Checks on the text surrounding the token
+        exact_prefix = self.exact_prefix
+        if exact_prefix is not None: checks.append(lambda token: rawstokenfilter.tokenprefix(token) == exact_prefix)
+        if self.re_prefix is not None:
+            re_prefix = re.compile(self.re_prefix).match
+            checks.append(lambda token: re_prefix(rawstokenfilter.tokenprefix(token)) is not None)
+        exact_suffix = self.exact_suffix
+        if exact_suffix is not None: checks.append(lambda token: rawstokenfilter.tokensuffix(token) == exact_suffix)
+        if self.re_suffix is not None:
+            re_suffix = re.compile(self.re_suffix).match
+            checks.append(lambda token: re_suffix(rawstokenfilter.tokensuffix(token)) is not None)
+            
+        self.checks = tuple(checks)
+        
+    def indexvalues(self):
+        '''Gets a tuple of values such that any token this filter matches must have
+        one of them, or None if that isn't known. Used to look up tokens by value
+        instead of checking every one.'''
+        if self.invert:
+            return None
+        elif self.exact_value is not None:
+            return (self.exact_value,)
+        elif self.value_in is not None and not isinstance(self.value_in, basestring):
+            values = []
+            for value in self.value_in:
+                if value != self.except_value and value not in values: values.append(value)
+            return tuple(values)
+        else:
+            return None
+        
+    def indexargs(self):
+        '''Gets a tuple of keys for the arguments index of rawsindex such that any
+        token this filter matches must be indexed by every one of them, or None if
+        there aren't any. Used to look up tokens by their arguments instead of
+        checking every one.'''
+        if self.invert: return None
+        keys = []
+        if self.args_contains is not None:
+            keys.append(self.args_contains)
+        if self.exact_args is not None:
+            keys.extend((index, arg) for index, arg in enumerate(self.exact_args) if arg is not None)
+        if self.exact_arg is not None:
+            keys.extend((index, arg) for index, arg in self.exact_arg if index >= 0)
+        return tuple(keys) if keys else None
+        
+    def basematch(self, token):
+        for check in self.checks:
+            if not check(token): return False
         return True
         
+    @staticmethod
+    def tokenprefix(token):
+        # Utility method for getting the previous token's suffix and a token's own prefix concatenated
+        prefix = token.prefix or ''
+        prev = token.prev
+        return ((prev.suffix or '') + prefix) if prev is not None else prefix
+    @staticmethod
+    def tokensuffix(token):
+        # Utility method for getting a token's own suffix and the next token's prefix concatenated
+        suffix = token.suffix or ''
+        next = token.next
+        return (suffix + (next.prefix or '')) if next is not None else suffix
+        
 
 
 class rawsboolfilter(rawsbasefilter):
     '''Logical filter class for combining other filters.'''
     
-    def __init__(self, subs, operand=None, invert=None):
+    def __init__(self, subs, operand=None, invert=None, limit=None, limit_terminates=True):
         self.subs = subs
         self.operand = operand
         self.invert = invert
-        self.args = args
+        self.limit = limit
+        self.limit_terminates = limit_terminates
         
     def basematch(self, token):
         if self.operand == 'one':
             count = 0
-            for sub in subs:
+            for sub in self.subs:
                 count += sub.match(token)
                 if count > 1: return False
             return count == 1
         elif self.operand == 'any':
-            for sub in subs:
+            for sub in self.subs:
                 if sub.match(token): return True
+            return False
         elif self.operand == 'all':
-            for sub in subs:
+            for sub in self.subs:
                 if not sub.match(token): return False
             return True
             
+    def indexvalues(self):
+        '''Gets a tuple of values such that any token this filter matches must have
+        one of them, or None if that isn't known. For 'all' these are the values of
+        the first filter which knows them, and for 'one' and 'any' they're the values
+        of every filter, provided that all of them know theirs.'''
+        if self.invert: return None
+        subvalues = [sub.indexvalues() for sub in self.subs]
+        if self.operand == 'all':
+            for values in subvalues:
+                if values is not None: return values
+            return None
+        elif self.operand in ('one', 'any'):
+            if any(values is None for values in subvalues): return None
+            union = []
+            for values in subvalues:
+                for value in values:
+                    if value not in union: union.append(value)
+            return tuple(union)
+        else:
+            return None
+    def indexargs(self):
+        '''Gets a tuple of keys for the arguments index of rawsindex such that any
+        token this filter matches must be indexed by every one of them, or None if
+        that isn't known. Only filters combined with 'all' know them, in which case
+        they're the keys of the first filter which knows its own.'''
+        if self.invert or self.operand != 'all': return None
+        for sub in self.subs:
+            keys = sub.indexargs()
+            if keys is not None: return keys
+        return None
+            
     @staticmethod
     def one(subs): return rawsboolfilter(subs, 'one')
     @staticmethod
@@ -189,5 +311,4 @@ class rawsboolfilter(rawsbasefilter):
     @staticmethod
     def all(subs): return rawsboolfilter(subs, 'all')
     @staticmethod
-    def none(subs): return rawsboolfilter(subs, 'all', invert=True)
-    
\ No newline at end of file
+    def none(subs): return rawsboolfilter(subs, 'any', invert=True)
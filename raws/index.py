@@ -0,0 +1,359 @@
+import re
+
+
+
+class rawsindex(object):
+    '''Keeps track of the tokens in a rawsfile by their values, so that queries for
+    tokens with some particular value don't need to look at every token in the file.
+    For values which are looked up as objects, e.g. CREATURE, tokens are also indexed
+    by their single argument. Optionally, tokens can also be indexed by each of their
+    arguments, both by the argument alone and by the argument together with its
+    position among the token's arguments. The index is kept up to date as tokens are
+    added, removed, and changed.
+    
+    For objects whose properties have been queried, the index also remembers their
+    extent, given by the token following their last property, and a summary of which
+    values those properties have, in the form of a bitset with one bit for each value
+    in the file. Checking whether an object has some property at all then takes only
+    a bitwise and. When tokens are added, removed, or changed, only the extent of the
+    object they belong to is affected: An added token which starts an object of the
+    same kind becomes the end of that object's extent, and the value of any other
+    added token, or the new value of a changed one, is added to the object's summary.
+    When a token is removed, the object's extent and summary are forgotten and made
+    again the next time they're needed. A summary may therefore include values which
+    the object's properties no longer have, but never leaves out one which they do.
+
+    In order for tokens with the same value to be kept in the order they appear in the
+    file, each token is given a position. Positions increase from the beginning of the
+    file to the end, and are spaced apart so that tokens added later on can usually be
+    given positions between those of their neighbors without renumbering the rest.
+    
+    The index also keeps count of the tokens in the file and the range their positions
+    fall within, which together with the number of tokens having each value is what
+    the query planner uses to estimate whether it's cheaper to look tokens up in the
+    index or to check every token.'''
+
+    # Space between the positions of neighboring tokens when they're numbered anew
+    spacing = 1 << 32
+
+    def __init__(self, root):
+        '''Constructs a rawsindex object for a file given its first token.'''
+        self.args = None
+        self.bits = {}
+        self.build(root)
+
+    def build(self, root):
+        '''Numbers and indexes every token in the file anew.'''
+        self.values = {}
+        self.objects = {}
+        self.patterns = {}
+        self.extents = {}
+        position = 0
+        token = root
+        while token is not None:
+            token.position = position
+            self.values.setdefault(token.valuestr, []).append(token)
+            position += rawsindex.spacing
+            token = token.next
+        self.count = position // rawsindex.spacing
+        self.lowest = 0
+        self.highest = position
+        if self.args is not None: self.indexargs()
+        
+    def indexargs(self, enabled=True):
+        '''Starts or stops indexing tokens by their arguments. Arguments which
+        aren't strings are indexed by what str gives for them.'''
+        if enabled:
+            self.args = {}
+            tokens = [token for valuetokens in self.values.itervalues() for token in valuetokens]
+            tokens.sort(key=lambda token: token.position)
+            for token in tokens: self.insertargs(token)
+        else:
+            self.args = None
+
+    def range(self, values, low=None, high=None):
+        '''Gets the tokens having any of the given values whose positions are at
+        least low and less than high, in the order they appear in the file. If low or
+        high is None then the range isn't bounded on that side.'''
+        tokens = []
+        for value in values:
+            valuetokens = self.values.get(value)
+            if valuetokens: tokens.extend(rawsindex.slice(valuetokens, low, high))
+        if len(values) > 1: tokens.sort(key=lambda token: token.position)
+        return tokens
+    def argrange(self, key, low=None, high=None):
+        '''Gets the tokens having some argument whose positions are at least low
+        and less than high, in the order they appear in the file. The key is either
+        an argument, for tokens having it anywhere among their arguments, or an
+        (index, argument) tuple for tokens having it at that index.'''
+        return rawsindex.slice(self.args.get(key, ()), low, high)
+    def objectrange(self, type, id, low=None, high=None):
+        '''Gets the tokens with the given value and exactly one argument, that
+        being the given id, whose positions are at least low and less than high.'''
+        return rawsindex.slice(self.getobjects(type, id), low, high)
+        
+    def fraction(self, low=None, high=None):
+        '''Estimates what fraction of the tokens in the file have positions at least
+        low and less than high.'''
+        if low is None and high is None: return 1.0
+        if low is None or low < self.lowest: low = self.lowest
+        if high is None or high > self.highest: high = self.highest
+        return float(max(0, high - low)) / max(1, self.highest - self.lowest)
+    def cardinality(self, values):
+        '''Gets the number of tokens in the file having any of the given values.'''
+        return sum(len(self.values.get(value, ())) for value in values)
+        
+    def summary(self, token, props):
+        '''Gets a tuple containing the token which ends the extent of an object, that
+        being the first token after it having one of the values given by props, or None
+        if there isn't one, and a summary of the values of the tokens in between as
+        given by valuebits. props is what the object's argsprops method returns.'''
+        entries = self.extents.get(props)
+        if entries is None: entries = self.extents[props] = {}
+        # Tokens with the same text compare as equal, so they're told apart by id
+        entry = entries.get(id(token))
+        if entry is None:
+            end = self.following(self.untilvalues(props), token)
+            bits = 0
+            itertoken = token.next
+            while itertoken is not end:
+                bits |= self.bit(itertoken.valuestr)
+                itertoken = itertoken.next
+            # The entry refers to the token so that its id can't be reused in the meantime
+            entry = entries[id(token)] = [token, end, bits]
+        return entry[1], entry[2]
+    def untilvalues(self, props):
+        '''Gets the values of tokens which end the extents of objects, given what
+        their argsprops method returns.'''
+        until_exact_value, until_re_value, until_value_in = props
+        if until_re_value is not None:
+            return self.matching(until_re_value)
+        elif until_exact_value is not None:
+            return (until_exact_value,)
+        else:
+            return until_value_in
+    def valuebits(self, values):
+        '''Gets the bitset for some values. Tokens having any of them are present
+        among those summarized by a summary if its bitwise and with this isn't 0.'''
+        bits = 0
+        for value in values: bits |= self.bits.get(value, 0)
+        return bits
+        
+    def matching(self, pattern):
+        '''Gets a tuple of the values in the file which match a regular expression.'''
+        values = self.patterns.get(pattern)
+        if values is None:
+            compiled = re.compile(pattern + '$')
+            values = tuple(value for value in self.values if compiled.match(value))
+            self.patterns[pattern] = values
+        return values
+        
+    def preceding(self, values, position):
+        '''Gets the last token before the given position having any of the given
+        values, or None if there isn't one.'''
+        last = None
+        for value in values:
+            valuetokens = self.values.get(value)
+            if valuetokens:
+                index = rawsindex.locate(valuetokens, position)
+                if index and (last is None or valuetokens[index - 1].position > last.position):
+                    last = valuetokens[index - 1]
+        return last
+    def following(self, values, token):
+        '''Gets the first token after the given one having any of the given values,
+        or None if there isn't one.'''
+        first = None
+        for value in values:
+            valuetokens = self.values.get(value)
+            if valuetokens:
+                index = rawsindex.locate(valuetokens, token.position + 1)
+                if index < len(valuetokens) and (first is None or valuetokens[index].position < first.position):
+                    first = valuetokens[index]
+        return first
+    def between(self, values, first, last):
+        '''Gets the tokens after first and before last having any of the given values,
+        in order. If last is None, gets the tokens all the way to the end of the file.'''
+        return self.range(values, first.position + 1, last.position if last is not None else None)
+        
+    def getobjects(self, type, id=None):
+        '''Gets the tokens with the given value and exactly one argument, which is
+        the given id if it isn't None, in the order they appear in the file.'''
+        ids = self.objects.get(type)
+        if ids is None:
+            # Tokens are indexed by their arguments only for values which were looked up this way
+            ids = {}
+            for token in self.values.get(type, ()):
+                if token.nargs() == 1: ids.setdefault(token.args[0], []).append(token)
+            self.objects[type] = ids
+        if id is not None:
+            return ids.get(id, ())
+        else:
+            return [token for token in self.values.get(type, ()) if token.nargs() == 1]
+        
+    def add(self, tokens):
+        '''Indexes tokens which were just added to the file in one sequence.'''
+        first, last = tokens[0], tokens[-1]
+        low = first.prev.position if first.prev is not None else None
+        high = last.next.position if last.next is not None else None
+        count = len(tokens)
+        self.count += count
+        if low is None and high is None:
+            low, step = -rawsindex.spacing, rawsindex.spacing
+        elif high is None:
+            step = rawsindex.spacing
+        elif low is None:
+            low, step = high - rawsindex.spacing * (count + 1), rawsindex.spacing
+        elif high - low > count:
+            step = (high - low) // (count + 1)
+        else:
+            # No room left between the neighbors, so everything is numbered anew
+            while first.prev is not None: first = first.prev
+            self.build(first)
+            return
+        for token in tokens:
+            low += step
+            token.position = low
+            self.insert(token)
+        if first.position < self.lowest: self.lowest = first.position
+        if last.position + rawsindex.spacing > self.highest: self.highest = last.position + rawsindex.spacing
+    def remove(self, tokens):
+        '''Forgets about tokens which were just removed from the file.'''
+        self.count -= len(tokens)
+        for token in tokens: self.discard(token, token.valuestr)
+    def change(self, token, oldvalue):
+        '''Moves a token whose value was just changed.'''
+        self.discard(token, oldvalue, changed=True)
+        self.insert(token)
+
+    def insert(self, token):
+        # Utility method for inserting a token in its place among those with the same value
+        valuetokens = self.values.get(token.valuestr)
+        if valuetokens is None:
+            valuetokens = self.values[token.valuestr] = []
+            self.patterns = {}
+        rawsindex.insertinto(valuetokens, token)
+        self.insertobject(token)
+        self.insertargs(token)
+        if self.extents: self.insertextents(token)
+    def discard(self, token, value, changed=False):
+        # Utility method for removing a token from among those with the given value, or
+        # which had that value before it was changed
+        valuetokens = self.values.get(value)
+        if valuetokens and rawsindex.discardfrom(valuetokens, token):
+            if not valuetokens:
+                del self.values[value]
+                self.patterns = {}
+        self.discardobject(token, value)
+        self.discardargs(token)
+        if self.extents: self.discardextents(token, value, changed)
+    def insertobject(self, token):
+        # Utility method for indexing a token by its argument, if its value is indexed that way
+        ids = self.objects.get(token.valuestr)
+        if ids is not None and token.nargs() == 1:
+            rawsindex.insertinto(ids.setdefault(token.args[0], []), token)
+    def discardobject(self, token, value):
+        # Utility method for removing a token which was indexed by its argument
+        ids = self.objects.get(value)
+        if ids is not None and token.nargs() == 1:
+            id = token.args[0]
+            idtokens = ids.get(id)
+            if idtokens and rawsindex.discardfrom(idtokens, token):
+                if not idtokens: del ids[id]
+    def insertargs(self, token):
+        # Utility method for indexing a token by its arguments, if arguments are indexed
+        if self.args is not None:
+            for key in rawsindex.argkeys(token): rawsindex.insertinto(self.args.setdefault(key, []), token)
+    def discardargs(self, token):
+        # Utility method for removing a token which was indexed by its arguments
+        if self.args is not None:
+            for key in rawsindex.argkeys(token):
+                keytokens = self.args.get(key)
+                if keytokens and rawsindex.discardfrom(keytokens, token):
+                    if not keytokens: del self.args[key]
+                    
+    def insertextents(self, token):
+        # Utility method for updating the extent and summary of the object which a token
+        # was added to, for each kind of object having extents. A token which starts an
+        # object of the same kind cuts the extent short, leaving the summary as it was.
+        for props, entries in self.extents.items():
+            values = self.untilvalues(props)
+            owner = self.preceding(values, token.position)
+            entry = entries.get(id(owner)) if owner is not None else None
+            if entry is not None:
+                if token.valuestr in values:
+                    entry[1] = token
+                else:
+                    entry[2] |= self.bit(token.valuestr)
+    def discardextents(self, token, value, changed):
+        # Utility method for forgetting the extent of the object which a token was removed
+        # from, and the token's own extent, for each kind of object having extents. When
+        # the token's value was only changed, the object keeps its extent unless the old
+        # value was what ended it, and insertextents adds the new value to its summary.
+        for props, entries in self.extents.items():
+            entries.pop(id(token), None)
+            if not changed or rawsindex.ends(props, value):
+                owner = self.preceding(self.untilvalues(props), token.position)
+                if owner is not None: entries.pop(id(owner), None)
+            if not entries: del self.extents[props]
+    @staticmethod
+    def ends(props, value):
+        # Utility method for telling whether tokens with some value end the extents of
+        # objects of a kind, given what the objects' argsprops method returns
+        until_exact_value, until_re_value, until_value_in = props
+        if until_re_value is not None:
+            return re.match(until_re_value + '$', value) is not None
+        elif until_exact_value is not None:
+            return value == until_exact_value
+        else:
+            return value in until_value_in
+
+    @staticmethod
+    def argkeys(token):
+        # Utility method for getting the keys a token is indexed by in the arguments index
+        if not token.nargs(): return ()
+        keys = set()
+        for index, arg in enumerate(token.args):
+            arg = str(arg)
+            keys.add(arg)
+            keys.add((index, arg))
+        return keys
+
+    @staticmethod
+    def insertinto(tokens, token):
+        # Utility method for inserting a token into a list of tokens ordered by position
+        tokens.insert(rawsindex.locate(tokens, token.position), token)
+    @staticmethod
+    def discardfrom(tokens, token):
+        # Utility method for removing a token from a list of tokens ordered by position
+        index = rawsindex.locate(tokens, token.position)
+        if index < len(tokens) and tokens[index] is token:
+            del tokens[index]
+            return True
+        return False
+
+    def bit(self, value):
+        # Utility method for getting the bit which stands for a value in summaries
+        bit = self.bits.get(value)
+        if bit is None: bit = self.bits[value] = 1 << len(self.bits)
+        return bit
+        
+    @staticmethod
+    def slice(tokens, low, high):
+        # Utility method for getting the tokens in a list ordered by position whose
+        # positions are at least low and less than high
+        start = rawsindex.locate(tokens, low) if low is not None else 0
+        end = rawsindex.locate(tokens, high) if high is not None else len(tokens)
+        return tokens[start:end]
+        
+    @staticmethod
+    def locate(tokens, position):
+        # Utility method for finding where a position belongs in a list of tokens ordered
+        # by position, like bisect.bisect_left
+        low, high = 0, len(tokens)
+        while low < high:
+            middle = (low + high) // 2
+            if tokens[middle].position < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
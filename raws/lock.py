@@ -0,0 +1,79 @@
+import os
+import errno
+
+# Files are locked using whichever of these the system has
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+class rawslock(object):
+    '''Exclusive lock on a file, used to keep processes from working on the same
+    files at once. The lock is held until it's released or the process holding it
+    ends, so a lock left behind by a process which was interrupted is never in the
+    way. The same rawslock object can be acquired again while it's held, and is
+    only released once it's been released as many times.
+
+    Example usage:
+        >>> lock = raws.lock('rawbak/lock')
+        >>> with lock:
+        ...     print lock.held()
+        True
+    '''
+
+    def __init__(self, path):
+        '''Constructs a rawslock object for the file at path, which is created when
+        the lock is first acquired if it doesn't exist already.'''
+        self.path = path
+        self.file = None
+        self.depth = 0
+
+    def held(self):
+        '''Gets whether this object holds the lock.'''
+        return self.depth > 0
+
+    def acquire(self, blocking=True):
+        '''Takes the lock, waiting for any other process holding it to let go. If
+        blocking is False, returns False instead of waiting. Returns True once the
+        lock is held.'''
+        if self.depth:
+            self.depth += 1
+            return True
+        lockfile = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lockfile.seek(0)
+                msvcrt.locking(lockfile.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except IOError as error:
+            lockfile.close()
+            if not blocking and error.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK, errno.EDEADLK): return False
+            raise
+        self.file = lockfile
+        self.depth = 1
+        return True
+
+    def release(self, remove=False):
+        '''Lets go of the lock once it's been released as many times as it was
+        acquired. If remove is True the file is removed then too, which should only
+        be done when no other process could be waiting for it.'''
+        if not self.depth: raise ValueError('Lock %s is not held.' % self.path)
+        self.depth -= 1
+        if self.depth: return
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+        if remove: os.remove(self.path)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+    def __exit__(self, type, value, traceback):
+        self.release()
+
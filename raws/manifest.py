@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+
+class rawsmanifest(object):
+    '''Keeps a record of the files written to a raws output directory, stored in a
+    file in that same directory. For each file it records the hash of its contents
+    along with its size and modification time at the time it was written. When a
+    file would be written with the same contents it already has, and it hasn't been
+    touched since, writing it can be skipped entirely. The record can also be used
+    to check that nothing in the directory has changed since it was written.'''
+
+    # Name of the file within the output directory where the record is kept
+    filename = 'pydwarf_manifest.json'
+
+    # Manifests written with a different format are ignored
+    format = 1
+
+    def __init__(self, path):
+        '''Constructs a rawsmanifest object for the output directory at path, reading
+        its existing record if there is one.'''
+        self.path = path
+        self.files = {}
+        self.read()
+
+    def manifestpath(self):
+        # Utility method for getting the path of the file where the record is kept
+        return os.path.join(self.path, rawsmanifest.filename)
+
+    def read(self):
+        '''Reads the record from the directory, forgetting what was recorded before.
+        The record is empty when there isn't one or it can't be read.'''
+        self.files = {}
+        try:
+            with open(self.manifestpath(), 'rb') as manifest:
+                data = json.load(manifest)
+            if data.get('format') == rawsmanifest.format:
+                self.files = {str(name): tuple(entry) for name, entry in data['files'].iteritems()}
+        except (OSError, IOError, ValueError, TypeError, KeyError, AttributeError):
+            pass
+        return self
+    def write(self):
+        '''Writes the record to the directory, replacing the one there before.'''
+        manifestpath = self.manifestpath()
+        temppath = '%s.%d.tmp' % (manifestpath, os.getpid())
+        with open(temppath, 'wb') as manifest:
+            json.dump({'format': rawsmanifest.format, 'files': self.files}, manifest, indent=4, sort_keys=True)
+        if os.path.exists(manifestpath): os.remove(manifestpath)
+        os.rename(temppath, manifestpath)
+        return self
+
+    def current(self, filename, digest=None):
+        '''Gets whether the file with the given name is, going by its size and
+        modification time, as it was when recorded and, if digest is given, whether
+        the hash of its contents was recorded as that digest.'''
+        entry = self.files.get(filename)
+        if entry is None: return False
+        try:
+            stat = os.stat(os.path.join(self.path, filename))
+        except OSError:
+            return False
+        return (digest is None or entry[0] == digest) and entry[1] == stat.st_size and entry[2] == stat.st_mtime
+    def record(self, filename, digest):
+        '''Records the hash of the contents of a file which was just written.'''
+        stat = os.stat(os.path.join(self.path, filename))
+        self.files[filename] = (digest, stat.st_size, stat.st_mtime)
+    def forget(self, filename):
+        '''Removes the record of a file, e.g. when it was deleted.'''
+        self.files.pop(filename, None)
+
+    def verify(self):
+        '''Checks the files in the directory against the record by hashing their
+        contents. Returns a tuple containing lists of the names of recorded files
+        which are missing, of those which have different contents than recorded,
+        and of text files which aren't recorded at all.'''
+        missing, changed = [], []
+        for filename in sorted(self.files):
+            filepath = os.path.join(self.path, filename)
+            if not os.path.isfile(filepath):
+                missing.append(filename)
+            elif filedigest(filepath) != self.files[filename][0]:
+                changed.append(filename)
+        unexpected = sorted(
+            filename for filename in os.listdir(self.path)
+            if filename.endswith('.txt') and filename not in self.files and os.path.isfile(os.path.join(self.path, filename))
+        )
+        return missing, changed, unexpected
+
+
+
+def filedigest(path, chunksize=65536):
+    '''Gets the hash of the contents of a file, reading it in pieces.'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as rfile:
+        while True:
+            chunk = rfile.read(chunksize)
+            if not chunk: break
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,13 +1,19 @@
 # vim:fileencoding=UTF-8
 
+import re
+import math
 import inspect
+import itertools
 from filters import *
+from querycache import rawsquerycache
 
 
 
-class rawsqueryable:
+class rawsqueryable(object):
     '''Classes which contain raws tokens should inherit from this in order to provide querying functionality.'''
     
+    __slots__ = ()
+    
     query_tokeniter_docstring = '''
         tokeniter: The query runs along this iterable until either a filter has hit
             its limit or the tokens have run out.'''
@@ -29,31 +35,289 @@ class rawsqueryable:
             named normally.)
     ''' % query_tokeniter_docstring
     
+    # Names of the arguments accepted by the tokens method of each class, see argstokens
+    tokensargs = {}
+    
     def __getitem__(self, pretty): return self.get(pretty=pretty)
     def __iter__(self): return self.tokens()
     def __contains__(self, pretty): return self.get(pretty=pretty) is not None
     
+    # Relative costs used by the query planner, where checking a token against a filter
+    # costs 1: Passing over a token which doesn't have any of the values the filter looks
+    # for, and each step of the binary search which finds where a range of positions
+    # starts or ends among the tokens having some value
+    skipcost = 0.25
+    lookupcost = 0.5
+    
+    def scope(self, **kwargs):
+        '''Describes the tokens which the tokens method would iterate through, if it
+        were given the same arguments, in terms of the indexes of the files they belong
+        to. Used by the query planner. Returns a tuple containing a (file, low, high,
+        reverse) tuple for each file in order, where low and high bound the positions
+        of the tokens as for rawsindex.range and reverse tells whether they're iterated
+        in reverse order. Returns None when the tokens can't be described this way,
+        in which case queries check every token.'''
+        return None
+        
+    def cachestamp(self):
+        '''Gets a tuple containing the rawsquerycache which remembers the results
+        of queries on this object and the version number which those results must
+        have been stored with to still be valid. Returns None when results for this
+        object aren't remembered.'''
+        return None
+        
+    def planquery(self, filters, tokeniter=None, **kwargs):
+        '''Executes a query the same as the query method does, except that it first
+        plans how to find the tokens to check. Depending on the filters, the part of
+        the raws that the query covers, and how many tokens have the values which the
+        filters look for, tokens are either looked up by value or by object id using
+        the indexes of their files or else every one of them is checked.
+        
+        filters: A tuple containing either one filter or two. When there are two, the
+            first should be one like the getuntil and alluntil methods use to end the
+            query, having a limit of 1 which terminates the query. The token which
+            ends the query is found first and then only tokens preceding it are
+            considered for the second filter. Queries with other filters, or where a
+            tokeniter is given, are executed by the query method as-is.
+        **kwargs: The same as for the query method.
+        '''
+        
+        scope = self.scope(**kwargs) if tokeniter is None else None
+        if scope is None or len(filters) not in (1, 2):
+            return self.query(filters, tokeniter, **kwargs)
+        if len(filters) == 1:
+            return self.query(filters, rawsqueryable.plan(filters[0], scope), **kwargs)
+        until, condition = filters
+        planned = self.planuntil(until, condition, scope, kwargs)
+        if planned is None: return self.query(filters, None, **kwargs)
+        end, tokens = planned
+        until.result = rawstokenlist(() if end is None else (end,))
+        self.query((condition,), tokens, **kwargs)
+        return filters
+        
+    def planiter(self, filters, tokeniter=None, **kwargs):
+        '''Plans a query the same as the planquery method does, but instead of
+        storing results in the filters, returns an iterator which yields the tokens
+        matching the last filter one at a time, finding each only once the one before
+        it has been consumed.
+        
+        filters: A tuple containing either one filter or two, as for planquery.
+        **kwargs: The same as for the query method.
+        '''
+        
+        if len(filters) not in (1, 2): raise ValueError
+        scope = self.scope(**kwargs) if tokeniter is None else None
+        condition = filters[-1]
+        if scope is not None:
+            if len(filters) == 1:
+                tokens = rawsqueryable.plan(condition, scope)
+                if tokens is not None: return rawsqueryable.itermatches(condition, tokens)
+            else:
+                planned = self.planuntil(filters[0], condition, scope, kwargs)
+                if planned is not None:
+                    end, tokens = planned
+                    return rawsqueryable.itermatches(condition, tokens if tokens is not None else self.tokens(**kwargs))
+        if tokeniter is None: tokeniter = self.tokens(**kwargs)
+        return rawsqueryable.itermatches(condition, tokeniter, filters[0] if len(filters) == 2 else None)
+        
+    def planuntil(self, until, condition, scope, kwargs):
+        # Utility method for the query planner, finds the token which ends a query using
+        # the indexes of files and gets the tokens before it which could match the
+        # condition. Returns a tuple containing the ending token, or None if there isn't
+        # one, and those tokens, or None if every token must be checked. Returns None
+        # instead if the ending token can't be found that way.
+        tokens = rawsqueryable.plan(until, scope) if until.limit == 1 and until.limit_terminates else None
+        if tokens is None: return None
+        end = next((token for token in tokens if until.match(token)), None)
+        if end is None: return None, rawsqueryable.plan(condition, scope)
+        tokens = rawsqueryable.plan(condition, rawsqueryable.scopeuntil(scope, end))
+        if tokens is None: tokens = itertools.takewhile(lambda token: token is not end, self.tokens(**kwargs))
+        return end, tokens
+        
+    @staticmethod
+    def itermatches(filter, tokens, until=None):
+        # Utility method for iterating through the tokens matching a filter, stopping at
+        # the filter's limit or at the first token matching until
+        values = filter.indexvalues()
+        if values is not None: values = frozenset(values)
+        limit = filter.limit
+        count = 0
+        for token in tokens:
+            if until is not None and until.match(token): return
+            if (values is None or token.valuestr in values) and filter.match(token):
+                yield token
+                count += 1
+                if count == limit: return
+                
+    @staticmethod
+    def plan(filter, scope):
+        # Utility method for the query planner, gets the tokens within a scope which could
+        # match a filter using the indexes of their files, or None when checking every
+        # token is expected to be cheaper
+        values = filter.indexvalues()
+        keys = filter.indexargs()
+        if values is None and keys is None: return None
+        id = rawsqueryable.filterid(filter) if values is not None else None
+        # Tally the tokens in the scope, and for each way of looking tokens up, the steps
+        # needed for the lookups and the number of tokens found which could match
+        total = 0.0
+        valuecost = [0.0, 0.0]
+        keycosts = {key: [0.0, 0.0] for key in keys} if keys is not None else None
+        for rfile, low, high, reverse in scope:
+            index = rfile.getindex()
+            fraction = index.fraction(low, high)
+            bounds = (low is not None) + (high is not None)
+            total += index.count * fraction
+            if id is not None:
+                # Objects are indexed by id the first time they're looked up that way
+                objects = index.objects.get(values[0])
+                if objects is None: valuecost[0] += index.cardinality(values)
+                count = len(objects.get(id, ())) if objects is not None else 1
+                valuecost[0] += bounds * math.log(count + 1, 2)
+                valuecost[1] += count * fraction
+            elif values is not None:
+                for value in values:
+                    count = len(index.values.get(value, ()))
+                    valuecost[0] += bounds * math.log(count + 1, 2)
+                    valuecost[1] += count * fraction
+            if keycosts is not None:
+                if rfile.getargsindex() is None:
+                    keycosts = None
+                else:
+                    for key, cost in keycosts.iteritems():
+                        count = len(index.args.get(key, ()))
+                        cost[0] += bounds * math.log(count + 1, 2)
+                        cost[1] += count * fraction
+        ways = {}
+        if values is not None: ways[None] = valuecost
+        if keycosts is not None: ways.update(keycosts)
+        if not ways: return None
+        # A query which ends after some number of matches only checks tokens up to there
+        portion = 1.0
+        if filter.limit and filter.limit_terminates:
+            portion = min(1.0, float(filter.limit) / (min(cost[1] for cost in ways.itervalues()) + 1))
+        # When scanning, tokens without the values the filter looks for are passed over
+        # cheaply and the rest are checked
+        if values is not None:
+            scancost = portion * ((total - valuecost[1]) * rawsqueryable.skipcost + valuecost[1])
+        else:
+            scancost = portion * total
+        best, bestcost = None, scancost
+        for way, cost in ways.iteritems():
+            waycost = cost[0] * rawsqueryable.lookupcost + cost[1] * portion
+            if waycost < bestcost: best, bestcost = way, waycost
+        if bestcost >= scancost: return None
+        return rawsqueryable.lookup(scope, values, id, best)
+        
+    @staticmethod
+    def lookup(scope, values, id, key):
+        # Utility method for the query planner, iterates through the tokens within a scope
+        # having some argument if a key for the arguments index is given, otherwise being
+        # objects with some id if it's given, otherwise having some values
+        for rfile, low, high, reverse in scope:
+            index = rfile.getindex()
+            if key is not None:
+                tokens = index.argrange(key, low, high)
+            elif id is not None:
+                tokens = index.objectrange(values[0], id, low, high)
+            else:
+                tokens = index.range(values, low, high)
+            for token in (reversed(tokens) if reverse else tokens): yield token
+            
+    @staticmethod
+    def scopeuntil(scope, end):
+        # Utility method for the query planner, gets the part of a scope preceding a token
+        until = []
+        for rfile, low, high, reverse in scope:
+            if end.file is rfile:
+                if reverse:
+                    low = end.position + 1 if low is None else max(low, end.position + 1)
+                else:
+                    high = end.position if high is None else min(high, end.position)
+                until.append((rfile, low, high, reverse))
+                break
+            until.append((rfile, low, high, reverse))
+        return tuple(until)
+        
+    @staticmethod
+    def filterid(filter):
+        # Utility method for the query planner, gets the id of the objects a filter
+        # matches if it only matches tokens with exactly that one argument
+        exact_args = getattr(filter, 'exact_args', None)
+        if exact_args is not None and len(exact_args) == 1 and exact_args[0] is not None and getattr(filter, 'exact_value', None) is not None and not filter.invert:
+            return exact_args[0]
+        return None
+        
     def query(self, filters, tokeniter=None, **kwargs):
-        '''Executes a query on some iterable containing tokens.
+        '''Executes a query on some iterable containing tokens. Every filter is
+        applied in the same pass over the tokens, and each filter's result is stored
+        in its result attribute. Tokens are only checked against the filters which
+        could match their values, and the query stops as soon as a filter with
+        limit_terminates hits its limit or every filter has hit its limit.
         
         filters: A dict or other iterable containing rawstokenfilter-like objects.
         **kwargs: If tokeniter is not given, then the object's token method will be
             called with these arguments and used instead.
         %s
+        
+        Example usage:
+            >>> hematite = df.getobj('INORGANIC:HEMATITE')
+            >>> query = hematite.query({
+            ...     'stone': raws.tokenfilter(exact_value='IS_STONE', limit=1, limit_terminates=False),
+            ...     'environment': raws.tokenfilter(exact_value='ENVIRONMENT'),
+            ...     'end': raws.tokenfilter(exact_value='INORGANIC', limit=1)
+            ... })
+            >>> print query['stone'].result
+            [IS_STONE]
+            >>> print len(query['environment'].result)
+            2
         ''' % rawsqueryable.query_tokeniter_docstring
         
         if tokeniter is None: tokeniter = self.tokens(**kwargs)
-        filteriter = (filters.itervalues() if isinstance(filters, dict) else filters)
-        limit = False
-        for filter in filteriter: filter.result = rawstokenlist()
+        active = list(filters.itervalues() if isinstance(filters, dict) else filters)
+        for filter in active: filter.result = rawstokenlist()
+        buckets, general = rawsqueryable.dispatch(active)
         for token in tokeniter:
-            for filter in filteriter:
-                if (not filter.limit) or len(filter.result) < filter.limit:
-                    if filter.match(token): filter.result.append(token)
-                    if filter.limit_terminates and len(filter.result) == filter.limit: limit = True; break
-            if limit: break
+            for filter in buckets.get(token.valuestr, general):
+                if filter.match(token):
+                    filter.result.append(token)
+                    if filter.limit and len(filter.result) == filter.limit:
+                        if filter.limit_terminates: return filters
+                        # The filter won't accept any more tokens, so stop checking them against it
+                        active.remove(filter)
+                        if not active: return filters
+                        general = rawsqueryable.retire(buckets, general, filter)
         return filters
         
+    @staticmethod
+    def dispatch(filters):
+        # Utility method for sorting filters by the values of the tokens they could match,
+        # returns a dict mapping values to the filters which a token with that value needs
+        # to be checked against, and the filters for tokens with any other value
+        buckets = {}
+        general = []
+        for filter in filters:
+            values = filter.indexvalues()
+            if values is None:
+                general.append(filter)
+                for bucket in buckets.itervalues(): bucket.append(filter)
+            else:
+                for value in values:
+                    bucket = buckets.get(value)
+                    if bucket is None:
+                        buckets[value] = general[:] + [filter]
+                    elif bucket[-1] is not filter:
+                        bucket.append(filter)
+        return {value: tuple(bucket) for value, bucket in buckets.iteritems()}, tuple(general)
+        
+    @staticmethod
+    def retire(buckets, general, filter):
+        # Utility method for removing a filter which won't accept any more tokens from
+        # the results of dispatch, returns the new tuple of filters for other values
+        for value, bucket in buckets.iteritems():
+            if filter in bucket: buckets[value] = tuple(other for other in bucket if other is not filter)
+        return tuple(other for other in general if other is not filter)
+        
     def get(self, pretty=None, tokeniter=None, **kwargs):
         '''Get the first matching token.
         
@@ -73,12 +337,7 @@ class rawsqueryable:
             [CREATURE:BEAR_BLACK]
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        filters = (
-            rawstokenfilter(pretty=pretty, limit=1, **filter_args)
-        ,)
-        result = self.query(filters, tokeniter, **tokens_args)[0].result
-        return result[0] if result and len(result) else None
+        return rawsquery('get', pretty, **kwargs).run(self, tokeniter)
     
     def getlast(self, pretty=None, tokeniter=None, **kwargs):
         '''Get the last matching token.
@@ -91,12 +350,7 @@ class rawsqueryable:
             [T_WORD:PRACTICE:mubun]
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        filters = (
-            rawstokenfilter(pretty=pretty, **filter_args)
-        ,)
-        result = self.query(filters, tokeniter, **tokens_args)[0].result
-        return result[-1] if result and len(result) else None
+        return rawsquery('getlast', pretty, **kwargs).run(self, tokeniter)
     
     def all(self, pretty=None, tokeniter=None, **kwargs):
         '''Get a list of all matching tokens.
@@ -119,11 +373,37 @@ class rawsqueryable:
             ['[CREATURE:DWARF]', '[CREATURE:HUMAN]', '[CREATURE:ELF]', '[CREATURE:GOBLIN]', '[CREATURE:FAIRY]', '[CREATURE:PIXIE]']
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        filters = (
-            rawstokenfilter(pretty=pretty, **filter_args)
-        ,)
-        return self.query(filters, tokeniter, **tokens_args)[0].result
+        return rawsquery('all', pretty, **kwargs).run(self, tokeniter)
+    
+    def iterall(self, pretty=None, tokeniter=None, **kwargs):
+        '''Iterate through all matching tokens. Each one is found only once the
+        one before it has been consumed, so this is cheaper than the all method when
+        not every matching token is needed.
+        
+        %s
+        
+        Example usage:
+            >>> for token in df.iterall('INTELLIGENT'):
+            ...     print token.get('CREATURE', reverse=True)
+            ...     break
+            [CREATURE:DWARF]
+        ''' % rawsqueryable.quick_query_args_docstring
+        
+        return rawsquery('all', pretty, **kwargs).iterate(self, tokeniter)
+        
+    def count(self, pretty=None, tokeniter=None, **kwargs):
+        '''Count the matching tokens without making a list of them.
+        
+        %s
+        
+        Example usage:
+            >>> print df.count('INTELLIGENT')
+            6
+        ''' % rawsqueryable.quick_query_args_docstring
+        
+        count = 0
+        for token in rawsquery('all', pretty, **kwargs).iterate(self, tokeniter): count += 1
+        return count
     
     def until(self, pretty=None, tokeniter=None, **kwargs):
         '''Get a list of all tokens up to a match.
@@ -148,12 +428,7 @@ class rawsqueryable:
             [STATE_NAME_ADJ:ALL_SOLID:hematite][DISPLAY_COLOR:4:7:0][TILE:156]
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        filters = (
-            rawstokenfilter(pretty=pretty, limit=1, **filter_args),
-            rawstokenfilter()
-        )
-        return self.query(filters, tokeniter, **tokens_args)[1].result
+        return rawsquery('until', pretty, **kwargs).run(self, tokeniter)
         
     def getuntil(self, pretty=None, until=None, tokeniter=None, **kwargs):
         '''Get the first matching token, but abort when a token matching arguments prepended with 'until_' is encountered.
@@ -168,14 +443,7 @@ class rawsqueryable:
             None
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        until_args, condition_args = self.argsuntil(filter_args)
-        filters = (
-            rawstokenfilter(pretty=until, limit=1, **until_args),
-            rawstokenfilter(pretty=pretty, limit=1, **condition_args)
-        )
-        result = self.query(filters, tokeniter, **tokens_args)[1].result
-        return result[0] if result and len(result) else None
+        return rawsquery('getuntil', pretty, until, **kwargs).run(self, tokeniter)
     
     def getlastuntil(self, pretty=None, until=None, tokeniter=None, **kwargs):
         '''Get the last matching token, up until a token matching arguments prepended with 'until_' is encountered.
@@ -190,14 +458,7 @@ class rawsqueryable:
             [STATE_NAME_ADJ:ALL_SOLID:hematite]
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        until_args, condition_args = self.argsuntil(filter_args)
-        filters = (
-            rawstokenfilter(pretty=until, limit=1, **until_args),
-            rawstokenfilter(pretty=pretty, **condition_args)
-        )
-        result = self.query(filters, tokeniter, **tokens_args)[1].result
-        return result[-1] if result and len(result) else None
+        return rawsquery('getlastuntil', pretty, until, **kwargs).run(self, tokeniter)
      
     def alluntil(self, pretty=None, until=None, tokeniter=None, **kwargs):
         '''Get a list of all matching tokens, but abort when a token matching
@@ -215,15 +476,24 @@ class rawsqueryable:
             ['[INTELLIGENT]', '[INTELLIGENT]', '[INTELLIGENT]']
         ''' % rawsqueryable.quick_query_args_docstring
         
-        filter_args, tokens_args = self.argstokens(tokeniter, kwargs)
-        until_args, condition_args = self.argsuntil(filter_args)
-        filters = (
-            rawstokenfilter(pretty=until, limit=1, **until_args),
-            rawstokenfilter(pretty=pretty, **condition_args)
-        )
-        return self.query(filters, tokeniter, **tokens_args)[1].result
+        return rawsquery('alluntil', pretty, until, **kwargs).run(self, tokeniter)
     
-    def getprop(self, pretty=None, **kwargs):
+    def iteralluntil(self, pretty=None, until=None, tokeniter=None, **kwargs):
+        '''Iterate through all matching tokens, stopping when a token matching
+        arguments prepended with 'until_' is encountered. Each one is found only
+        once the one before it has been consumed.
+        
+        %s
+        
+        Example usage:
+            >>> dwarf = df.getobj('CREATURE:DWARF')
+            >>> print [str(token) for token in dwarf.iteralluntil('INTELLIGENT', 'CREATURE')]
+            ['[INTELLIGENT]']
+        ''' % rawsqueryable.quick_query_args_docstring
+        
+        return rawsquery('alluntil', pretty, until, **kwargs).iterate(self, tokeniter)
+    
+    def getprop(self, pretty=None, tokeniter=None, **kwargs):
         '''Gets the first token matching the arguments, but stops at the next
         token with the same value as this one. Should be sufficient in almost
         all cases to get a token representing a property of an object, when
@@ -238,10 +508,9 @@ class rawsqueryable:
             None
         '''
         
-        until_exact_value, until_re_value, until_value_in = self.argsprops()
-        return self.getuntil(pretty=pretty, until_exact_value=until_exact_value, until_re_value=until_re_value, until_value_in=until_value_in, **kwargs)
+        return rawsquery('getprop', pretty, **kwargs).run(self, tokeniter)
         
-    def getlastprop(self, pretty=None, **kwargs):
+    def getlastprop(self, pretty=None, tokeniter=None, **kwargs):
         '''Gets the last token matching the arguments, but stops at the next
         token with the same value as this one. Should be sufficient in almost
         all cases to get a token representing a property of an object, when
@@ -256,10 +525,9 @@ class rawsqueryable:
             [ITEMS_SCALED]
         '''
         
-        until_exact_value, until_re_value, until_value_in = self.argsprops()
-        return self.getlastuntil(pretty=pretty, until_exact_value=until_exact_value, until_re_value=until_re_value, until_value_in=until_value_in, **kwargs)
+        return rawsquery('getlastprop', pretty, **kwargs).run(self, tokeniter)
             
-    def allprop(self, pretty=None, **kwargs):
+    def allprop(self, pretty=None, tokeniter=None, **kwargs):
         '''Gets the all tokens matching the arguments, but stops at the next
         token with the same value as this one. Should be sufficient in almost
         all cases to get a token representing a property of an object, when
@@ -275,15 +543,27 @@ class rawsqueryable:
             [ENVIRONMENT:IGNEOUS_EXTRUSIVE:VEIN:100]
         '''
         
-        until_exact_value, until_re_value, until_value_in = self.argsprops()
-        return self.alluntil(pretty=pretty, until_exact_value=until_exact_value, until_re_value=until_re_value, until_value_in=until_value_in, **kwargs)
+        return rawsquery('allprop', pretty, **kwargs).run(self, tokeniter)
+            
+    def iterallprop(self, pretty=None, tokeniter=None, **kwargs):
+        '''Iterate through the tokens matching the arguments which are properties
+        of this object, the same as those the allprop method would get. Each one is
+        found only once the one before it has been consumed.
+        
+        Example usage:
+            >>> hematite = df.getobj('INORGANIC:HEMATITE')
+            >>> print next(hematite.iterallprop('ENVIRONMENT'))
+            [ENVIRONMENT:SEDIMENTARY:VEIN:100]
+        '''
+        
+        return rawsquery('allprop', pretty, **kwargs).iterate(self, tokeniter)
             
     def propdict(self, always_list=True, value_keys=True, full_keys=True, **kwargs):
         '''Returns a dictionary with token values mapped as keys to the tokens
         themselves. If always_list is True then every item in the dict will be
         a list. If it's False then items in the dict where only one token was
         found will be given as individual rawstoken instances rather than as
-        lists. **kwargs are passed to the alluntil method.
+        lists. **kwargs are passed to the allprop method.
         
         Example usage:
             >>> hematite = df.getobj('INORGANIC:HEMATITE')
@@ -299,8 +579,7 @@ class rawsqueryable:
             [[TILE:156]]
         '''
         
-        until_exact_value, until_re_value, until_value_in = self.argsprops()
-        props = self.alluntil(until_exact_value=until_exact_value, until_re_value=until_re_value, until_value_in=until_value_in, **kwargs)
+        props = self.allprop(**kwargs)
         pdict = {}
         for prop in props:
             for key in (prop.value if value_keys else None, str(prop)[1:-1] if full_keys else None):
@@ -317,6 +596,31 @@ class rawsqueryable:
                             pdict[key] = [prop, pdict[key]]
         return pdict
         
+    def propextent(self):
+        '''Gets a tuple containing the rawsindex for the file this object belongs to,
+        the token which follows its last property, and a summary of the values of its
+        properties (see rawsindex.summary), or None if the object isn't indexed. Used
+        by property queries so that they only need to look at the tokens belonging to
+        the object, or at none of them when the summary shows there's no match.'''
+        return None
+        
+    def propquery(self, filter):
+        # Utility function for querying only the tokens belonging to an object using the
+        # index of its file, returns None if the query can't be done that way
+        tokens = self.proptokens(filter)
+        return self.query((filter,), tokens)[0].result if tokens is not None else None
+    def proptokens(self, filter):
+        # Utility function for getting the tokens belonging to an object which could match
+        # a filter using the index of its file, returns None if they can't be found that way
+        extent = self.propextent()
+        if extent is None: return None
+        index, end, bits = extent
+        values = filter.indexvalues()
+        if values is not None:
+            return index.between(values, self, end) if bits & index.valuebits(values) else ()
+        else:
+            return self.tokens(until_token=end)
+        
     def argsuntil(self, kwargs):
         # Utility function for handling arguments of getuntil and alluntil methods
         until_args, condition_args = {}, {}
@@ -331,7 +635,9 @@ class rawsqueryable:
         # Utility function for separating arguments to pass on to a tokens iterator from arguments to pass to filters
         if tokeniter is None and hasattr(self, 'tokens'):
             filter_args, tokens_args = {}, {}
-            args = inspect.getargspec(self.tokens)[0]
+            args = rawsqueryable.tokensargs.get(type(self))
+            if args is None:
+                args = rawsqueryable.tokensargs[type(self)] = frozenset(inspect.getargspec(self.tokens)[0])
             for argname, argvalue in kwargs.iteritems():
                 (tokens_args if argname in args else filter_args)[argname] = argvalue
             return filter_args, tokens_args
@@ -353,6 +659,154 @@ class rawsqueryable:
 
 
 
+class rawsquery(object):
+    '''A quick query which is prepared once and can then be run any number of times,
+    for example once for each of many objects in a loop. Preparing a query means
+    parsing its pretty arguments, compiling its filters, and sorting its arguments
+    into those for the filters and those for the tokens method, so that none of it
+    needs to be done again each time the query is run. The quick query methods of
+    rawsqueryable, such as get and allprop, work by constructing and running one of
+    these.
+    
+    Example usage:
+        >>> getname = raws.query('getprop', 'NAME')
+        >>> for creature in df.allobj('CREATURE', id_in=('DWARF', 'ELF')): print getname(creature)
+        [NAME:dwarf:dwarves:dwarven]
+        [NAME:elf:elves:elven]
+        >>> print raws.query('all', 'INTELLIGENT').run(df) == df.all('INTELLIGENT')
+        True
+    '''
+    
+    # Names of the quick query methods which a query can act like
+    methods = ('get', 'getlast', 'all', 'until', 'getuntil', 'getlastuntil', 'alluntil', 'getprop', 'getlastprop', 'allprop')
+    
+    def __init__(self, method, pretty=None, until=None, **kwargs):
+        '''Constructs a rawsquery object.
+        
+        method: The name of the rawsqueryable quick query method which this query
+            acts like, e.g. 'get', 'alluntil', or 'getprop'.
+        pretty, until, **kwargs: The same as for that method. until is only accepted
+            for getuntil, getlastuntil, and alluntil.
+        '''
+        if method not in rawsquery.methods: raise ValueError
+        if until is not None and method not in ('getuntil', 'getlastuntil', 'alluntil'): raise ValueError
+        self.method = method
+        self.pretty = pretty
+        self.until = until
+        self.kwargs = kwargs
+        self.prepared = {}
+        self.untilfilters = {}
+        self.key = None
+        self.keyed = False
+        
+    def __call__(self, queryable, tokeniter=None):
+        return self.run(queryable, tokeniter)
+        
+    def run(self, queryable, tokeniter=None):
+        '''Runs the query on a rawsqueryable object, and returns whatever the quick
+        query method it acts like would have.
+        
+        queryable: The object to query, e.g. a rawsdir, rawsfile, or rawstoken.
+        %s
+        ''' % rawsqueryable.query_tokeniter_docstring
+        
+        stamp = queryable.cachestamp() if tokeniter is None else None
+        key = self.cachekey() if stamp is not None else None
+        if key is None: return self.execute(queryable, tokeniter)
+        cache, version = stamp
+        result = cache.get(queryable, key, version)
+        if result is rawsquerycache.missing:
+            result = self.execute(queryable, tokeniter)
+            cache.put(queryable, key, version, result)
+        # Lists are copied so that changing them doesn't change the remembered result
+        return rawstokenlist(result) if isinstance(result, list) else result
+        
+    def execute(self, queryable, tokeniter=None):
+        # Utility method for running the query without looking for a remembered result
+        filters, tokens_args, until_args = self.prepare(queryable, tokeniter)
+        method = self.method
+        if method in ('getprop', 'getlastprop', 'allprop'):
+            result = None
+            condition = filters[0]
+            if tokeniter is None and not tokens_args and not until_args:
+                result = queryable.propquery(condition)
+            if result is None:
+                filters = (self.untilfilter(queryable, until_args), condition)
+                result = queryable.planquery(filters, tokeniter, **tokens_args)[1].result
+        else:
+            result = queryable.planquery(filters, tokeniter, **tokens_args)[-1].result
+        if method.startswith('getlast'):
+            return result[-1] if result else None
+        elif method.startswith('get'):
+            return result[0] if result else None
+        else:
+            return result
+            
+    def iterate(self, queryable, tokeniter=None):
+        '''Runs the query on a rawsqueryable object like the run method does, but
+        returns an iterator which finds the matching tokens one at a time as they're
+        consumed rather than a list of all of them. Only queries which act like all,
+        until, alluntil, or allprop can be iterated.'''
+        
+        method = self.method
+        if method not in ('all', 'until', 'alluntil', 'allprop'): raise ValueError
+        filters, tokens_args, until_args = self.prepare(queryable, tokeniter)
+        if method == 'allprop':
+            condition = filters[0]
+            if tokeniter is None and not tokens_args and not until_args:
+                tokens = queryable.proptokens(condition)
+                if tokens is not None: return rawsqueryable.itermatches(condition, tokens)
+            filters = (self.untilfilter(queryable, until_args), condition)
+        return queryable.planiter(filters, tokeniter, **tokens_args)
+            
+    def cachekey(self):
+        # Utility method for getting the key which identifies this query in a rawsquerycache,
+        # or None if its results can't be remembered
+        if not self.keyed:
+            self.key = rawsquerycache.key(self.method, self.pretty, self.until, self.kwargs)
+            self.keyed = True
+        return self.key
+        
+    def prepare(self, queryable, tokeniter):
+        # Utility method for getting the filters and the arguments for the tokens method
+        # when running on some object. These only depend on the object's type and on
+        # whether a tokeniter was given, so they're only constructed once for each.
+        key = (type(queryable), tokeniter is None)
+        prepared = self.prepared.get(key)
+        if prepared is None:
+            method = self.method
+            filter_args, tokens_args = queryable.argstokens(tokeniter, self.kwargs)
+            until_args = None
+            if method in ('get', 'getlast', 'all'):
+                if method == 'get': filter_args['limit'] = 1
+                filters = (rawstokenfilter(pretty=self.pretty, **filter_args),)
+            elif method == 'until':
+                filters = (rawstokenfilter(pretty=self.pretty, limit=1, **filter_args), rawstokenfilter())
+            else:
+                until_args, condition_args = queryable.argsuntil(filter_args)
+                if method in ('getuntil', 'getprop'): condition_args['limit'] = 1
+                condition = rawstokenfilter(pretty=self.pretty, **condition_args)
+                if method in ('getprop', 'getlastprop', 'allprop'):
+                    filters = (condition,)
+                else:
+                    filters = (rawstokenfilter(pretty=self.until, limit=1, **until_args), condition)
+            prepared = self.prepared[key] = (filters, tokens_args, until_args)
+        return prepared
+        
+    def untilfilter(self, queryable, until_args):
+        # Utility method for getting the filter which stops a property query at the end
+        # of an object, there being one for each kind of object
+        props = queryable.argsprops()
+        filter = self.untilfilters.get(props)
+        if filter is None:
+            until_exact_value, until_re_value, until_value_in = props
+            filter = self.untilfilters[props] = rawstokenfilter(
+                exact_value=until_exact_value, re_value=until_re_value, value_in=until_value_in, limit=1, **until_args
+            )
+        return filter
+
+
+
 class rawsqueryable_obj(rawsqueryable):
     def __init__(self):
         self.files = None
@@ -370,21 +824,25 @@ class rawsqueryable_obj(rawsqueryable):
         elif type.startswith('MATGLOSS_'):
             return ('MATGLOSS',)
         elif type in ('TILE_PAGE', 'CREATURE_GRAPHICS'):
-            type = ('GRAPHICS',)
+            return ('GRAPHICS',)
         else:
             return type
+            
+    def getobjfiles(self, type):
+        # Utility function for getting the files containing objects of some type
+        match_types = self.getobjheadername(type)
+        results = []
+        for rfile in self.files.itervalues():
+            objecttype = rfile.objecttype()
+            if objecttype is not None and objecttype in match_types:
+                results.append(rfile)
+        return results
     
     def getobjheaders(self, type):
         '''Gets OBJECT:X tokens where X is type. Is also prepared for special cases
         like type=ITEM_PANTS matching OBJECT:ITEM. Current as of DF version 0.40.24.'''
         
-        match_types = self.getobjheadername(type)
-        results = []
-        for rfile in self.files.itervalues():
-            root = rfile.root()
-            if root and root.value == 'OBJECT' and root.nargs() == 1 and root.args[0] in match_types:
-                results.append(root)
-        return results
+        return [rfile.root() for rfile in self.getobjfiles(type)]
     
     def getobj(self, pretty=None, type=None, exact_id=None):
         '''Get the first object token matching a given type and id. (If there's more 
@@ -393,25 +851,57 @@ class rawsqueryable_obj(rawsqueryable):
             CREATURE:X tokens showing up in entity_default.'''
             
         type, exact_id = rawsqueryable_obj.objpretty(pretty, type, exact_id)
-        for objecttoken in self.getobjheaders(type):
-            obj = objecttoken.get(exact_value=type, exact_args=(exact_id,))
-            if obj: return obj
+        for rfile in self.getobjfiles(type):
+            root = rfile.root()
+            for obj in rfile.getindex().getobjects(type, exact_id):
+                if obj is not root: return obj
         return None
         
-    def allobj(self, pretty=None, type=None, exact_id=None, re_id=None, id_in=None):
-        '''Gets all objects matching a given type and optional id or id regex.'''
+    def allobj(self, pretty=None, type=None, exact_id=None, re_id=None, id_in=None, has=None):
+        '''Gets all objects matching a given type and optional id, id regex, or
+        iterable containing ids. If has is given, only objects with properties
+        matching it are included. It can be a string, which is handled like the
+        pretty argument of getprop, or an iterable of them which must all be
+        matched. Objects without any properties having the right values are
+        skipped without looking at their properties.'''
+        
+        stamp = self.cachestamp()
+        key = rawsquerycache.key('allobj', pretty, type, exact_id, re_id, id_in, has) if stamp is not None else None
+        if key is None: return rawstokenlist(self.iterallobj(pretty, type, exact_id, re_id, id_in, has))
+        cache, version = stamp
+        result = cache.get(self, key, version)
+        if result is rawsquerycache.missing:
+            result = rawstokenlist(self.iterallobj(pretty, type, exact_id, re_id, id_in, has))
+            cache.put(self, key, version, result)
+        return rawstokenlist(result)
+        
+    def iterallobj(self, pretty=None, type=None, exact_id=None, re_id=None, id_in=None, has=None):
+        '''Iterate through the objects which the allobj method would get given the
+        same arguments. Each one is found only once the one before it has been
+        consumed.'''
         
         if re_id and id_in: raise ValueError
         type, exact_id = rawsqueryable_obj.objpretty(pretty, type, exact_id)
-        results = []
-        for objecttoken in self.getobjheaders(type):
-            for result in objecttoken.all(
-                exact_value=type, exact_args=(exact_id,) if exact_id else None,
-                re_args=(re_id,) if re_id else (('|'.join(id_in),) if id_in else None),
-                args_count=1
-            ):
-                results.append(result)
-        return results
+        if re_id: re_id = re.compile(re_id + '$')
+        if id_in: id_in = set(id_in)
+        if has is not None:
+            has = [rawsquery('getprop', prop) for prop in ((has,) if isinstance(has, basestring) else has)]
+        for rfile in self.getobjfiles(type):
+            root = rfile.root()
+            index = rfile.getindex()
+            if id_in and not exact_id:
+                # Look up each id rather than checking every object of the type
+                objs = [obj for id in id_in for obj in index.getobjects(type, id)]
+                if len(objs) > 1: objs.sort(key=lambda obj: obj.position)
+            else:
+                objs = list(index.getobjects(type, exact_id if exact_id else None))
+            for obj in objs:
+                if obj is not root and (
+                    (not re_id or re_id.match(obj.args[0])) and
+                    (not id_in or obj.args[0] in id_in) and
+                    (not has or all(query.execute(obj) is not None for query in has))
+                ):
+                    yield obj
         
     def objdict(self, *args, **kwargs):
         return {token.args[0]: token for token in self.allobj(*args, **kwargs)}
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+class rawsquerycache(object):
+    '''Remembers the results of quick queries so that running the same query on the
+    same object again gives the result without looking at any tokens. Every rawsfile
+    and rawsdir keeps a version number which increases whenever tokens are added,
+    removed, or changed, and each result is stored along with the version of what
+    was queried. Results whose version is out of date are never used.
+
+    Only a bounded number of results are kept, and when there are more than that the
+    least recently used ones are forgotten. The cache also counts how many times a
+    result was found and how many times it wasn't, which is helpful for profiling.'''
+
+    # Returned by get when there's no usable result, since None is a valid result
+    missing = object()
+
+    def __init__(self, maxsize=1024):
+        '''Constructs a rawsquerycache object.
+
+        maxsize: When more than this many results are stored, the least recently
+            used ones are forgotten.
+        '''
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, queryable, key, version):
+        '''Gets the result stored for a query on some object, or missing if there's
+        no result stored for it or the one stored is from a different version.'''
+        entry = self.entries.pop((id(queryable), key), None)
+        if entry is None or entry[1] != version:
+            self.misses += 1
+            return rawsquerycache.missing
+        # The entry keeps the object alive, so its id can't be reused in the meantime
+        self.entries[(id(queryable), key)] = entry
+        self.hits += 1
+        return entry[2]
+    def put(self, queryable, key, version, result):
+        '''Stores the result of a query on some object, then forgets the least
+        recently used results if there are more than the maximum.'''
+        self.entries[(id(queryable), key)] = (queryable, version, result)
+        while len(self.entries) > self.maxsize: self.entries.popitem(last=False)
+
+    def clear(self):
+        '''Forgets all stored results. The hit and miss counts are kept.'''
+        self.entries.clear()
+
+    @staticmethod
+    def key(*parts):
+        '''Gets a key identifying a query made from some arguments, converting lists,
+        sets, and dicts to hashable equivalents. Returns None if there's no usable
+        key, as when some argument is a token, since tokens compare by their text
+        and the text can change. Only strings, numbers, and None are accepted as
+        arguments, along with containers of them.'''
+        try:
+            return rawsquerycache.freeze(parts)
+        except TypeError:
+            return None
+    @staticmethod
+    def freeze(value):
+        # Utility method for converting an argument to something hashable, raises a
+        # TypeError for arguments that can't be part of a key
+        if isinstance(value, (list, tuple)):
+            return tuple(rawsquerycache.freeze(item) for item in value)
+        elif isinstance(value, (set, frozenset)):
+            return frozenset(rawsquerycache.freeze(item) for item in value)
+        elif isinstance(value, dict):
+            return frozenset((key, rawsquerycache.freeze(item)) for key, item in value.iteritems())
+        elif value is None or isinstance(value, (basestring, int, long, float)):
+            return value
+        else:
+            raise TypeError
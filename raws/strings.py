@@ -0,0 +1,61 @@
+import sys
+import __builtin__
+
+
+
+# Token values, arguments, and the text between tokens repeat many thousands of times
+# across a set of raws, e.g. every creature has its own [BODY] tokens and nearly every
+# token is preceded by the same run of newlines and tabs. The parser and the token
+# mutators pass strings through intern so that all copies of the same text share a
+# single object. Interned strings are freed once nothing refers to them anymore.
+
+def intern(string):
+    '''Gets the shared copy of a string. Objects which aren't plain strings, such as
+    unicode strings, are returned unchanged.
+
+    Example usage:
+        >>> a = raws.strings.intern(''.join(['CREATURE', '_TILE']))
+        >>> b = raws.strings.intern(''.join(['CREATURE_', 'TILE']))
+        >>> print a is b
+        True
+    '''
+    return __builtin__.intern(string) if type(string) is str else string
+
+def internlist(strings):
+    '''Gets a list of the shared copies of some strings.'''
+    return [__builtin__.intern(string) if type(string) is str else string for string in strings]
+
+
+
+def tokenstrings(token):
+    # Utility method for getting all the strings referred to by a token
+    strings = [token.value, token.prefix, token.suffix]
+    if token.argslist is None:
+        strings.append(token.argstext)
+    else:
+        strings.extend(token.argslist)
+    return strings
+
+def stats(tokens):
+    '''Reports how much memory is saved by interning for the strings referred to
+    by some tokens. Returns a tuple containing the number of references to strings,
+    the number of distinct string objects, and the number of bytes which would
+    have been used in addition if no two references shared the same object.
+
+    Example usage:
+        >>> tokens = raws.token.parse('[CASTE:MALE][MALE][CASTE:FEMALE][FEMALE]')
+        >>> references, unique, saved = raws.strings.stats(tokens)
+        >>> print references, unique
+        10 4
+    '''
+    references = 0
+    unique = {}
+    total = 0
+    for token in tokens:
+        for string in tokenstrings(token):
+            if isinstance(string, basestring):
+                size = sys.getsizeof(string)
+                references += 1
+                total += size
+                unique[id(string)] = size
+    return references, len(unique), total - sum(unique.itervalues())
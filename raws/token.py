@@ -1,9 +1,76 @@
+import re
+import gc
+import weakref
 import itertools
-from queryable import rawsqueryable, rawstokenlist
+from queryable import rawsqueryable, rawstokenlist, rawsquery
 from filters import rawstokenfilter
+from strings import intern, internlist
+from __builtin__ import intern as internstr
+
+class rawsargs(list):
+    '''List of a token's arguments which lets the token know when it's changed.'''
+    
+    __slots__ = ('tokenref',)
+    
+    def __init__(self, token, args=()):
+        list.__init__(self, args)
+        self.tokenref = weakref.ref(token)
+        
+    def __reduce__(self):
+        # Copies and pickles are plain lists
+        return (list, (list(self),))
+        
+    def mutator(method):
+        # Utility function for wrapping list methods which change the list
+        def mutate(self, *args, **kwargs):
+            token = self.tokenref()
+            if token is not None: token.argschanging()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if token is not None: token.argschanged()
+        mutate.__name__ = method.__name__
+        mutate.__doc__ = method.__doc__
+        return mutate
+        
+    __setitem__ = mutator(list.__setitem__)
+    __delitem__ = mutator(list.__delitem__)
+    __setslice__ = mutator(list.__setslice__)
+    __delslice__ = mutator(list.__delslice__)
+    __iadd__ = mutator(list.__iadd__)
+    __imul__ = mutator(list.__imul__)
+    append = mutator(list.append)
+    extend = mutator(list.extend)
+    insert = mutator(list.insert)
+    pop = mutator(list.pop)
+    remove = mutator(list.remove)
+    reverse = mutator(list.reverse)
+    sort = mutator(list.sort)
+    del mutator
+
+
 
 class rawstoken(rawsqueryable):
     
+    # A full set of raws makes hundreds of thousands of these, so attributes are stored in
+    # slots. The __dict__ slot is only allocated for tokens which have other attributes
+    # assigned to them by scripts. Parsed tokens keep the text of their arguments in
+    # argstext and only split it into argslist once the args attribute is accessed.
+    # The link to the parent rawsfile is a weak reference, shared by all of the file's
+    # tokens. Links between tokens are strong both ways, so a chain of tokens is kept
+    # alive through any one of them; the rawsfile owns its chain, and unlinks it when the
+    # file itself is freed so that the tokens are freed by reference counting instead of
+    # whenever the cyclic garbage collector gets around to them. Chains which don't
+    # belong to a file, such as those returned by parse, are left to the collector.
+    # The value, prefix, and suffix attributes are properties so that changes to them can
+    # be noticed, and offset is the position of the token's text in the data it was parsed
+    # from for as long as it's known to still be identical to that text. position orders
+    # tokens within their file once the file has been indexed; see rawsindex.
+    __slots__ = (
+        'prev', 'next', 'valuestr', 'argslist', 'argstext', 'prefixstr', 'suffixstr',
+        'offset', 'position', 'removed', 'fileref', '__dict__', '__weakref__'
+    )
+    
     auto_arg_docstring = '''
         auto: When the first argument is specified the intended assignment will be
             detected automatically. If a rawstoken is specified it will be treated
@@ -15,6 +82,16 @@ class rawstoken(rawsqueryable):
     # Don't allow these characters in a token's prefix or suffix
     illegal_external_chars = '['
     
+    # Matches the text between a token's braces; everything between two matches is a prefix
+    token_pattern = re.compile(r'\[([^\]]*)\]')
+    
+    # Used by addprop to find the property which new properties are added after, for objects
+    # other than INORGANIC and for INORGANIC objects respectively
+    addafterqueries = (
+        rawsquery('getlastprop', value_in=('COPY_TAGS_FROM',)),
+        rawsquery('getlastprop', value_in=('COPY_TAGS_FROM', 'USE_MATERIAL_TEMPLATE'))
+    )
+    
     @staticmethod
     def auto(auto, pretty, token, tokens):
         # Convenience function for handling method arguments
@@ -58,21 +135,108 @@ class rawstoken(rawsqueryable):
         if tokens is not None: raise ValueError
         if pretty:
             token = rawstoken.parseone(pretty, implicit_braces=True)
+        argstext = None
         if token:
             value = token.value
-            args = list(token.args) if token.args else []
+            if token.argslist is None:
+                argstext = token.argstext
+            else:
+                args = list(token.argslist)
             prefix = token.prefix
             suffix = token.suffix
         # tokens look like this: [value:arg1:arg2:...:argn]
+        self.offset = None          # position of the token's unchanged text in the data it was parsed from
+        self.position = None        # orders the token within its file
+        self.fileref = None
         self.prev = prev            # previous token sequentially
         self.next = next            # next token sequentially
-        self.value = value          # value for the token
-        self.args = args            # arguments for the token
-        self.prefix = prefix        # non-token text between the preceding token and this one
-        self.suffix = suffix        # between this token and the next/eof (should typically apply to eof)
+        self.valuestr = value       # value for the token
+        self.argslist = None        # arguments for the token, split from argstext when first needed
+        self.argstext = argstext
+        if argstext is None: self.args = args
+        self.prefixstr = prefix     # non-token text between the preceding token and this one
+        self.suffixstr = suffix     # between this token and the next/eof (should typically apply to eof)
         self.removed = False        # keeps track of whether this token has been removed yet
-        self.file = None            # parent rawsfile object
-        if not self.args: self.args = []
+        self.file = file            # parent rawsfile object
+        
+    @staticmethod
+    def lean(text, prefix):
+        # Utility method used by parse to construct tokens from the text between their braces
+        # without the overhead of handling constructor arguments; prev and next are linked
+        # afterwards in bulk, and arguments are split up only when they're first needed.
+        # Only for plain strings, which can be interned without checking their type.
+        token = rawstoken.__new__(rawstoken)
+        colon = text.find(':')
+        token.prev = None
+        token.next = None
+        token.argslist = None
+        if colon == -1:
+            token.valuestr = internstr(text)
+            token.argstext = None
+        else:
+            token.valuestr = internstr(text[:colon])
+            token.argstext = internstr(text[colon+1:])
+        token.prefixstr = internstr(prefix)
+        token.suffixstr = None
+        token.offset = None
+        token.position = None
+        token.removed = False
+        token.fileref = None
+        return token
+        
+    @staticmethod
+    def constructor(kwargs, data):
+        # Utility method used when parsing to get a function which constructs a token given the
+        # text between its braces and its prefix
+        if kwargs or type(data) is not str:
+            def construct(text, prefix):
+                tokenparts = internlist(text.split(':'))
+                return rawstoken(value=tokenparts[0], args=tokenparts[1:], prefix=intern(prefix), **kwargs)
+            return construct
+        else:
+            return rawstoken.lean
+        
+    def getargs(self):
+        '''Gets the token's list of arguments, which is also accessible as the args
+        attribute. Arguments of parsed tokens are split up the first time they're
+        needed. Changes made to the list are noticed by the token.
+        
+        Example usage:
+            >>> token = raws.token('EXAMPLE:a:b:c')
+            >>> print token.getargs()
+            ['a', 'b', 'c']
+            >>> print token.args
+            ['a', 'b', 'c']
+        '''
+        if self.argslist is None:
+            args = internlist(self.argstext.split(':')) if self.argstext is not None else ()
+            self.argslist = rawsargs(self, args)
+        return self.argslist
+    def setargs(self, args):
+        '''Sets the token's list of arguments, which is also assignable as the args
+        attribute.
+        
+        Example usage:
+            >>> token = raws.token('EXAMPLE:a:b:c')
+            >>> token.setargs(['x', 'y'])
+            >>> print token
+            [EXAMPLE:x:y]
+        '''
+        self.argschanging()
+        self.argslist = rawsargs(self, args if args is not None else ())
+        self.argstext = None
+        self.argschanged()
+    args = property(getargs, setargs)
+    
+    def getfile(self):
+        '''Gets the rawsfile this token belongs to, which is also accessible as the
+        file attribute, or None if it doesn't belong to one.'''
+        return self.fileref() if self.fileref is not None else None
+    def setfile(self, file):
+        '''Sets the rawsfile this token belongs to, which is also assignable as the
+        file attribute. Only a weak reference to it is kept.'''
+        self.fileref = weakref.ref(file) if file is not None else None
+    file = property(getfile, setfile)
     
     def nargs(self, count=None):
         '''When count is None, returns the number of arguments the token has. (Length of
@@ -88,7 +252,11 @@ class rawstoken(rawsqueryable):
             >>> print token.nargs(5)
             True
         '''
-        return len(self.args) if (count is None) else (len(self.args) == count)
+        if self.argslist is None:
+            length = self.argstext.count(':') + 1 if self.argstext is not None else 0
+        else:
+            length = len(self.argslist)
+        return length if (count is None) else (length == count)
         
     def getarg(self, index):
         '''Gets argument at index, returns None if the index is out of bounds.
@@ -121,7 +289,7 @@ class rawstoken(rawsqueryable):
             [EXAMPLE:a:b:500]'''
         valuestr = str(value)
         if any([char in valuestr for char in rawstoken.illegal_internal_chars]): raise ValueError
-        self.args[index] = valuestr
+        self.args[index] = intern(valuestr)
     def addarg(self, value):
         '''Appends an argument to the end of the argument list.
         
@@ -135,7 +303,7 @@ class rawstoken(rawsqueryable):
         '''
         valuestr = str(value)
         if any([char in valuestr for char in rawstoken.illegal_internal_chars]): raise ValueError
-        self.args.append(valuestr)
+        self.args.append(intern(valuestr))
     def argsstr(self):
         '''Return arguments joined by ':'.
         
@@ -144,7 +312,10 @@ class rawstoken(rawsqueryable):
             >>> print token.argsstr()
             a:b:c
         '''
-        return ':'.join([str(a) for a in self.args])
+        if self.argslist is None:
+            return self.argstext if self.argstext is not None else ''
+        else:
+            return ':'.join([str(a) for a in self.argslist])
         
     def getvalue(self):
         '''Get the token's value.
@@ -154,7 +325,7 @@ class rawstoken(rawsqueryable):
             >>> print token.getvalue()
             EXAMPLE
         '''
-        return self.value
+        return self.valuestr
     def setvalue(self, value):
         '''Set the token's value.
         
@@ -166,7 +337,12 @@ class rawstoken(rawsqueryable):
         '''
         valuestr = str(value)
         if any([char in valuestr for char in rawstoken.illegal_internal_chars]): raise ValueError
-        self.value = value
+        oldvalue = self.valuestr
+        self.valuestr = intern(value)
+        self.modified()
+        index = self.fileindex()
+        if index is not None and oldvalue != self.valuestr: index.change(self, oldvalue)
+    value = property(getvalue, setvalue)
         
     def getprefix(self):
         '''Get the comment text preceding a token.
@@ -180,7 +356,7 @@ class rawstoken(rawsqueryable):
             >>> print token.getsuffix()
              so is this
         '''
-        return self.prefix
+        return self.prefixstr
     def setprefix(self, value):
         '''Set the comment text preceding a token.
         
@@ -194,7 +370,9 @@ class rawstoken(rawsqueryable):
         '''
         valuestr = str(value)
         if any([char in valuestr for char in rawstoken.illegal_external_chars]): raise ValueError
-        self.prefix = value
+        self.prefixstr = intern(value)
+        self.modified()
+    prefix = property(getprefix, setprefix)
         
     def getsuffix(self):
         '''Get the comment text following a token.
@@ -208,7 +386,7 @@ class rawstoken(rawsqueryable):
             >>> print token.getprefix()
             This is a comment
         '''
-        return self.suffix
+        return self.suffixstr
     def setsuffix(self, value):
         '''Set the comment text following a token.
         
@@ -222,7 +400,49 @@ class rawstoken(rawsqueryable):
         '''
         valuestr = str(value)
         if any([char in valuestr for char in rawstoken.illegal_external_chars]): raise ValueError
-        self.suffix = value
+        self.suffixstr = intern(value)
+        self.modified()
+    suffix = property(getsuffix, setsuffix)
+        
+    def modified(self):
+        # Utility method called whenever the text of a token is changed
+        self.offset = None
+        file = self.file
+        if file is not None:
+            file.changed()
+            if self.prev is None: file.rootchanged()
+    def argschanging(self):
+        # Utility method called by rawsargs before the token's arguments are changed
+        index = self.fileindex()
+        if index is not None:
+            index.discardobject(self, self.valuestr)
+            index.discardargs(self)
+    def argschanged(self):
+        # Utility method called by rawsargs after the token's arguments were changed
+        self.modified()
+        index = self.fileindex()
+        if index is not None:
+            index.insertobject(self)
+            index.insertargs(self)
+    def propextent(self):
+        # Utility method used by property queries for finding where this object's properties
+        # end and which values they have, using the index of its file
+        file = self.file
+        if file is None or self.removed: return None
+        index = file.getindex()
+        end, bits = index.summary(self, self.argsprops())
+        return index, end, bits
+    def fileindex(self):
+        # Utility method for getting the rawsindex of the token's file if it has one
+        file = self.file
+        return file.index if file is not None else None
+    def length(self):
+        # Utility method for getting the length of the text a token was parsed from
+        length = len(self.valuestr) + 2
+        if self.argstext is not None: length += len(self.argstext) + 1
+        if self.prefixstr: length += len(self.prefixstr)
+        if self.suffixstr: length += len(self.suffixstr)
+        return length
         
     def arg(self):
         '''When a token is expected to have only one argument, this method can be used
@@ -250,9 +470,9 @@ class rawstoken(rawsqueryable):
         return hash('%s:%s' % (self.value, self.argsstr()) if self.nargs() else self.value)
     
     def __str__(self):
-        return '[%s%s]' %(self.value, (':%s' % self.argsstr()) if self.args and len(self.args) else '')
+        return '[%s%s]' %(self.valuestr, (':%s' % self.argsstr()) if self.nargs() else '')
     def __repr__(self):
-        return '%s%s%s' % (self.prefix if self.prefix else '', str(self), self.suffix if self.suffix else '')
+        return '%s%s%s' % (self.prefixstr if self.prefixstr else '', str(self), self.suffixstr if self.suffixstr else '')
     def __eq__(self, other):
         return self.equals(other)
     def __ne__(self, other):
@@ -361,8 +581,27 @@ class rawstoken(rawsqueryable):
             yield itertoken
             itertoken = itertoken.prev if reverse else itertoken.next
             count += 1
-            
-    @staticmethod   
+
+    def cachestamp(self):
+        file = self.file
+        if file is None or self.removed: return None
+        dir = file.dir
+        if dir is None or dir.querycache is None: return None
+        return dir.querycache, file.version
+    def scope(self, range=None, include_self=False, reverse=False, until_token=None):
+        file = self.file
+        if range is not None or file is None or self.removed: return None
+        if until_token is not None and (until_token.file is not file or until_token.removed): return None
+        file.getindex()
+        if reverse:
+            low, high = None, self.position + 1 if include_self else self.position
+            if until_token is not None and until_token.position < high: low = until_token.position + 1
+        else:
+            low, high = self.position if include_self else self.position + 1, None
+            if until_token is not None and until_token.position >= low: high = until_token.position
+        return ((file, low, high, reverse),)
+
+    @staticmethod
     def iter(root, tail):
         '''Iterate through tokens starting with root and ending at tail.
         
@@ -451,11 +690,9 @@ class rawstoken(rawsqueryable):
                 [CV_REMOVE_TAG:CHANGE_BODY_SIZE_PERC]
         '''
         
-        if self.value == 'INORGANIC':
-            aftervalues = ('COPY_TAGS_FROM', 'USE_MATERIAL_TEMPLATE')
-        else:
-            aftervalues = ('COPY_TAGS_FROM',)
-        addafter = self.getlastprop(value_in=aftervalues)
+        # Objects remember the extent of their properties and which values those have, so
+        # for most objects this finds right away that the token goes immediately after them
+        addafter = rawstoken.addafterqueries[self.value == 'INORGANIC'].run(self)
         if not addafter: addafter = self
         addafter.add(auto=auto, **kwargs)
     
@@ -477,33 +714,77 @@ class rawstoken(rawsqueryable):
                 last = token
             return first, last            
         
+    @staticmethod
+    def link(tokens):
+        '''Utility method for linking the prev and next attributes of a sequence of tokens
+        in order. Tokens at either end keep their outward links.
+        
+        Example usage:
+            >>> tokens = [raws.token('ONE'), raws.token('TWO'), raws.token('THREE')]
+            >>> raws.token.link(tokens)
+            >>> print list(tokens[0].tokens(include_self=True))
+            [[ONE], [TWO], [THREE]]
+        '''
+        prevtoken = None
+        for token in tokens:
+            if prevtoken is not None:
+                prevtoken.next = token
+                token.prev = prevtoken
+            prevtoken = token
+        
     def addone(self, token, reverse=False):
         # Utility method called by add when adding a single token
+        token.fileref = self.fileref
+        token.offset = None
         if reverse:
             token.next = self
             token.prev = self.prev
-            if self.prev: self.prev.next = token
+            if self.prev:
+                self.prev.next = token
+            else:
+                self.headchanged(token)
             self.prev = token
         else:
             token.prev = self
             token.next = self.next
             if self.next: self.next.prev = token
             self.next = token
+        file = self.file
+        if file is not None:
+            file.changed()
+            if file.index is not None: file.index.add((token,))
         return token
     def addall(self, tokens, reverse=False):
         # Utility method called by add when adding multiple tokens
         first, last = rawstoken.firstandlast(tokens)
+        for token in tokens:
+            token.fileref = self.fileref
+            token.offset = None
         if reverse:
             last.next = self
             first.prev = self.prev
-            if self.prev: self.prev.next = first
+            if self.prev:
+                self.prev.next = first
+            else:
+                self.headchanged(first)
             self.prev = last
         else:
             first.prev = self
             last.next = self.next
             if self.next: self.next.prev = tokens[-1]
             self.next = first
+        file = self.file
+        if file is not None:
+            file.changed()
+            if file.index is not None: file.index.add(tokens)
         return tokens
+    def headchanged(self, token):
+        # Utility method called when this token stops being the first in its file, since
+        # the file keeps track of its first token
+        file = self.file
+        if file is not None and file.roottoken is self:
+            file.roottoken = token
+            file.rootchanged()
     
     def remove(self, count=0, reverse=False):
         '''Removes this token and the next count tokens in the direction indicated by reverse.
@@ -528,11 +809,13 @@ class rawstoken(rawsqueryable):
         if not self.removed:
             left = self.prev
             right = self.next
+            removed = [self]
             if count:
                 token = self.prev if reverse else self.next
                 while count and token:
                     count -= 1
                     token.removed = True
+                    removed.append(token)
                     token = token.prev if reverse else token.next
                 if reverse:
                     left = token
@@ -540,6 +823,14 @@ class rawstoken(rawsqueryable):
                     right = token
             if left: left.next = right
             if right: right.prev = left
+            file = self.file
+            if file is not None:
+                file.changed()
+                if left is None:
+                    file.roottoken = right
+                    file.rootchanged()
+                if right is None: file.tailtoken = left
+                if file.index is not None: file.index.remove(removed)
             self.removed = True
     
     @staticmethod
@@ -564,8 +855,6 @@ class rawstoken(rawsqueryable):
             [BEAUTIFUL] 
         '''
 
-        tokens = rawstokenlist()    # maintain a sequential list of tokens
-        pos = 0                     # byte position in data
         if data.find('[') == -1 and data.find(']') == -1:
             if implicit_braces:
                 tokenparts = data.split(':')
@@ -574,36 +863,184 @@ class rawstoken(rawsqueryable):
                     args=tokenparts[1:],
                     **kwargs
                 )
+                tokens = rawstokenlist()
                 tokens.append(token)
                 return tokens
             else:
                 raise ValueError
         else:
-            while pos < len(data):
-                token = None
-                open = data.find('[', pos)
-                if open >= 0 and open < len(data):
-                    close = data.find(']', open)
-                    if close >= 0 and close < len(data):
-                        prefix = data[pos:open]
-                        tokentext = data[open+1:close]
-                        tokenparts = tokentext.split(':')
-                        token = rawstoken(
-                            value=tokenparts[0],
-                            args=tokenparts[1:],
-                            prefix=prefix,
-                            prev=tokens[-1] if len(tokens) else None,
-                            **kwargs
-                        )
-                        pos = close+1
-                if token:
-                    if len(tokens): tokens[-1].next = token
-                    tokens.append(token)
-                else:
-                    break
-            if len(tokens) and pos<len(data):
-                tokens[-1].suffix = data[pos:]
-            return tokens
+            return rawstoken.fromparts(rawstoken.split(data), **kwargs)
+            
+    @staticmethod
+    def split(data):
+        '''Does the pattern matching part of parsing a string containing tokens. The
+        result is a list of alternating prefixes and token texts, followed by whatever
+        trails after the last token. It's made of plain strings so it can be cheaply
+        passed between processes, and fromparts turns it into tokens.
+        
+        Example usage:
+            >>> print raws.token.split('[WHAT] a [BEAUTIFUL][DAY]')
+            ['', 'WHAT', ' a ', 'BEAUTIFUL', '', 'DAY', '']
+        '''
+        return rawstoken.token_pattern.split(data)
+        
+    @staticmethod
+    def fromparts(parts, **kwargs):
+        '''Builds a list of linked tokens from the output of the split static method.
+        **kwargs are passed to the constructor for each token.
+        
+        Example usage:
+            >>> parts = raws.token.split('[WHAT] a [BEAUTIFUL][DAY]')
+            >>> print raws.token.fromparts(parts)
+            [WHAT] a [BEAUTIFUL][DAY]
+        '''
+        tokens = rawstokenlist()    # maintain a sequential list of tokens
+        construct = rawstoken.constructor(kwargs, parts[0])
+        append = tokens.append
+        # Building tokens would otherwise set off the cyclic garbage collector many
+        # times over, each time traversing every token made so far, though the only
+        # cycles parsing creates are the links between the tokens themselves.
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            offset = 0
+            for i in xrange(1, len(parts), 2):
+                token = construct(parts[i], parts[i-1])
+                token.offset = offset
+                offset += len(parts[i-1]) + len(parts[i]) + 2
+                append(token)
+            rawstoken.link(tokens)
+        finally:
+            if gcenabled: gc.enable()
+        if len(tokens) and parts[-1]:
+            tokens[-1].suffixstr = parts[-1]
+        return tokens
+
+    @staticmethod
+    def pack(parts):
+        '''Turns the output of the split static method into a compact form from which
+        unpack can build tokens without doing any more splitting. It's a tuple of the
+        interned values, argument texts, and prefixes of each token, where they start
+        in the data, and whatever trails after the last token, all of which marshal
+        can store and load quickly. Strings are kept interned when marshalled.
+
+        Example usage:
+            >>> parts = raws.token.split('[WHAT] a [BEAUTIFUL:DAY]')
+            >>> print raws.token.pack(parts)
+            (['WHAT', 'BEAUTIFUL'], [None, 'DAY'], ['', ' a '], [0, 6], '')
+        '''
+        values, argstexts, prefixes, offsets = [], [], [], []
+        offset = 0
+        for i in xrange(1, len(parts), 2):
+            text, prefix = parts[i], parts[i-1]
+            colon = text.find(':')
+            if colon == -1:
+                values.append(internstr(text))
+                argstexts.append(None)
+            else:
+                values.append(internstr(text[:colon]))
+                argstexts.append(internstr(text[colon+1:]))
+            prefixes.append(internstr(prefix))
+            offsets.append(offset)
+            offset += len(prefix) + len(text) + 2
+        return values, argstexts, prefixes, offsets, parts[-1]
+
+    @staticmethod
+    def unpack(packed):
+        '''Builds a list of linked tokens from the output of the pack static method.
+        The result is the same as fromparts would give for the parts that were packed.
+
+        Example usage:
+            >>> packed = raws.token.pack(raws.token.split('[WHAT] a [BEAUTIFUL][DAY]'))
+            >>> print raws.token.unpack(packed)
+            [WHAT] a [BEAUTIFUL][DAY]
+        '''
+        values, argstexts, prefixes, offsets, suffix = packed
+        tokens = rawstokenlist()
+        append = tokens.append
+        new = rawstoken.__new__
+        # See fromparts for why the garbage collector is disabled here
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            for value, argstext, prefix, offset in itertools.izip(values, argstexts, prefixes, offsets):
+                token = new(rawstoken)
+                token.prev = None
+                token.next = None
+                token.valuestr = value
+                token.argslist = None
+                token.argstext = argstext
+                token.prefixstr = prefix
+                token.suffixstr = None
+                token.offset = offset
+                token.position = None
+                token.removed = False
+                token.fileref = None
+                append(token)
+            rawstoken.link(tokens)
+        finally:
+            if gcenabled: gc.enable()
+        if len(tokens) and suffix:
+            tokens[-1].suffixstr = suffix
+        return tokens
+
+    @staticmethod
+    def iterparse(stream, chunksize=65536, link=True, **kwargs):
+        '''Parses tokens from a file-like object, reading it in chunks and yielding
+        each token once it's complete. Unlike parse, the whole input never needs to
+        be in memory at once. Like parse with implicit_braces=False, an exception is
+        raised if the input isn't empty but contains no braces at all.
+        
+        stream: Object with a read method, such as a file. The header line of a raws
+            file should be read from it beforehand.
+        chunksize: Number of bytes to read from the stream at a time.
+        link: If True, the yielded tokens are linked to each other just like the
+            tokens in a list returned by parse, and the whole sequence is kept alive
+            for as long as its first token is. Scans which should only hold onto a
+            bounded number of tokens at a time should set this to False.
+        **kwargs: Extra named arguments are passed to the constructor each time a new
+            rawstoken is distinguished and created.
+        
+        Example usage:
+            >>> import StringIO
+            >>> stream = StringIO.StringIO('[WHAT] a [BEAUTIFUL][DAY]')
+            >>> for token in raws.token.iterparse(stream, chunksize=4):
+            ...     print repr(token)
+            ...
+            [WHAT] a 
+            [BEAUTIFUL]
+            [DAY]
+        '''
+        construct = None
+        buffer = ''
+        braces = False
+        prevtoken = None
+        while True:
+            chunk = stream.read(chunksize)
+            if chunk:
+                buffer += chunk
+                braces = braces or chunk.find('[') != -1 or chunk.find(']') != -1
+            # A match is always a complete token, since its prefix ends at the first opening
+            # brace and its text at the first closing brace following that; whatever is left
+            # over may be the beginning of a token split across chunks.
+            parts = rawstoken.split(buffer)
+            if construct is None and len(parts) > 1: construct = rawstoken.constructor(kwargs, buffer)
+            for i in xrange(1, len(parts), 2):
+                token = construct(parts[i], parts[i-1])
+                if prevtoken is not None:
+                    if link:
+                        prevtoken.next = token
+                        token.prev = prevtoken
+                    # Tokens are held back by one so the last can get its suffix before being yielded
+                    yield prevtoken
+                prevtoken = token
+            buffer = parts[-1]
+            if not chunk: break
+        if prevtoken is not None:
+            if buffer: prevtoken.suffixstr = buffer
+            yield prevtoken
+        elif buffer and not braces:
+            raise ValueError
             
     @staticmethod
     def parseone(*args, **kwargs):
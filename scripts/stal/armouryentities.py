@@ -8,24 +8,31 @@ import raws
 
 print 'And so it begins.'
 
-entities = raws.dir(path='StalsArmouryPackv1_8a_4024')['entity_default']
+itemtypes = ('AMMO', 'DIGGER', 'TOOL', 'WEAPON', 'ARMOR', 'PANTS', 'GLOVES', 'SHOES', 'HELM', 'SHIELD')
 
 edict = {}
-
-for entity in entities.all(exact_value='ENTITY'):
-    print 'Entity: %s' % entity
-    itemtypes = ('AMMO', 'DIGGER', 'TOOL', 'WEAPON', 'ARMOR', 'PANTS', 'GLOVES', 'SHOES', 'HELM', 'SHIELD')
-    edict[entity.args[0]] = {}
-    entitydict = edict[entity.args[0]]
-    for item in entity.alluntil(value_in=itemtypes, until_exact_value='ENTITY'):
-        if item.value == 'AMMO':
-            if item.value not in entitydict: entitydict[item.value] = {}
-            forweapon = item.get(exact_value='WEAPON', reverse=True).args[0]
-            if forweapon not in entitydict[item.value]: entitydict[item.value][forweapon] = []
-            entitydict[item.value][forweapon].append(item.args[0])
-        else:
-            if item.value not in entitydict: entitydict[item.value] = []
-            entitydict[item.value].append(item.args[0])
+entitydict = None
+lastweapon = None
+
+# Tokens are streamed from the file rather than loaded all at once, so keep track of the
+# current entity and the most recent weapon (which AMMO tokens refer to) while going along.
+with open('StalsArmouryPackv1_8a_4024/entity_default.txt', 'rb') as entities:
+    entities.readline() # Skip the header
+    for token in raws.token.iterparse(entities, link=False):
+        if token.value == 'ENTITY':
+            print 'Entity: %s' % token
+            edict[token.args[0]] = {}
+            entitydict = edict[token.args[0]]
+        elif token.value in itemtypes and entitydict is not None:
+            if token.value == 'AMMO':
+                if token.value not in entitydict: entitydict[token.value] = {}
+                if lastweapon not in entitydict[token.value]: entitydict[token.value][lastweapon] = []
+                entitydict[token.value][lastweapon].append(token.args[0])
+            else:
+                if token.value not in entitydict: entitydict[token.value] = []
+                entitydict[token.value].append(token.args[0])
+        if token.value == 'WEAPON':
+            lastweapon = token.args[0]
 
 print edict
 
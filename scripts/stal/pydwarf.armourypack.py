@@ -144,7 +144,7 @@ def addreactions(dfraws, armouryraws):
     if armouryreactions:
         if 'stal_reaction_armoury' not in dfraws.files:
             armouryreactions.header = 'stal_reaction_armoury'
-            dfraws.files['stal_reaction_armoury'] = armouryreactions
+            dfraws.setfile('stal_reaction_armoury', armouryreactions)
         else:
             pydwarf.log.error('DF raws already contain stal_reaction_armory.')
     else:
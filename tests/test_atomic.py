@@ -0,0 +1,102 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+import raws
+
+
+
+class testatomic(unittest.TestCase):
+    '''Checks that atomic writes leave the output directory as it was when writing
+    or moving files into place fails, and that staging directories left by
+    interrupted writes are removed while those still in use are not.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.outputpath = os.path.join(self.path, 'out')
+        os.makedirs(self.outputpath)
+        self.dir = raws.dir()
+        for name in ('creature_a', 'creature_b', 'creature_c'):
+            self.dir.addfile(rfile=raws.file(header=name, tokens=raws.token.parse('[OBJECT:CREATURE][CREATURE:%s]' % name.upper())))
+        self.dir.write(self.outputpath)
+        self.before = self.contents()
+        for token in self.dir.all(exact_value='CREATURE'): token.args[0] = 'CHANGED'
+        self.dirmodule = sys.modules['raws.dir']
+        self.replacefile, self.link = self.dirmodule.replacefile, getattr(os, 'link', None)
+
+    def tearDown(self):
+        self.dirmodule.replacefile = self.replacefile
+        if self.link is not None: os.link = self.link
+        shutil.rmtree(self.path)
+
+    def contents(self):
+        contents = {}
+        for filename in os.listdir(self.outputpath):
+            with open(os.path.join(self.outputpath, filename), 'rb') as rfile: contents[filename] = rfile.read()
+        return contents
+    def failreplacing(self, count):
+        # Makes moving files into place fail once, after the given number of them were moved
+        moved = [0]
+        def replacefile(source, target):
+            moved[0] += 1
+            if moved[0] == count + 1: raise OSError('Failed to replace %s.' % target)
+            self.replacefile(source, target)
+        self.dirmodule.replacefile = replacefile
+
+    def test_written(self):
+        with open(os.path.join(self.outputpath, 'stale.txt'), 'wb') as rfile: rfile.write('stale')
+        with open(os.path.join(self.outputpath, 'other.dat'), 'wb') as rfile: rfile.write('other')
+        self.dir.write(self.outputpath, atomic=True)
+        contents = self.contents()
+        self.assertEqual(sorted(contents), ['creature_a.txt', 'creature_b.txt', 'creature_c.txt', 'other.dat'])
+        self.assertIn('[CREATURE:CHANGED]', contents['creature_b.txt'])
+        self.assertEqual(os.listdir(self.path), ['out'])
+
+    def test_failedwrite(self):
+        def write(outfile):
+            raise IOError('Failed to write.')
+        self.dir.files['creature_c'].write = write
+        self.assertRaises(IOError, self.dir.write, self.outputpath, atomic=True, threads=2)
+        self.assertEqual(self.contents(), self.before)
+        self.assertEqual(os.listdir(self.path), ['out'])
+
+    def test_rollback(self):
+        self.failreplacing(2)
+        self.assertRaises(OSError, self.dir.write, self.outputpath, atomic=True)
+        self.assertEqual(self.contents(), self.before)
+        self.assertEqual(os.listdir(self.path), ['out'])
+
+    def test_rollbacknolink(self):
+        # Where links aren't supported old files are moved aside instead
+        if self.link is not None: del os.link
+        self.failreplacing(1)
+        self.assertRaises(OSError, self.dir.write, self.outputpath, atomic=True)
+        self.assertEqual(self.contents(), self.before)
+        self.assertEqual(os.listdir(self.path), ['out'])
+
+    def test_leftover(self):
+        # A staging directory whose process is gone, another whose process is still
+        # writing, and one belonging to a different output directory
+        os.makedirs(os.path.join(self.path, 'out.1.staging'))
+        os.makedirs(os.path.join(self.path, 'outer.1.staging'))
+        writer = subprocess.Popen(
+            [sys.executable, '-c', 'import os, sys, raws; lock = raws.lock("%s.%d.lock" % (sys.argv[1], os.getpid())); lock.acquire(); os.makedirs("%s.%d.staging" % (sys.argv[1], os.getpid())); print "writing"; sys.stdout.flush(); sys.stdin.read()', self.outputpath],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        try:
+            self.assertEqual(writer.stdout.readline().strip(), 'writing')
+            self.dir.write(self.outputpath, atomic=True)
+            self.assertEqual(sorted(os.listdir(self.path)), sorted(['out', 'out.%d.lock' % writer.pid, 'out.%d.staging' % writer.pid, 'outer.1.staging']))
+        finally:
+            writer.stdin.close()
+            writer.wait()
+        # Once the writer is gone its staging directory is left over too
+        self.dir.write(self.outputpath, atomic=True)
+        self.assertEqual(sorted(os.listdir(self.path)), ['out', 'outer.1.staging'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
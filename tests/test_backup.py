@@ -0,0 +1,154 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+import raws
+from backup import backupstore
+
+
+
+class testbackup(unittest.TestCase):
+    '''Checks that snapshots store each file's contents once and aren't made when
+    nothing changed, that restoring brings back contents and modification times as
+    copies which can be written without changing the backup, and that pruning and
+    collecting remove only what no snapshot refers to.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.inputpath = os.path.join(self.path, 'in')
+        self.store = backupstore(os.path.join(self.path, 'bak'))
+        os.makedirs(os.path.join(self.inputpath, 'sub'))
+        for name in ('creature_a', 'creature_b'):
+            self.writetext(os.path.join(self.inputpath, '%s.txt' % name), '%s\n\n[OBJECT:CREATURE]\n[CREATURE:%s]\n' % (name, name.upper()))
+        shutil.copyfile(self.inpath('creature_a.txt'), self.inpath('sub', 'creature_a.txt'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writetext(self, path, text):
+        with open(path, 'wb') as rfile: rfile.write(text)
+    def readtext(self, path):
+        with open(path, 'rb') as rfile: return rfile.read()
+    def inpath(self, *names):
+        return os.path.join(self.inputpath, *names)
+    def blobs(self):
+        return sorted(
+            prefix + filename for prefix in os.listdir(self.store.blobspath)
+            if os.path.isdir(os.path.join(self.store.blobspath, prefix))
+            for filename in os.listdir(os.path.join(self.store.blobspath, prefix))
+        )
+    def contents(self, path):
+        contents = {}
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                contents[os.path.relpath(filepath, path)] = (self.readtext(filepath), os.stat(filepath).st_mtime)
+        return contents
+
+    def test_snapshot(self):
+        first = self.store.snapshot(self.inputpath)
+        # Files with the same contents are stored once
+        self.assertEqual(len(self.blobs()), 2)
+        self.assertEqual(self.store.snapshot(self.inputpath), first)
+        self.assertEqual(self.store.snapshots(), [first])
+        self.writetext(self.inpath('creature_b.txt'), 'creature_b\n\n[OBJECT:CREATURE]\n[CREATURE:CREATURE_BEAR]\n')
+        second = self.store.snapshot(self.inputpath)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.store.snapshots(), [first, second])
+        self.assertEqual(len(self.blobs()), 3)
+        treepath = os.path.join(self.store.snapshotspath, first, 'creature_b.txt')
+        self.assertEqual(self.readtext(treepath), 'creature_b\n\n[OBJECT:CREATURE]\n[CREATURE:CREATURE_B]\n')
+
+    def test_restore(self):
+        name = self.store.snapshot(self.inputpath)
+        before = self.contents(self.inputpath)
+        self.writetext(self.inpath('creature_a.txt'), 'changed')
+        os.remove(self.inpath('creature_b.txt'))
+        self.writetext(self.inpath('extra.txt'), 'extra')
+        # Paths read from config.json are unicode
+        self.store.restore(unicode(self.inputpath), name)
+        after = self.contents(self.inputpath)
+        self.assertEqual(sorted(after), sorted(before))
+        for relpath, (text, mtime) in before.iteritems():
+            self.assertEqual(after[relpath][0], text)
+            self.assertLess(abs(after[relpath][1] - mtime), 0.001)
+        # Restoring leaves files looking as they did, so no new snapshot is made
+        self.assertEqual(self.store.snapshot(self.inputpath), name)
+
+    def test_writerestored(self):
+        name = self.store.snapshot(self.inputpath)
+        blobs = {digest: self.readtext(self.store.blobpath(digest)) for digest in self.blobs()}
+        treepath = os.path.join(self.store.snapshotspath, name)
+        tree = self.contents(treepath)
+        self.store.restore(self.inputpath, name)
+        # Writing the restored raws in place mustn't change what's in the backup
+        dir = raws.dir(path=self.inputpath)
+        dir.get('CREATURE:CREATURE_A').setarg(0, 'CREATURE_E')
+        dir.write(self.inputpath, incremental=True)
+        self.assertIn('[CREATURE:CREATURE_E]', self.readtext(self.inpath('creature_a.txt')))
+        self.assertEqual({digest: self.readtext(self.store.blobpath(digest)) for digest in self.blobs()}, blobs)
+        self.assertEqual(self.contents(treepath), tree)
+        for dirpath, dirnames, filenames in os.walk(self.inputpath):
+            for filename in filenames:
+                self.assertEqual(os.stat(os.path.join(dirpath, filename)).st_nlink, 1)
+
+    def test_prune(self):
+        names = []
+        for index in xrange(3):
+            self.writetext(self.inpath('creature_b.txt'), 'creature_b' + '!' * index)
+            names.append(self.store.snapshot(self.inputpath))
+        self.assertEqual(len(self.blobs()), 4)
+        self.store.prune(1)
+        self.assertEqual(self.store.snapshots(), names[-1:])
+        self.assertEqual(sorted(os.listdir(self.store.snapshotspath)), [names[-1], '%s.json' % names[-1]])
+        self.assertEqual(len(self.blobs()), 2)
+
+    def test_collect(self):
+        self.store.snapshot(self.inputpath)
+        blobs = self.blobs()
+        stray = os.path.join(self.store.blobspath, 'ff')
+        os.makedirs(stray)
+        self.writetext(os.path.join(stray, 'f' * 38), 'stray')
+        self.writetext(os.path.join(self.store.blobspath, 'stray.txt'), 'stray')
+        self.writetext(os.path.join(self.store.temppath, '1.tmp'), 'interrupted')
+        os.makedirs(os.path.join(self.store.snapshotspath, 'unfinished'))
+        self.store.collect()
+        self.assertEqual(self.blobs(), blobs)
+        self.assertEqual(os.listdir(self.store.temppath), [])
+        self.assertNotIn('unfinished', os.listdir(self.store.snapshotspath))
+
+    def test_unreadable(self):
+        first = self.store.snapshot(self.inputpath)
+        self.writetext(self.inpath('creature_b.txt'), 'changed')
+        self.store.snapshot(self.inputpath)
+        blobs = self.blobs()
+        self.writetext(self.store.indexpath(first), '{')
+        # There's no telling which blobs the unreadable snapshot needs, so all are kept
+        self.store.collect()
+        self.assertEqual(self.blobs(), blobs)
+
+    def test_lock(self):
+        holder = subprocess.Popen(
+            [sys.executable, '-c', 'import sys, raws; lock = raws.lock(sys.argv[1]); lock.acquire(); print "held"; sys.stdout.flush(); sys.stdin.read()', self.store.lock.path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        try:
+            self.assertEqual(holder.stdout.readline().strip(), 'held')
+            self.assertFalse(self.store.lock.acquire(blocking=False))
+        finally:
+            holder.stdin.close()
+            holder.wait()
+        # The lock is let go of when the process holding it ends
+        self.assertTrue(self.store.lock.acquire(blocking=False))
+        self.assertTrue(self.store.lock.acquire(blocking=False))
+        self.store.lock.release()
+        self.assertTrue(self.store.lock.held())
+        self.store.lock.release()
+        self.assertFalse(self.store.lock.held())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
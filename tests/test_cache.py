@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+import raws
+
+
+
+class countingcache(raws.cache):
+    # Cache which counts how many times it's trimmed
+    def __init__(self, *args, **kwargs):
+        super(countingcache, self).__init__(*args, **kwargs)
+        self.trims = 0
+    def trim(self, maxsize=None):
+        self.trims += 1
+        return super(countingcache, self).trim(maxsize)
+
+
+
+class testcache(unittest.TestCase):
+    '''Checks that raws read using a rawscache are the same as those read without
+    one, including when files change in ways their size and modification time
+    don't show.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.rawspath = os.path.join(self.path, 'raws')
+        os.makedirs(self.rawspath)
+        self.cache = countingcache(os.path.join(self.path, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writeraws(self, name, text, mtime=None):
+        filepath = os.path.join(self.rawspath, '%s.txt' % name)
+        with open(filepath, 'wb') as rfile: rfile.write(text)
+        if mtime is not None: os.utime(filepath, (mtime, mtime))
+        return filepath
+
+    def written(self, dir):
+        # Get the text of each file as it would be written
+        outpath = os.path.join(self.path, 'out')
+        if os.path.exists(outpath): shutil.rmtree(outpath)
+        os.makedirs(outpath)
+        dir.write(outpath)
+        texts = {}
+        for filename in os.listdir(outpath):
+            with open(os.path.join(outpath, filename), 'rb') as rfile: texts[filename] = rfile.read()
+        return texts
+
+    def test_hits(self):
+        self.writeraws('creature_a', 'creature_a\n\n[OBJECT:CREATURE]\n\n[CREATURE:A]\n    [NAME:a]\n')
+        self.writeraws('creature_b', 'creature_b\n\n[OBJECT:CREATURE]\n\n[CREATURE:B]\n    [NAME:b]\n')
+        first = raws.dir(path=self.rawspath, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        second = raws.dir(path=self.rawspath, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+        self.assertEqual([str(token) for token in second.tokens()], [str(token) for token in first.tokens()])
+        # Touching a file without changing it still hits
+        filepath = os.path.join(self.rawspath, 'creature_a.txt')
+        os.utime(filepath, (1000000000, 1000000000))
+        raws.dir(path=self.rawspath, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (4, 2))
+
+    def test_stale(self):
+        # A change which keeps the file's size and modification time must not use the old entry
+        filepath = self.writeraws('creature_a', 'creature_a\n\n[CREATURE:AAAA][NAME:xx]\n', mtime=1000000000)
+        raws.dir(path=self.rawspath, cache=self.cache)
+        self.writeraws('creature_a', 'creature_a\n\n[CREATURE:BBBB][NAME:zz]\n', mtime=1000000000)
+        self.assertEqual(os.path.getsize(filepath), len('creature_a\n\n[CREATURE:AAAA][NAME:xx]\n'))
+        dir = raws.dir(path=self.rawspath, cache=self.cache)
+        self.assertEqual([str(token) for token in dir.tokens()], ['[CREATURE:BBBB]', '[NAME:zz]'])
+        self.assertEqual(self.written(dir), {'creature_a.txt': 'creature_a\n\n[CREATURE:BBBB][NAME:zz]\n'})
+        dir.get('NAME').args[0] = 'yy'
+        self.assertEqual(self.written(dir), {'creature_a.txt': 'creature_a\n\n[CREATURE:BBBB][NAME:yy]\n'})
+
+    def test_lazy(self):
+        self.writeraws('creature_a', 'creature_a\n[CREATURE:A][NAME:a]')
+        raws.dir(path=self.rawspath, cache=self.cache, lazy=True).tokens().next()
+        dir = raws.dir(path=self.rawspath, cache=self.cache, lazy=True)
+        self.assertEqual([str(token) for token in dir.tokens()], ['[CREATURE:A]', '[NAME:a]'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_trim(self):
+        # The cache is trimmed once per directory read, not once per file
+        for number in xrange(5): self.writeraws('file_%d' % number, 'file_%d\n[A:%d]' % (number, number))
+        raws.dir(path=self.rawspath, cache=self.cache)
+        self.assertEqual(self.cache.trims, 1)
+        raws.dir(path=self.rawspath, cache=self.cache, processes=2)
+        self.assertEqual(self.cache.trims, 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (5, 5))
+        self.cache.trim(maxsize=0)
+        self.assertEqual(self.cache.size(), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+import raws
+
+
+
+class testincremental(unittest.TestCase):
+    '''Checks that incremental writes skip files whose output is up to date, copy
+    unchanged files whose output isn't, write changed files, and remove only the
+    text files which no longer belong in the output directory.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.inputpath = os.path.join(self.path, 'in')
+        self.outputpath = os.path.join(self.path, 'out')
+        os.makedirs(self.inputpath)
+        os.makedirs(self.outputpath)
+        for name in ('creature_a', 'creature_b', 'creature_c'):
+            self.writetext(os.path.join(self.inputpath, '%s.txt' % name), '%s\n\n[OBJECT:CREATURE]\n[CREATURE:%s]\n' % (name, name.upper()))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writetext(self, path, text):
+        with open(path, 'wb') as rfile: rfile.write(text)
+    def readtext(self, path):
+        with open(path, 'rb') as rfile: return rfile.read()
+    def outpath(self, name):
+        return os.path.join(self.outputpath, '%s.txt' % name)
+
+    def test_separate(self):
+        dir = raws.dir(path=self.inputpath)
+        self.writetext(self.outpath('stale'), 'stale\n[A]')
+        self.writetext(os.path.join(self.outputpath, 'other.dat'), 'other')
+        dir.write(self.outputpath, incremental=True)
+        self.assertEqual(sorted(os.listdir(self.outputpath)), ['creature_a.txt', 'creature_b.txt', 'creature_c.txt', 'other.dat'])
+        # Unchanged files are copied along with their modification times
+        for name in ('creature_a', 'creature_b', 'creature_c'):
+            source, target = os.stat(os.path.join(self.inputpath, '%s.txt' % name)), os.stat(self.outpath(name))
+            self.assertEqual(source.st_size, target.st_size)
+            self.assertAlmostEqual(source.st_mtime, target.st_mtime, places=3)
+        # Up to date copies are skipped, which shows when one was changed without its size
+        # or modification time changing
+        mtime = os.stat(self.outpath('creature_a')).st_mtime
+        self.writetext(self.outpath('creature_a'), self.readtext(self.outpath('creature_a')).replace('CREATURE_A', 'CREATURE_X'))
+        os.utime(self.outpath('creature_a'), (mtime, mtime))
+        # A copy which isn't up to date is copied again
+        self.writetext(self.outpath('creature_b'), 'out of date')
+        # Changed files are written
+        dir.getobj('CREATURE:CREATURE_C').args[0] = 'CHANGED'
+        dir.write(self.outputpath, incremental=True)
+        self.assertIn('CREATURE_X', self.readtext(self.outpath('creature_a')))
+        self.assertEqual(self.readtext(self.outpath('creature_b')), self.readtext(os.path.join(self.inputpath, 'creature_b.txt')))
+        self.assertIn('[CREATURE:CHANGED]', self.readtext(self.outpath('creature_c')))
+        # Removed files are removed from the output
+        dir.removefile(rfile=dir.files['creature_b'])
+        dir.write(self.outputpath, incremental=True)
+        self.assertEqual(sorted(os.listdir(self.outputpath)), ['creature_a.txt', 'creature_c.txt', 'other.dat'])
+
+    def test_inplace(self):
+        # Writing incrementally to the input directory leaves unchanged files alone
+        dir = raws.dir(path=self.inputpath, lazy=True)
+        before = os.stat(os.path.join(self.inputpath, 'creature_a.txt'))
+        dir.files['creature_b'].root().add('[NAME:b]')
+        dir.write(self.inputpath, incremental=True)
+        after = os.stat(os.path.join(self.inputpath, 'creature_a.txt'))
+        self.assertEqual((before.st_ino, before.st_mtime), (after.st_ino, after.st_mtime))
+        self.assertFalse(dir.files['creature_a'].parsed)
+        self.assertIn('[NAME:b]', self.readtext(os.path.join(self.inputpath, 'creature_b.txt')))
+
+    def test_added(self):
+        # Files which weren't read from anywhere are always written
+        dir = raws.dir(path=self.inputpath)
+        dir.addfile(rfile=raws.file(header='creature_d', tokens=raws.token.parse('[OBJECT:CREATURE][CREATURE:D]')))
+        dir.write(self.outputpath, incremental=True)
+        self.assertEqual(self.readtext(self.outpath('creature_d')), 'creature_d\n[OBJECT:CREATURE][CREATURE:D]')
+        self.assertEqual(len(os.listdir(self.outputpath)), 4)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import random
+import unittest
+import raws
+
+
+
+# Values given to tokens in the generated raws, chosen so that there are objects of each
+# kind which property queries treat differently: those ending at the next token with the
+# same value, ITEM_ objects, and WORD and SYMBOL objects
+objectvalues = ('CREATURE', 'INORGANIC', 'ITEM_WEAPON', 'ITEM_ARMOR', 'WORD', 'SYMBOL')
+propvalues = ('NAME', 'TILE', 'COLOR', 'CASTE', 'COPY_TAGS_FROM', 'USE_MATERIAL_TEMPLATE', 'REACTION_CLASS')
+values = objectvalues + propvalues
+args = ('A', 'B', 'C', '1', '2')
+
+# Headers for the generated files along with the types of the objects in them
+filetypes = (
+    ('CREATURE', ('CREATURE',)),
+    ('INORGANIC', ('INORGANIC',)),
+    ('ITEM', ('ITEM_WEAPON', 'ITEM_ARMOR')),
+    ('LANGUAGE', ('WORD', 'SYMBOL')),
+)
+
+
+
+def randomtoken(rand, objecttypes=objectvalues):
+    # Get the text of a token with a random value and arguments
+    if rand.random() < 0.2:
+        return '%s:%s' % (rand.choice(objecttypes), rand.choice(args))
+    else:
+        return ':'.join([rand.choice(propvalues)] + [rand.choice(args) for i in xrange(rand.randint(0, 3))])
+
+def randomfile(rand, header, objecttypes):
+    # Get the text of a raws file containing random objects
+    tokens = ['OBJECT:%s' % header]
+    for obj in xrange(rand.randint(2, 12)):
+        tokens.append('%s:%s' % (rand.choice(objecttypes), rand.choice(args)))
+        for prop in xrange(rand.randint(0, 10)):
+            tokens.append(randomtoken(rand, objecttypes))
+    return '\n'.join('[%s]' % token for token in tokens)
+
+def randomdir(rand):
+    # Get a rawsdir containing some random files
+    dir = raws.dir()
+    for number in xrange(rand.randint(3, 6)):
+        header, objecttypes = rand.choice(filetypes)
+        dir.addfile(rfile=raws.file(header='%s_%d' % (header.lower(), number), tokens=raws.token.parse(randomfile(rand, header, objecttypes))))
+    return dir
+
+def mutate(rand, dir):
+    # Make some random change to the tokens in a rawsdir
+    tokens = list(dir.tokens())
+    token = rand.choice(tokens)
+    operation = rand.randint(0, 10)
+    if operation == 0:
+        token.value = rand.choice(values)
+    elif operation == 1:
+        token.add(randomtoken(rand), reverse=rand.random() < 0.5)
+    elif operation == 2:
+        token.add('[%s][%s][%s]' % (randomtoken(rand), randomtoken(rand), randomtoken(rand)), reverse=rand.random() < 0.5)
+    elif operation == 3:
+        if len(tokens) > 8: token.remove(count=rand.randint(0, 3), reverse=rand.random() < 0.5)
+    elif operation == 4:
+        token.args.append(rand.choice(args))
+    elif operation == 5:
+        if token.nargs(): token.args[rand.randint(0, token.nargs() - 1)] = rand.choice(args)
+    elif operation == 6:
+        token.args = [rand.choice(args) for i in xrange(rand.randint(0, 2))]
+    elif operation == 7:
+        if token.value in objectvalues: token.addprop(randomtoken(rand))
+    elif operation == 8:
+        # Many tokens added in one place use up the space between positions
+        for i in xrange(rand.randint(20, 40)): token.add(randomtoken(rand))
+    elif operation == 9:
+        header, objecttypes = rand.choice(filetypes)
+        name = 'added_%d' % rand.randint(0, 1 << 30)
+        dir.addfile(rfile=raws.file(header=name, tokens=raws.token.parse(randomfile(rand, header, objecttypes))))
+    elif operation == 10:
+        if len(dir.files) > 2: dir.removefile(rfile=rand.choice(dir.files.values()))
+
+
+
+def ids(tokens):
+    # Tokens compare by their text, so results are compared by identity instead
+    return [id(token) for token in tokens]
+
+def scan(tokens, predicate):
+    # Get the tokens matching some predicate by checking every one of them
+    return [token for token in tokens if predicate(token)]
+
+def scanobj(dir, type, id):
+    # Find an object by checking every token of every file which may contain it
+    headers = dir.getobjheadername(type)
+    for rfile in dir.files.itervalues():
+        root = rfile.root()
+        if root is not None and root.value == 'OBJECT' and root.nargs() == 1 and root.args[0] in headers:
+            for token in root.tokens():
+                if token.value == type and token.nargs() == 1 and token.args[0] == id: return token
+    return None
+
+def scanprops(obj):
+    # Get the properties of an object by checking every token up to where they end
+    if obj.value.startswith('ITEM_'):
+        ends = lambda token: token.value.startswith('ITEM_') and len(token.value) > 5
+    elif obj.value in ('WORD', 'SYMBOL'):
+        ends = lambda token: token.value in ('WORD', 'SYMBOL')
+    else:
+        ends = lambda token: token.value == obj.value
+    props = []
+    for token in obj.tokens():
+        if ends(token): break
+        props.append(token)
+    return props
+
+
+
+class testindex(unittest.TestCase):
+    '''Checks that queries answered using the index of each file give the same results
+    as checking every token, while tokens and files are randomly added, removed, and
+    changed.'''
+
+    seeds = xrange(6)
+    mutations = 300
+
+    def check(self, rand, dir):
+        tokens = list(dir.tokens())
+        for value in values:
+            expected = ids(scan(tokens, lambda token: token.value == value))
+            self.assertEqual(ids(dir.all(exact_value=value)), expected)
+            self.assertEqual(ids(dir.all(value)), expected)
+            first = dir.get(exact_value=value)
+            self.assertEqual(id(first) if first is not None else None, expected[0] if expected else None)
+            last = dir.getlast(exact_value=value)
+            self.assertEqual(id(last) if last is not None else None, expected[-1] if expected else None)
+        valuein = rand.sample(values, 3)
+        self.assertEqual(ids(dir.all(value_in=valuein)), ids(scan(tokens, lambda token: token.value in valuein)))
+        for arg in args:
+            self.assertEqual(ids(dir.all(args_contains=arg)), ids(scan(tokens, lambda token: arg in token.args)))
+            self.assertEqual(ids(dir.all(exact_arg=((0, arg),))), ids(scan(tokens, lambda token: token.nargs() and token.args[0] == arg)))
+        for rfile in dir.files.itervalues():
+            value = rand.choice(values)
+            self.assertEqual(ids(rfile.all(exact_value=value)), ids(scan(rfile.tokens(), lambda token: token.value == value)))
+        start = rand.choice(tokens)
+        value = rand.choice(values)
+        self.assertEqual(ids(start.all(exact_value=value)), ids(scan(start.tokens(), lambda token: token.value == value)))
+        for type in objectvalues:
+            for arg in args:
+                obj = dir.getobj(type, arg)
+                expected = scanobj(dir, type, arg)
+                self.assertEqual(id(obj) if obj is not None else None, id(expected) if expected is not None else None)
+        for obj in rand.sample(tokens, min(20, len(tokens))):
+            props = scanprops(obj)
+            for value in rand.sample(propvalues, 3) + [rand.choice(objectvalues)]:
+                expected = ids(scan(props, lambda token: token.value == value))
+                self.assertEqual(ids(obj.allprop(exact_value=value)), expected)
+                prop = obj.getprop(value)
+                self.assertEqual(id(prop) if prop is not None else None, expected[0] if expected else None)
+                prop = obj.getlastprop(exact_value=value)
+                self.assertEqual(id(prop) if prop is not None else None, expected[-1] if expected else None)
+            self.assertEqual(ids(obj.allprop()), ids(props))
+            aftervalues = ('COPY_TAGS_FROM', 'USE_MATERIAL_TEMPLATE') if obj.value == 'INORGANIC' else ('COPY_TAGS_FROM',)
+            expected = scan(props, lambda token: token.value in aftervalues)
+            addafter = raws.token.addafterqueries[obj.value == 'INORGANIC'].run(obj)
+            self.assertEqual(id(addafter) if addafter is not None else None, id(expected[-1]) if expected else None)
+        self.checkextents(dir)
+
+    def checkextents(self, dir):
+        # Check that every extent remembered by an index ends where the object's properties
+        # do, and that its summary includes the value of every one of those properties
+        for rfile in dir.files.itervalues():
+            if rfile.index is None: continue
+            for props, entries in rfile.index.extents.iteritems():
+                self.assertTrue(entries)
+                for key, (obj, end, bits) in entries.iteritems():
+                    self.assertEqual(key, id(obj))
+                    self.assertFalse(obj.removed)
+                    self.assertIs(obj.file, rfile)
+                    self.assertEqual(obj.argsprops(), props)
+                    objprops = scanprops(obj)
+                    expected = objprops[-1].next if objprops else obj.next
+                    self.assertIs(end, expected)
+                    for token in objprops: self.assertTrue(bits & rfile.index.bit(token.value))
+
+    def test_mutations(self):
+        for seed in self.seeds:
+            rand = random.Random(seed)
+            dir = randomdir(rand)
+            dir.indexargs()
+            self.check(rand, dir)
+            for mutation in xrange(self.mutations):
+                mutate(rand, dir)
+                if mutation % 10 == 0: self.check(rand, dir)
+            self.check(rand, dir)
+
+    def test_summaries(self):
+        # Changes to one object's properties leave the extents of other objects alone
+        rfile = raws.file(header='creature_test', tokens=raws.token.parse(
+            '[OBJECT:CREATURE][CREATURE:A][NAME:a][TILE:1][CREATURE:B][NAME:b][CREATURE:C][NAME:c]'
+        ))
+        a, b, c = rfile.all(exact_value='CREATURE')
+        for obj in (a, b, c): self.assertIsNone(obj.getprop('FLIER'))
+        entries = rfile.index.extents[a.argsprops()]
+        a.addprop('FLIER')
+        self.assertEqual(len(entries), 3)
+        self.assertIs(a.getprop('FLIER'), a.next)
+        b.getprop('NAME').setvalue('DESCRIPTION')
+        self.assertEqual(len(entries), 3)
+        self.assertIsNotNone(b.getprop('DESCRIPTION'))
+        a.add('CREATURE:D')
+        d = a.next
+        self.assertIs(entries[id(a)][1], d)
+        self.assertIsNone(a.getprop('FLIER'))
+        self.assertIsNotNone(d.getprop('FLIER'))
+        c.getprop('NAME').remove()
+        self.assertNotIn(id(c), entries)
+        self.assertIn(id(b), entries)
+        self.assertIsNone(c.getprop('NAME'))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+import raws
+from raws.manifest import filedigest
+
+
+
+class testmanifest(unittest.TestCase):
+    '''Checks that writing with a manifest records the hash of every file written,
+    skips files whose contents are unchanged, and that the manifest finds files
+    which were changed, removed, or added since.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.outputpath = os.path.join(self.path, 'out')
+        os.makedirs(self.outputpath)
+        self.dir = raws.dir()
+        for name in ('creature_a', 'creature_b', 'creature_c'):
+            self.dir.addfile(rfile=raws.file(header=name, tokens=raws.token.parse('[OBJECT:CREATURE][CREATURE:%s]' % name.upper())))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def outpath(self, name):
+        return os.path.join(self.outputpath, '%s.txt' % name)
+    def stats(self):
+        # Get the inode and modification time of every file written, which show whether it was written again
+        return {name: (os.stat(self.outpath(name)).st_ino, os.stat(self.outpath(name)).st_mtime) for name in self.dir.files}
+
+    def test_record(self):
+        self.dir.write(self.outputpath, manifest=True)
+        manifest = raws.manifest(self.outputpath)
+        self.assertEqual(sorted(manifest.files), ['creature_a.txt', 'creature_b.txt', 'creature_c.txt'])
+        for filename, (digest, size, mtime) in manifest.files.iteritems():
+            self.assertEqual(digest, filedigest(os.path.join(self.outputpath, filename)))
+            self.assertEqual(digest, self.dir.files[filename[:-4]].digest())
+        self.assertEqual(manifest.verify(), ([], [], []))
+
+    def test_skip(self):
+        self.dir.write(self.outputpath, manifest=True, threads=2)
+        before = self.stats()
+        # Files with changed tokens but the same text aren't written again
+        for rfile in self.dir.files.itervalues(): rfile.root().value = 'OBJECT'
+        self.dir.write(self.outputpath, manifest=True)
+        self.assertEqual(self.stats(), before)
+        self.assertEqual(os.listdir(self.outputpath).count('creature_a.txt.%d.tmp' % os.getpid()), 0)
+        # Files with changed text are
+        self.dir.getobj('CREATURE:CREATURE_B').args[0] = 'CHANGED'
+        self.dir.write(self.outputpath, manifest=True)
+        after = self.stats()
+        self.assertEqual([name for name in before if before[name] != after[name]], ['creature_b'])
+        with open(self.outpath('creature_b'), 'rb') as rfile: self.assertIn('[CREATURE:CHANGED]', rfile.read())
+        self.assertEqual(raws.manifest(self.outputpath).verify(), ([], [], []))
+        self.assertEqual(sorted(os.listdir(self.outputpath)), ['creature_a.txt', 'creature_b.txt', 'creature_c.txt', raws.manifest.filename])
+
+    def test_touched(self):
+        # A file which was changed since it was written is written again, even with the same digest
+        self.dir.write(self.outputpath, manifest=True)
+        with open(self.outpath('creature_a'), 'ab') as rfile: rfile.write('[EXTRA]')
+        self.assertEqual(raws.manifest(self.outputpath).verify(), ([], ['creature_a.txt'], []))
+        self.dir.write(self.outputpath, manifest=True)
+        with open(self.outpath('creature_a'), 'rb') as rfile: self.assertNotIn('[EXTRA]', rfile.read())
+        self.assertEqual(raws.manifest(self.outputpath).verify(), ([], [], []))
+
+    def test_verify(self):
+        self.dir.write(self.outputpath, manifest=True)
+        os.remove(self.outpath('creature_a'))
+        with open(self.outpath('creature_b'), 'wb') as rfile: rfile.write('changed')
+        with open(self.outpath('creature_d'), 'wb') as rfile: rfile.write('unexpected')
+        self.assertEqual(raws.manifest(self.outputpath).verify(), (['creature_a.txt'], ['creature_b.txt'], ['creature_d.txt']))
+
+    def test_removed(self):
+        # Files which no longer belong are removed and forgotten
+        self.dir.write(self.outputpath, manifest=True)
+        self.dir.removefile(rfile=self.dir.files['creature_c'])
+        self.dir.write(self.outputpath, manifest=True, atomic=True)
+        manifest = raws.manifest(self.outputpath)
+        self.assertEqual(sorted(manifest.files), ['creature_a.txt', 'creature_b.txt'])
+        self.assertFalse(os.path.exists(self.outpath('creature_c')))
+        self.assertEqual(manifest.verify(), ([], [], []))
+
+    def test_unreadable(self):
+        # A manifest which can't be read is treated as empty, so every file is written
+        self.dir.write(self.outputpath, manifest=True)
+        with open(os.path.join(self.outputpath, raws.manifest.filename), 'wb') as manifest: manifest.write('{not json')
+        self.assertEqual(raws.manifest(self.outputpath).files, {})
+        self.dir.write(self.outputpath, manifest=True)
+        self.assertEqual(len(raws.manifest(self.outputpath).files), 3)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import random
+import unittest
+import raws
+from tests.test_index import ids, randomfile, randomdir, scanobj, filetypes, objectvalues, args
+
+
+
+def scanall(dir, type, id=None):
+    # Find all objects of a type by checking every token of every file which may contain them
+    headers = dir.getobjheadername(type)
+    objs = []
+    for rfile in dir.files.itervalues():
+        root = rfile.root()
+        if root is not None and root.value == 'OBJECT' and root.nargs() == 1 and root.args[0] in headers:
+            for token in root.tokens():
+                if token.value == type and token.nargs() == 1 and (id is None or token.args[0] == id): objs.append(token)
+    return objs
+
+def randomobjfile(rand, name):
+    # Get a new rawsfile containing random objects
+    header, objecttypes = rand.choice(filetypes)
+    return raws.file(header=name, tokens=raws.token.parse(randomfile(rand, header, objecttypes)))
+
+def mutateobjects(rand, dir):
+    # Make some random change to the objects in a rawsdir or to the files containing them
+    objs = [token for token in dir.tokens() if token.value in objectvalues and token.nargs() == 1]
+    rfiles = dir.files.values()
+    operation = rand.randint(0, 10)
+    if operation == 0 and objs:
+        # Rename an object
+        rand.choice(objs).args[0] = rand.choice(args)
+    elif operation == 1 and objs:
+        # Change an object's type
+        rand.choice(objs).value = rand.choice(objectvalues)
+    elif operation == 2 and objs:
+        rand.choice(objs).remove()
+    elif operation == 3:
+        token = rand.choice(list(dir.tokens()))
+        token.add('%s:%s' % (rand.choice(objectvalues), rand.choice(args)), reverse=rand.random() < 0.5)
+    elif operation == 4:
+        # Files put straight into the dict belong to the directory all the same
+        name = 'assigned_%d' % rand.randint(0, 1 << 30)
+        dir.files[name] = randomobjfile(rand, name)
+    elif operation == 5:
+        name = 'set_%d' % rand.randint(0, 1 << 30)
+        dir.setfile(name, randomobjfile(rand, name))
+    elif operation == 6:
+        # Replace a file with another of the same name
+        name = rand.choice(dir.files.keys())
+        dir.files[name] = randomobjfile(rand, name)
+    elif operation == 7 and len(rfiles) > 2:
+        rfile = rand.choice(rfiles)
+        if rand.random() < 0.5:
+            dir.removefile(rfile=rfile)
+        else:
+            del dir.files[[name for name, other in dir.files.iteritems() if other is rfile][0]]
+    elif operation == 8:
+        # Changing the OBJECT token changes which objects the file is searched for
+        root = rand.choice(rfiles).root()
+        if root is not None and root.nargs() == 1: root.args[0] = rand.choice(filetypes)[0]
+    elif operation == 9 and len(rfiles) > 2:
+        name, rfile = dir.files.popitem(last=rand.random() < 0.5)
+    elif operation == 10:
+        dir.files = [(name, rfile) for name, rfile in reversed(dir.files.items())]
+
+
+
+class testobjects(unittest.TestCase):
+    '''Checks that looking up objects through the index on their type and id gives the
+    same results as checking every token, while objects and the files containing them
+    are randomly added, renamed, and removed.'''
+
+    seeds = xrange(8)
+    mutations = 150
+
+    def check(self, rand, dir):
+        for rfile in dir.files.itervalues(): self.assertIs(rfile.dir, dir)
+        for type in objectvalues:
+            self.assertEqual(ids(dir.allobj(type)), ids(scanall(dir, type)))
+            for id in args:
+                expected = scanall(dir, type, id)
+                obj = dir.getobj(type, id)
+                self.assertEqual(id if obj is None else obj.args[0], id)
+                self.assertIs(obj, scanobj(dir, type, id))
+                self.assertEqual(ids(dir.allobj('%s:%s' % (type, id))), ids(expected))
+            idin = rand.sample(args, 2)
+            self.assertEqual(ids(dir.allobj(type, id_in=idin)), ids([obj for obj in scanall(dir, type) if obj.args[0] in idin]))
+            self.assertEqual(ids(dir.allobj(type, re_id='[AB]')), ids([obj for obj in scanall(dir, type) if obj.args[0] in ('A', 'B')]))
+
+    def test_mutations(self):
+        for seed in self.seeds:
+            rand = random.Random(seed)
+            dir = randomdir(rand)
+            if seed % 2: dir.cachequeries()
+            self.check(rand, dir)
+            for mutation in xrange(self.mutations):
+                mutateobjects(rand, dir)
+                if mutation % 5 == 0: self.check(rand, dir)
+            self.check(rand, dir)
+
+    def test_assigned(self):
+        # A file put straight into the files dict after a lookup is found by the next one
+        dir = raws.dir()
+        dir.addfile(rfile=raws.file(header='reaction_a', tokens=raws.token.parse('[OBJECT:REACTION][REACTION:A]')))
+        self.assertIsNone(dir.getobj('REACTION:X'))
+        other = raws.dir()
+        rfile = other.addfile(rfile=raws.file(header='reaction_x', tokens=raws.token.parse('[OBJECT:REACTION][REACTION:X][NAME:x]')))
+        dir.files['reaction_x'] = rfile
+        self.assertIs(rfile.dir, dir)
+        self.assertIs(dir.getobj('REACTION:X'), dir.get('REACTION:X'))
+        self.assertEqual([str(obj) for obj in dir.allobj('REACTION')], ['[REACTION:A]', '[REACTION:X]'])
+        # Changes to the file are seen by queries remembered by the directory
+        dir.cachequeries()
+        self.assertEqual(len(dir.allobj('REACTION')), 2)
+        rfile.add('REACTION:Y')
+        self.assertEqual(len(dir.allobj('REACTION')), 3)
+        del dir.files['reaction_x']
+        self.assertIsNone(rfile.dir)
+        self.assertIsNone(dir.getobj('REACTION:X'))
+        self.assertEqual(len(dir.allobj('REACTION')), 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import gc
+import weakref
+import unittest
+import raws
+
+
+
+class testlinks(unittest.TestCase):
+    '''Checks that tokens stay linked to their neighbours for as long as anything
+    refers to them, and that the tokens of a discarded file are freed without the
+    help of the cyclic garbage collector.'''
+
+    def setUp(self):
+        self.gcenabled = gc.isenabled()
+        gc.disable()
+
+    def tearDown(self):
+        if self.gcenabled: gc.enable()
+
+    def test_added(self):
+        two = raws.token('TWO')
+        two.add('ONE', reverse=True)
+        self.assertEqual(str(two.prev), '[ONE]')
+        self.assertIs(two.prev.next, two)
+        two.add('THREE')
+        self.assertEqual([str(token) for token in two.prev.tokens(include_self=True)], ['[ONE]', '[TWO]', '[THREE]'])
+
+    def test_parsed(self):
+        tokens = raws.token.parse('[A][B][C]')
+        b = tokens[1]
+        del tokens
+        self.assertEqual(str(b.prev), '[A]')
+        self.assertEqual(str(b.next), '[C]')
+        self.assertIs(b.prev.next, b)
+
+    def test_file(self):
+        # Tokens of a file stay linked as long as the file is alive
+        rfile = raws.file(header='test', data='[A][B][C]')
+        b = rfile.root().next
+        self.assertIs(b.file, rfile)
+        self.assertEqual(str(b.prev), '[A]')
+        # Once the file is freed its tokens are unlinked from the ones before them, so
+        # that they're freed by reference counting
+        tokens = weakref.ref(rfile.root())
+        del rfile
+        self.assertIsNone(tokens())
+        self.assertIsNone(b.file)
+        self.assertIsNone(b.prev)
+        self.assertEqual(str(b.next), '[C]')
+
+    def test_freed(self):
+        dir = raws.dir()
+        rfile = dir.addfile(rfile=raws.file(header='test', data='[OBJECT:TEST]' + '[A:1][B:2]' * 20))
+        rfile.getindex()
+        refs = map(weakref.ref, rfile.tokens())
+        del rfile, dir
+        self.assertEqual([ref for ref in refs if ref() is not None], [])
+
+    def test_moved(self):
+        # Tokens given to another file aren't unlinked when the first file is freed
+        first = raws.file(header='first', data='[A][B][C]')
+        tokens = list(first.tokens())
+        second = raws.file(header='second', tokens=tokens)
+        del first, tokens
+        self.assertEqual([str(token) for token in second.tokens()], ['[A]', '[B]', '[C]'])
+        self.assertEqual(str(second.tail().prev), '[B]')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
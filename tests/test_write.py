@@ -0,0 +1,149 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import raws
+
+
+
+# Raws bundled with the scripts, which are read and written back in these tests
+bundledroot = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+
+def bundleddirs():
+    # Get the directories of bundled raws which can be read as a rawsdir and contain tokens
+    dirs = []
+    for dirpath, dirnames, filenames in os.walk(bundledroot):
+        dirnames.sort()
+        if any(filename.endswith('.txt') for filename in filenames):
+            try:
+                dir = raws.dir(path=dirpath)
+            except ValueError:
+                continue
+            if dir.get() is not None: dirs.append(dirpath)
+    return dirs
+
+def readtexts(path, dir=None):
+    # Get the contents of every raws file in a directory. If dir is given, only files
+    # containing tokens are included, since text files without any, such as readmes,
+    # are written back with only their header line.
+    texts = {}
+    for filename in os.listdir(path):
+        if filename.endswith('.txt'):
+            if dir is not None and dir.files[os.path.splitext(filename)[0]].root() is None: continue
+            with open(os.path.join(path, filename), 'rb') as rfile: texts[filename] = rfile.read()
+    return texts
+
+def rendered(dir):
+    # Get the text each file should be written as, put together from its tokens one by
+    # one without relying on the text they were parsed from
+    return {
+        '%s.txt' % name: rfile.headertext() + ''.join(repr(token) for token in rfile.tokens())
+        for name, rfile in dir.files.iteritems() if rfile.root() is not None
+    }
+
+def edit(rand, dir):
+    # Make some random change to the tokens in a rawsdir
+    tokens = list(dir.tokens())
+    token = rand.choice(tokens)
+    operation = rand.randint(0, 8)
+    if operation == 0:
+        token.value = rand.choice(('NAME', 'TILE', 'COLOR', token.value))
+    elif operation == 1:
+        token.args = [rand.choice(('A', 'B', '1', '2')) for i in xrange(rand.randint(0, 3))]
+    elif operation == 2:
+        if token.nargs(): token.args[rand.randint(0, token.nargs() - 1)] = 'EDITED'
+    elif operation == 3:
+        token.prefix = rand.choice(('', '\n', '\n    ', ' comment '))
+    elif operation == 4:
+        token.suffix = rand.choice(('', '\n', ' trailing'))
+    elif operation == 5:
+        token.add('[ADDED:%d]' % rand.randint(0, 99), reverse=rand.random() < 0.5)
+    elif operation == 6:
+        if len(tokens) > 4: token.remove(count=rand.randint(0, 2), reverse=rand.random() < 0.5)
+    elif operation == 7:
+        token.add(raws.token(value='PRETTY', prefix='\n\t', suffix=' x'))
+    elif operation == 8:
+        rfile = rand.choice(dir.files.values())
+        rfile.header = rfile.header + '_renamed' if rand.random() < 0.2 else rfile.header
+
+
+
+class testwrite(unittest.TestCase):
+    '''Checks that raws are written back exactly as they were read when they aren't
+    changed, and exactly as their tokens say after random edits, even though text
+    which wasn't changed is copied from what was read rather than put together again.'''
+
+    seeds = xrange(3)
+    edits = 60
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.dirs = bundleddirs()
+        self.assertTrue(self.dirs)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def written(self, dir, **kwargs):
+        outpath = os.path.join(self.path, 'out')
+        if os.path.exists(outpath): shutil.rmtree(outpath)
+        os.makedirs(outpath)
+        dir.write(outpath, **kwargs)
+        return readtexts(outpath, dir)
+
+    def test_untouched(self):
+        for dirpath in self.dirs:
+            dir = raws.dir(path=dirpath)
+            original = readtexts(dirpath, dir)
+            self.assertEqual(self.written(dir), original)
+            self.assertEqual(self.written(dir, threads=3), original)
+            self.assertEqual(self.written(raws.dir(path=dirpath, lazy=True)), original)
+            for name, rfile in dir.files.iteritems():
+                if rfile.root() is not None: self.assertEqual(rfile.headertext() + rfile.body(), original['%s.txt' % name])
+
+    def test_edited(self):
+        for seed in self.seeds:
+            rand = random.Random(seed)
+            for dirpath in self.dirs:
+                dir = raws.dir(path=dirpath, lazy=rand.random() < 0.5)
+                for number in xrange(self.edits):
+                    edit(rand, dir)
+                    if number % 20 == 0: self.assertEqual(self.written(dir), rendered(dir))
+                self.assertEqual(self.written(dir), rendered(dir))
+                # What was written reads back as the same tokens
+                reread = raws.dir(path=os.path.join(self.path, 'out'))
+                for name, rfile in dir.files.iteritems():
+                    self.assertEqual(
+                        [str(token) for token in reread.files[name].tokens()],
+                        [str(token) for token in rfile.tokens()]
+                    )
+
+    def test_buffers(self):
+        # Small buffers are filled by pieces both bigger and smaller than them
+        rand = random.Random(0)
+        for dirpath in self.dirs:
+            dir = raws.dir(path=dirpath)
+            for number in xrange(10): edit(rand, dir)
+            expected = rendered(dir)
+            for name, rfile in dir.files.iteritems():
+                for buffersize in (1, 7, 4096):
+                    stream = bufferstream()
+                    rfile.write(stream, buffersize=buffersize)
+                    self.assertEqual(stream.getvalue(), expected['%s.txt' % name])
+
+
+
+class bufferstream(object):
+    # File-like object which accepts both strings and buffers, as real files do
+    def __init__(self):
+        self.pieces = []
+    def write(self, text):
+        self.pieces.append(str(text))
+    def getvalue(self):
+        return ''.join(self.pieces)
+
+
+
+if __name__ == '__main__':
+    unittest.main()